@@ -1,12 +1,31 @@
 from datetime import date
+from typing import Any
+from typing import Dict
+
 from google.adk.agents import Agent
+from google.adk.agents.readonly_context import ReadonlyContext
 from google.adk.tools import load_artifacts
 from google.genai import types
 from MarketingAgent.tools import call_image_editing_agent
 from MarketingAgent.tools import call_image_generation_agent
+from MarketingAgent.tools import check_jobs
+from MarketingAgent.tools import get_usage_summary
+from MarketingAgent.tools import search_assets
+from MarketingAgent.tools import start_ad_copy
+from MarketingAgent.assistants.generation.tools import reuse_image
+from MarketingAgent.brand import brand_registry
+from MarketingAgent.brand import current_brand
 from MarketingAgent.config import GeminiModelOptions
-
-date_today = date.today().strftime("%B %d, %Y")
+from MarketingAgent.config import config
+from MarketingAgent.copy_cache import serve_cached_ad_copy
+from MarketingAgent.copy_cache import store_ad_copy
+from MarketingAgent.deadlines import bind_turn_deadline
+from MarketingAgent.history import compact_history
+from MarketingAgent.jobs import deliver_job_notifications
+from MarketingAgent.ledger import bind_usage_scope
+from MarketingAgent.ledger import enforce_budget
+from MarketingAgent.models import MeteredGemini
+from MarketingAgent.parallel import enable_parallel_function_calls
 
 # CLIENT CONFIGURATION TEMPLATE
 CLIENT_CONFIG = {
@@ -41,9 +60,22 @@ CLIENT_CONFIG = {
     ]
 }
 
-root_agent_instruction = f"""
+brand_registry.register("client", CLIENT_CONFIG)
+
+# Several image requests in one response render side by side
+enable_parallel_function_calls()
+
+
+# Added to the orchestration guidance when the ad copy cache is on.
+AD_COPY_CACHE_STEP = """
+- For new ad copy, once the user has confirmed the brief: Call start_ad_copy with it, then write the copy. Pass regenerate=True when the user asks for a new or different version. Improvements of existing copy do not need start_ad_copy"""
+
+
+def render_root_agent_instruction(client: Dict[str, Any]) -> str:
+    """Render the root agent's instruction for a client configuration."""
+    return f"""
 <agent_identity>
-An experienced marketing assistant with expertise in image generation, editing, and strategic ad copywriting for {CLIENT_CONFIG['client_name']}.
+An experienced marketing assistant with expertise in image generation, editing, and strategic ad copywriting for {client['client_name']}.
 </agent_identity>
 
 <core_capabilities>
@@ -56,14 +88,21 @@ An experienced marketing assistant with expertise in image generation, editing,
     - Use the provided guidelines to structure and refine ad copy.
 - Call specialized agents for image generation and editing tasks
 - Provide current date and time information
+- Report token, image and cost usage for this session and tenant with get_usage_summary
+- Run image generation and edits in the background so the user can keep working, and check on them with check_jobs
 - Assist with comprehensive marketing strategy and execution
 </core_capabilities>
 
 <agent_orchestration>
 When handling requests:
-- For image generation: Call call_image_generation_agent with detailed prompts
+- For image generation: Call call_image_generation_agent with detailed prompts, passing the channel (e.g. social, banner, email) when known
+- For icons, badges and widgets: Call call_image_generation_agent too; it draws them as SVG
+- For images made earlier (e.g. "the beach image from last week"): Call search_assets, then reuse_image with the chosen node_id instead of generating the image again
 - For image editing: Call call_image_editing_agent with specific edit instructions
-- For ad copy: Handle directly using guidelines below
+- For several alternative edits of one image (e.g. A/B tests): Call call_image_editing_agent once, listing every variant in the prompt
+- For undoing edits or returning to an earlier version: Call call_image_editing_agent and ask it to revert, rather than regenerating the image
+- When the user wants to keep working (e.g. on ad copy) while an image renders: Pass background=True, share the job id, and continue with the user's next request. Finished jobs are reported to you; pass their artifact filenames on to the user
+- For ad copy: Handle directly using guidelines below{AD_COPY_CACHE_STEP if config.AD_COPY_CACHE else ""}
 - For complex projects: Coordinate multiple agents as needed
 </agent_orchestration>
 
@@ -221,17 +260,16 @@ Beyond specialized tasks, I can help with:
 </general_assistance>
 """
 
-global_instruction = f"""
-<TODAYS_DATE>
-Today's date is {date_today}.
-</TODAYS_DATE>
 
+def render_global_instruction(client: Dict[str, Any]) -> str:
+    """Render the brand voice instruction shared by all agents for a client configuration."""
+    return f"""
 <brand_identity>
-You are writing as {CLIENT_CONFIG['client_name']}, {CLIENT_CONFIG['industry']}. Your mission is {CLIENT_CONFIG['mission']}.
+You are writing as {client['client_name']}, {client['industry']}. Your mission is {client['mission']}.
 </brand_identity>
 
 <brand_voice>
-Write with a {', '.join(CLIENT_CONFIG['brand_voice_attributes'])} voice that:
+Write with a {', '.join(client['brand_voice_attributes'])} voice that:
 - Shows expertise without intimidation
 - Puts customer needs first
 - Focuses on practical solutions
@@ -253,17 +291,17 @@ Professional and helpful. Be confident but not arrogant. Stay encouraging and so
 
 <core_messaging>
 <key_concepts>
-{chr(10).join([f"- {msg}" for msg in CLIENT_CONFIG['key_messaging']])}
+{chr(10).join([f"- {msg}" for msg in client['key_messaging']])}
 </key_concepts>
 </core_messaging>
 
 <language_rules>
 <use_these_phrases>
-{chr(10).join([f"- \"{phrase}\"" for phrase in CLIENT_CONFIG['preferred_phrases']])}
+{chr(10).join([f"- \"{phrase}\"" for phrase in client['preferred_phrases']])}
 </use_these_phrases>
 
 <avoid_these_phrases>
-{chr(10).join([f"- \"{phrase}\"" for phrase in CLIENT_CONFIG['avoided_phrases']])}
+{chr(10).join([f"- \"{phrase}\"" for phrase in client['avoided_phrases']])}
 </avoid_these_phrases>
 
 <writing_style>
@@ -273,7 +311,7 @@ DO:
 - Include specific, actionable advice
 - Explain technical terms when needed
 - Show genuine enthusiasm for the industry
-- Reference "{CLIENT_CONFIG['team_reference']}" team members positively
+- Reference "{client['team_reference']}" team members positively
 
 DON'T:
 - Use intimidating technical jargon
@@ -286,7 +324,7 @@ DON'T:
 
 <content_examples>
 <good_example>
-"Get the reliable performance you need with our {{PRODUCT_NAME}}. Designed for {{TARGET_CUSTOMER}} who want {{KEY_BENEFIT}}, these {{PRODUCTS}} are {{EASE_OF_USE}} and backed by our {{WARRANTY_TERMS}}. Our {CLIENT_CONFIG['team_reference']} can help you find the right fit for your needs."
+"Get the reliable performance you need with our {{PRODUCT_NAME}}. Designed for {{TARGET_CUSTOMER}} who want {{KEY_BENEFIT}}, these {{PRODUCTS}} are {{EASE_OF_USE}} and backed by our {{WARRANTY_TERMS}}. Our {client['team_reference']} can help you find the right fit for your needs."
 </good_example>
 
 <bad_example>
@@ -300,7 +338,7 @@ Professional, informative, solution-focused. Balance technical accuracy with acc
 </website>
 
 <social_media>
-Visual how-tos, {CLIENT_CONFIG['team_reference']} stories, industry lifestyle content. Keep approachable and community-focused.
+Visual how-tos, {client['team_reference']} stories, industry lifestyle content. Keep approachable and community-focused.
 </social_media>
 
 <customer_service>
@@ -309,12 +347,54 @@ Patient and helpful. Focus on problem-solving and building customer confidence.
 </channel_specific>
 """
 
+
+def root_agent_instruction(context: ReadonlyContext) -> str:
+    """Instruction provider rendering the root agent's instruction for the tenant's brand."""
+    brand = current_brand(context)
+    return brand.memo(
+        "root_agent_instruction", lambda: render_root_agent_instruction(brand.section("client"))
+    )
+
+
+def global_instruction(context: ReadonlyContext) -> str:
+    """Global instruction provider with today's date and the tenant's brand voice.
+
+    The date is rendered on every call, so it is right after midnight too.
+    """
+    brand = current_brand(context)
+    brand_instruction = brand.memo(
+        "global_instruction", lambda: render_global_instruction(brand.section("client"))
+    )
+    today = date.today().strftime("%B %d, %Y")
+    return f"\n<TODAYS_DATE>\nToday's date is {today}.\n</TODAYS_DATE>\n{brand_instruction}"
+
+
 root_agent = Agent(
-    model=GeminiModelOptions.GEMINI_2_5_PRO,
+    model=MeteredGemini(model=GeminiModelOptions.GEMINI_2_5_PRO),
     name="root_agent",
     instruction=root_agent_instruction,
     description=f"A marketing assistant for {CLIENT_CONFIG['client_name']} that helps with various tasks, including PNG and SVG image generation and image editing.",
     global_instruction=global_instruction,
-    tools=[call_image_generation_agent, call_image_editing_agent, load_artifacts],
+    tools=[
+        call_image_generation_agent,
+        call_image_editing_agent,
+        get_usage_summary,
+        check_jobs,
+        search_assets,
+        reuse_image,
+        load_artifacts,
+        # Offered only with the cache on; it costs a model round trip per new copy.
+        *([start_ad_copy] if config.AD_COPY_CACHE else []),
+    ],
     generate_content_config=types.GenerateContentConfig(temperature=0.01),
+    before_model_callback=[
+        bind_usage_scope,
+        # Before any callback that calls a model, e.g. the history summarizer.
+        enforce_budget,
+        bind_turn_deadline,
+        serve_cached_ad_copy,
+        deliver_job_notifications,
+        compact_history,
+    ],
+    after_model_callback=store_ad_copy,
 )
\ No newline at end of file
@@ -0,0 +1,307 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Optional
+
+from google.adk.artifacts import BaseArtifactService
+from google.genai import types
+
+from MarketingAgent.config import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    mime_type TEXT,
+    is_text INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (app_name, user_id, session_id, filename, version)
+);
+CREATE INDEX IF NOT EXISTS artifacts_digest ON artifacts (digest);
+CREATE INDEX IF NOT EXISTS artifacts_created_at ON artifacts (created_at);
+"""
+
+# Artifacts with this prefix are shared by all sessions of a user.
+_USER_NAMESPACE = "user:"
+_USER_SESSION = "user"
+
+
+class LocalArtifactService(BaseArtifactService):
+    """Artifact service that keeps versioned artifacts on local disk.
+
+    Artifact bytes are stored once per content digest under ``blobs/`` and
+    indexed in SQLite, so the server heap only holds an image while a request
+    is using it and artifacts survive restarts. A blob is written while its
+    index row's write transaction is open, and `apply_retention` holds the
+    same lock, so retention never removes a blob whose row is about to commit.
+
+    Args:
+        root_dir: Directory holding the index and blobs.
+        max_versions: Number of versions kept per artifact, unset keeps all.
+        max_age_days: Age after which versions are pruned, unset keeps all.
+    """
+
+    def __init__(
+        self,
+        root_dir: str = config.ARTIFACT_STORE_DIR,
+        max_versions: Optional[int] = config.ARTIFACT_MAX_VERSIONS,
+        max_age_days: Optional[float] = config.ARTIFACT_MAX_AGE_DAYS,
+    ):
+        self.root_dir = Path(root_dir)
+        self.blob_dir = self.root_dir / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root_dir / "index.db"
+        self.max_versions = max_versions
+        self.max_age_days = max_age_days
+
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per operation keeps the service safe across threads and
+        # across worker processes sharing the same directory.
+        return sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _session_key(session_id: str, filename: str) -> str:
+        return _USER_SESSION if filename.startswith(_USER_NAMESPACE) else session_id
+
+    def blob_path(self, digest: str) -> Path:
+        """Path of the blob holding the bytes with the given SHA-256 digest."""
+        return self.blob_dir / digest[:2] / digest
+
+    def _write_blob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if path.exists():
+            return digest
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+        return digest
+
+    def _read_blob(self, digest: str) -> bytes:
+        # types.Blob needs real bytes, so the file is read into one.
+        return self.blob_path(digest).read_bytes()
+
+    def _save(
+        self, app_name: str, user_id: str, session_id: str, filename: str, artifact: types.Part
+    ) -> int:
+        if artifact.inline_data is not None:
+            data = artifact.inline_data.data or b""
+            mime_type = artifact.inline_data.mime_type
+            is_text = 0
+        elif artifact.text is not None:
+            data = artifact.text.encode("utf-8")
+            mime_type = "text/plain"
+            is_text = 1
+        else:
+            raise ValueError("Only inline data and text artifacts are supported.")
+
+        session_key = self._session_key(session_id, filename)
+
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Under the write lock, so retention cannot see the blob unreferenced.
+                digest = self._write_blob(data)
+                (latest,) = connection.execute(
+                    "SELECT MAX(version) FROM artifacts"
+                    " WHERE app_name = ? AND user_id = ? AND session_id = ? AND filename = ?",
+                    (app_name, user_id, session_key, filename),
+                ).fetchone()
+                version = 0 if latest is None else latest + 1
+                connection.execute(
+                    "INSERT INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        app_name,
+                        user_id,
+                        session_key,
+                        filename,
+                        version,
+                        digest,
+                        mime_type,
+                        is_text,
+                        len(data),
+                        time.time(),
+                    ),
+                )
+                if self.max_versions is not None:
+                    connection.execute(
+                        "DELETE FROM artifacts WHERE app_name = ? AND user_id = ?"
+                        " AND session_id = ? AND filename = ? AND version <= ?",
+                        (app_name, user_id, session_key, filename, version - self.max_versions),
+                    )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+        return version
+
+    def _load(
+        self,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        filename: str,
+        version: Optional[int],
+    ) -> Optional[types.Part]:
+        query = (
+            "SELECT digest, mime_type, is_text FROM artifacts"
+            " WHERE app_name = ? AND user_id = ? AND session_id = ? AND filename = ?"
+        )
+        params = [app_name, user_id, self._session_key(session_id, filename), filename]
+        if version is None:
+            query += " ORDER BY version DESC LIMIT 1"
+        else:
+            query += " AND version = ?"
+            params.append(version)
+
+        with closing(self._connect()) as connection:
+            row = connection.execute(query, params).fetchone()
+        if row is None:
+            return None
+
+        digest, mime_type, is_text = row
+        try:
+            data = self._read_blob(digest)
+        except FileNotFoundError:
+            print(f"Artifact blob missing for {filename} version {version}: {digest}")
+            return None
+
+        if is_text:
+            return types.Part.from_text(text=data.decode("utf-8"))
+        return types.Part.from_bytes(data=data, mime_type=mime_type)
+
+    def _list_keys(self, app_name: str, user_id: str, session_id: str) -> list[str]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT DISTINCT filename FROM artifacts"
+                " WHERE app_name = ? AND user_id = ? AND session_id IN (?, ?)"
+                " ORDER BY filename",
+                (app_name, user_id, session_id, _USER_SESSION),
+            ).fetchall()
+        return [filename for (filename,) in rows]
+
+    def _delete(self, app_name: str, user_id: str, session_id: str, filename: str) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "DELETE FROM artifacts WHERE app_name = ? AND user_id = ?"
+                " AND session_id = ? AND filename = ?",
+                (app_name, user_id, self._session_key(session_id, filename), filename),
+            )
+
+    def _list_versions(
+        self, app_name: str, user_id: str, session_id: str, filename: str
+    ) -> list[int]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT version FROM artifacts WHERE app_name = ? AND user_id = ?"
+                " AND session_id = ? AND filename = ? ORDER BY version",
+                (app_name, user_id, self._session_key(session_id, filename), filename),
+            ).fetchall()
+        return [version for (version,) in rows]
+
+    def apply_retention(self) -> int:
+        """Prune versions older than `max_age_days` and unreferenced blobs.
+
+        Blobs of versions dropped by `max_versions` are reclaimed here too.
+        The index's write lock is held throughout, so saves in this and other
+        processes wait instead of racing the cleanup.
+
+        Returns:
+            The number of blob files removed from disk.
+        """
+        removed = 0
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if self.max_age_days is not None:
+                    cutoff = time.time() - self.max_age_days * 86400
+                    connection.execute("DELETE FROM artifacts WHERE created_at < ?", (cutoff,))
+                referenced = {
+                    digest for (digest,) in connection.execute("SELECT DISTINCT digest FROM artifacts")
+                }
+                for path in self.blob_dir.glob("*/*"):
+                    if path.name.startswith(".tmp-") or path.name in referenced:
+                        continue
+                    path.unlink(missing_ok=True)
+                    removed += 1
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return removed
+
+    async def run_retention(self, interval_seconds: float) -> None:
+        """Apply retention every `interval_seconds` until cancelled."""
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.apply_retention)
+                if removed:
+                    print(f"Artifact retention removed {removed} blobs")
+            except Exception as e:
+                print(f"Error applying artifact retention: {e}")
+            await asyncio.sleep(interval_seconds)
+
+    async def save_artifact(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        filename: str,
+        artifact: types.Part,
+    ) -> int:
+        return await asyncio.to_thread(
+            self._save, app_name, user_id, session_id, filename, artifact
+        )
+
+    async def load_artifact(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        filename: str,
+        version: Optional[int] = None,
+    ) -> Optional[types.Part]:
+        return await asyncio.to_thread(
+            self._load, app_name, user_id, session_id, filename, version
+        )
+
+    async def list_artifact_keys(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> list[str]:
+        return await asyncio.to_thread(self._list_keys, app_name, user_id, session_id)
+
+    async def delete_artifact(
+        self, *, app_name: str, user_id: str, session_id: str, filename: str
+    ) -> None:
+        await asyncio.to_thread(self._delete, app_name, user_id, session_id, filename)
+
+    async def list_versions(
+        self, *, app_name: str, user_id: str, session_id: str, filename: str
+    ) -> list[int]:
+        return await asyncio.to_thread(
+            self._list_versions, app_name, user_id, session_id, filename
+        )
@@ -1,4 +1,35 @@
+import hashlib
+import os
+import tempfile
 from pathlib import Path
+from typing import Optional
+
+from google.adk.tools import ToolContext
+from google.genai import types
+
+from MarketingAgent.ledger import current_scope
+
+# Hex digits of the content digest that end every generated filename.
+FILENAME_DIGEST_LENGTH = 8
+
+
+def artifact_filename(prefix: str, prompt: str, content: bytes, extension: str = "png") -> str:
+    """The cache and artifact filename of a generated or edited image.
+
+    The name starts with the first 30 characters of the prompt, for people,
+    and ends with a digest of the content. Parallel calls with similar
+    prompts thus never overwrite each other's cache files or artifacts, and
+    a name always refers to the same bytes.
+
+    Args:
+        prefix: What made the content, e.g. "generated_image".
+        prompt: The prompt it was made with.
+        content: The image bytes.
+        extension: The file extension.
+    """
+    sanitized_prompt = "".join(c if c.isalnum() else "_" for c in prompt[:30])
+    digest = hashlib.sha256(content).hexdigest()[:FILENAME_DIGEST_LENGTH]
+    return f"{prefix}_{sanitized_prompt}_{digest}.{extension}"
 
 
 def save_image_to_cache(
@@ -6,6 +37,9 @@ def save_image_to_cache(
 ) -> str:
     """Save image bytes to a cache directory for easier future access.
 
+    The file is written under a temporary name and renamed into place, so
+    other server workers sharing the cache never read a partial image.
+
     Args:
         image_bytes: The raw binary image data to save
         filename: The name to give the saved file
@@ -20,10 +54,45 @@ def save_image_to_cache(
     file_path = cache_path / filename
 
     try:
-        with open(file_path, "wb") as f:
-            f.write(image_bytes)
+        fd, temp_path = tempfile.mkstemp(dir=cache_path, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(image_bytes)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
         return str(file_path)
 
     except Exception as e:
         print(f"Error saving image to cache: {e}")
         return ""
+
+
+async def load_session_artifact(
+    tool_context: ToolContext, filename: str
+) -> Optional[types.Part]:
+    """Load an artifact of the user's session from inside a sub-agent tool.
+
+    Sub-agents run in throwaway sessions, so artifacts the user uploaded are
+    looked up in the root session bound to `current_scope` first.
+
+    Args:
+        tool_context: The tool execution context.
+        filename: The artifact filename.
+
+    Returns:
+        The latest version of the artifact, or None if it does not exist.
+    """
+    scope = current_scope.get()
+    invocation_context = getattr(tool_context, "_invocation_context", None)
+    if scope is not None and invocation_context is not None and invocation_context.artifact_service:
+        artifact = await invocation_context.artifact_service.load_artifact(
+            app_name=scope.app_name,
+            user_id=scope.user_id,
+            session_id=scope.session_id,
+            filename=filename,
+        )
+        if artifact is not None:
+            return artifact
+    return await tool_context.load_artifact(filename)
@@ -1,16 +1,30 @@
 from google.adk.agents import Agent
+from google.adk.agents.readonly_context import ReadonlyContext
 
+from MarketingAgent.assistants.editing.tools import diff_images
 from MarketingAgent.assistants.editing.tools import edit_image  # noqa: F401
+from MarketingAgent.assistants.editing.tools import edit_image_variants
 from MarketingAgent.assistants.editing.tools import free_edit_image  # noqa: F401
+from MarketingAgent.assistants.editing.tools import list_image_lineage
+from MarketingAgent.assistants.editing.tools import probe_edit_model
+from MarketingAgent.assistants.editing.tools import revert_image
+from MarketingAgent.brand import current_brand
 from MarketingAgent.config import GeminiModelOptions
+from MarketingAgent.config import config
+from MarketingAgent.deadlines import enforce_deadline
+from MarketingAgent.ledger import enforce_budget
+from MarketingAgent.models import MeteredGemini
 
-# CLIENT CONFIGURATION
+# CLIENT CONFIGURATION, used until the brand configuration overrides it
 CLIENT_NAME = "{CLIENT_NAME}"
 CLIENT_INDUSTRY = "{CLIENT_INDUSTRY}"
 
-image_editing_instruction = f"""
+
+def render_image_editing_instruction(client_name: str, client_industry: str) -> str:
+    """Render the image editing agent's instruction for a client."""
+    return f"""
 <agent_identity>
-You are a specialized image editing assistant for {CLIENT_NAME}, focused on enhancing and modifying visual content for {CLIENT_INDUSTRY} marketing purposes.
+You are a specialized image editing assistant for {client_name}, focused on enhancing and modifying visual content for {client_industry} marketing purposes.
 </agent_identity>
 
 <core_mission>
@@ -32,6 +46,11 @@ Use the 'edit_image' tool when:
 - Precise element replacement or enhancement
 - Selective editing while preserving background
 - User mentions editing particular items or objects
+
+Choose its modes to match the request:
+- edit_mode: EDIT_MODE_INPAINT_INSERTION to add or change objects (default), EDIT_MODE_INPAINT_REMOVAL to remove them, EDIT_MODE_BGSWAP with mask_mode MASK_MODE_BACKGROUND to replace the background of a product shot
+- mask_mode: MASK_MODE_FOREGROUND (default) or MASK_MODE_BACKGROUND to find the area automatically
+- If the user supplies a mask image, pass it as mask_filename; it is stored, so later edits of the same image can use mask_mode MASK_MODE_USER_PROVIDED without it
 </masked_editing>
 
 <free_form_editing>
@@ -41,12 +60,30 @@ Use the 'free_edit_image' tool when:
 - Global color adjustments or mood changes
 - Image-wide transformations or enhancements
 </free_form_editing>
+
+<variant_editing>
+Use the 'edit_image_variants' tool when:
+- The user wants several alternative edits of the same image, e.g. to A/B test "red background" vs "blue background" vs "sunset"
+- Pass one prompt per variant, with free_form=True for whole-image changes; this is faster than calling the other edit tools once per variant
+</variant_editing>
+
+<version_history>
+Every edit is recorded with its source image, so earlier versions can be restored instantly without re-editing:
+- Use 'list_image_lineage' to show an image's edit history and the branches edited from it
+- Use 'diff_images' to compare two versions by their edits and pixel changes
+- Use 'revert_image' when the user wants to undo edits or "go back" N steps, instead of re-editing or regenerating
+- To branch from an earlier version, edit its node_id or the filename returned by 'revert_image'
+</version_history>
+
+<background_jobs>
+If the request asks to run in the background, call 'edit_image', 'free_edit_image' or 'edit_image_variants' with run_in_background=True and report the returned job id instead of an image.
+</background_jobs>
 </tool_selection_logic>
 
 <quality_assurance>
-- Maintain {CLIENT_NAME}'s visual brand standards
+- Maintain {client_name}'s visual brand standards
 - Preserve image quality during editing process
-- Ensure edits align with {CLIENT_INDUSTRY} industry expectations
+- Ensure edits align with {client_industry} industry expectations
 - Apply brand colors and styling consistently
 - Verify final output meets marketing objectives
 </quality_assurance>
@@ -68,10 +105,71 @@ Use the 'free_edit_image' tool when:
 </interaction_guidelines>
 """
 
+
+def image_editing_instruction(context: ReadonlyContext) -> str:
+    """Instruction provider rendering the image editing agent's instruction for the tenant's brand."""
+    brand = current_brand(context)
+    client = brand.section("client")
+    instruction = brand.memo(
+        "image_editing_instruction",
+        lambda: render_image_editing_instruction(
+            client.get("client_name", CLIENT_NAME), client.get("industry", CLIENT_INDUSTRY)
+        ),
+    )
+    return instruction + _unavailable_notice
+
+
 image_editing_agent = Agent(
-    model=GeminiModelOptions.GEMINI_2_0_FLASH,
+    model=MeteredGemini(model=GeminiModelOptions.GEMINI_2_0_FLASH),
     name="image_editing_agent",
     instruction=image_editing_instruction,
     description=f"A specialized image editing assistant for {CLIENT_NAME} that provides precision visual modifications while maintaining brand consistency in {CLIENT_INDUSTRY} marketing materials.",
-    tools=[free_edit_image, edit_image],
-)
\ No newline at end of file
+    tools=[
+        free_edit_image,
+        edit_image,
+        edit_image_variants,
+        list_image_lineage,
+        diff_images,
+        revert_image,
+    ],
+    before_model_callback=[enforce_deadline, enforce_budget],
+)
+
+# Tools that call the Imagen edit model.
+EDIT_MODEL_TOOLS = (free_edit_image, edit_image, edit_image_variants)
+
+EDITING_UNAVAILABLE_INSTRUCTION = """
+<editing_unavailable>
+The Imagen edit model is not available to this project ({reason}), so the 'edit_image', 'free_edit_image' and 'edit_image_variants' tools are disabled.
+Tell the user that image edits cannot be made right now, and suggest generating a new image with the requested changes instead.
+Reverting, listing and comparing earlier versions still work.
+</editing_unavailable>
+"""
+
+# Appended to the instruction once the edit model is found to be unavailable.
+_unavailable_notice = ""
+
+
+def hide_unavailable_edit_tools(agent: Agent) -> bool:
+    """Probe the Imagen edit model and remove its tools from `agent` if unavailable.
+
+    The image editing instruction then tells users that edits are unavailable.
+
+    Args:
+        agent: The agent to update, normally image_editing_agent.
+
+    Returns:
+        Whether the edit tools were hidden.
+    """
+    global _unavailable_notice
+    reason = probe_edit_model()
+    if reason is None:
+        return False
+    print(f"Hiding Imagen edit tools: {reason}")
+    agent.tools = [tool for tool in agent.tools if tool not in EDIT_MODEL_TOOLS]
+    _unavailable_notice = EDITING_UNAVAILABLE_INSTRUCTION.format(reason=reason)
+    return True
+
+
+if config.PROBE_MODEL_CAPABILITIES:
+    hide_unavailable_edit_tools(image_editing_agent)
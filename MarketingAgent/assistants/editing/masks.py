@@ -0,0 +1,67 @@
+import hashlib
+import io
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+
+
+@dataclass(frozen=True)
+class MaskSettings:
+    """The Imagen mask settings a mask was computed for."""
+
+    mask_mode: str
+    mask_dilation: float
+
+    @property
+    def key(self) -> str:
+        return f"{self.mask_mode.lower()}-{self.mask_dilation:.3f}"
+
+
+def normalize_mask(mask_bytes: bytes, size: tuple[int, int]) -> bytes:
+    """Convert any mask image to a binary PNG of the source size, white = edit."""
+    mask = Image.open(io.BytesIO(mask_bytes)).convert("L")
+    if mask.size != size:
+        mask = mask.resize(size, Image.Resampling.NEAREST)
+    mask = mask.point(lambda value: 255 if value >= 128 else 0)
+    buffer = io.BytesIO()
+    mask.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class MaskCache:
+    """Masks stored per source image digest and mask settings.
+
+    Only masks the user supplied are stored. The area one edit changed says
+    nothing about where the next edit of the image should apply, so masks are
+    never derived from edit results. Reads and writes block on disk; call them
+    with `asyncio.to_thread`.
+
+    Args:
+        cache_dir: The directory to keep masks in.
+    """
+
+    def __init__(self, cache_dir: str = ".cache"):
+        self.mask_dir = Path(cache_dir) / "masks"
+
+    def _path(self, source_digest: str, settings: MaskSettings) -> Path:
+        name = hashlib.sha256(f"{source_digest}:{settings.key}".encode()).hexdigest()
+        return self.mask_dir / f"{name}.png"
+
+    def get(self, source_digest: str, settings: MaskSettings) -> Optional[bytes]:
+        path = self._path(source_digest, settings)
+        return path.read_bytes() if path.is_file() else None
+
+    def put(self, source_digest: str, settings: MaskSettings, mask_bytes: bytes) -> None:
+        path = self._path(source_digest, settings)
+        self.mask_dir.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.mask_dir, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(mask_bytes)
+        os.replace(temp_path, path)
+
+
+mask_cache = MaskCache()
@@ -1,11 +1,43 @@
+import asyncio
+import io
+from pathlib import Path
 from typing import Dict, Any, Optional
 from enum import Enum
 
 from google.adk.tools import ToolContext
 from google.genai import types
 from google.genai.types import RawReferenceImage, MaskReferenceImage
-from MarketingAgent.config import genai_client, GeminiModelOptions
+from PIL import Image
+from MarketingAgent.config import config, genai_client, GeminiModelOptions
+from MarketingAgent.circuits import ModelUnavailableError
+from MarketingAgent.circuits import circuit_breaker
+from MarketingAgent.circuits import probe_model
+from MarketingAgent.deadlines import DeadlineExceededError
+from MarketingAgent.deadlines import check_deadline
+from MarketingAgent.deadlines import with_deadline
+from MarketingAgent.assistants.common import artifact_filename
+from MarketingAgent.assistants.common import load_session_artifact
 from MarketingAgent.assistants.common import save_image_to_cache
+from MarketingAgent.assistants.editing.masks import MaskSettings
+from MarketingAgent.assistants.editing.masks import mask_cache
+from MarketingAgent.assistants.editing.masks import normalize_mask
+from MarketingAgent.assistants.gallery import index_asset
+from MarketingAgent.assistants.memory import edit_footprint
+from MarketingAgent.assistants.memory import with_image_memory
+from MarketingAgent.assistants.lineage import LineageNode
+from MarketingAgent.assistants.lineage import image_digest
+from MarketingAgent.assistants.lineage import lineage_store
+from MarketingAgent.history import HISTORY_STATE_PREFIX
+from MarketingAgent.jobs import job_queue
+from MarketingAgent.jobs import submit_job
+from MarketingAgent.ledger import UNSCOPED
+from MarketingAgent.ledger import BudgetExceededError
+from MarketingAgent.ledger import current_scope
+from MarketingAgent.ledger import ledger
+from MarketingAgent.parallel import is_output_state_key
+from MarketingAgent.progress import ProgressStage
+from MarketingAgent.progress import emit_progress
+from MarketingAgent.progress import image_preview
 
 
 class MaskMode(str, Enum):
@@ -13,59 +45,183 @@ class MaskMode(str, Enum):
 
     BACKGROUND = "MASK_MODE_BACKGROUND"
     FOREGROUND = "MASK_MODE_FOREGROUND"
-    NONE = "MASK_MODE_UNSPECIFIED"
+    USER_PROVIDED = "MASK_MODE_USER_PROVIDED"
+    NONE = "MASK_MODE_DEFAULT"
 
 
 class EditMode(str, Enum):
     """Enum for edit modes in image editing."""
 
     INPAINT = "EDIT_MODE_INPAINT_INSERTION"
-    STYLE = "EDIT_MODE_STYLE_TRANSFER"
-    BASIC = "EDIT_MODE_UNSPECIFIED"
+    REMOVE = "EDIT_MODE_INPAINT_REMOVAL"
+    BACKGROUND_SWAP = "EDIT_MODE_BGSWAP"
+    STYLE = "EDIT_MODE_STYLE"
+    BASIC = "EDIT_MODE_DEFAULT"
 
 
-def _edit_image_with_imagen(
+# State keys the root agent stores sub-agent outputs under, one per call.
+_TOOL_OUTPUT_STATE_KEYS = ("image_generation_output", "image_editing_output")
+
+# Stored user masks apply to any dilation, so they share one cache key.
+USER_MASK_SETTINGS = MaskSettings(MaskMode.USER_PROVIDED.value, 0.0)
+
+# Where images were cached before the lineage store kept their bytes, and
+# the extensions they were cached with; the databases there are not images.
+LEGACY_CACHE_DIR = ".cache"
+LEGACY_IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg")
+
+
+def _load_source_image(image_filename: str) -> bytes:
+    """Read a source image of the current tenant from the lineage store.
+
+    The shared `.cache` directory only serves images cached before the
+    lineage store, which the current tenant claims on first use unless
+    LEGACY_IMAGE_TENANT names another owner. Any other file there may be
+    another tenant's, since a filename alone does not tell whose an image is.
+    Blocks on disk; call it with `asyncio.to_thread`.
+
+    Args:
+        image_filename: An image filename or a lineage node id.
+
+    Returns:
+        The raw bytes of the image.
+
+    Raises:
+        FileNotFoundError: If the tenant has no image by that name or node id.
+    """
+    node = lineage_store.resolve(image_filename) or _claim_legacy_image(image_filename)
+    if node is None:
+        raise FileNotFoundError(f"No image found for '{image_filename}'")
+    return lineage_store.load_bytes(node)
+
+
+def _claim_legacy_image(image_filename: str) -> Optional[LineageNode]:
+    """The current tenant's node for an image cached before the lineage store, if any."""
+    if (
+        Path(image_filename).name != image_filename
+        or image_filename.startswith(".")
+        or not image_filename.lower().endswith(LEGACY_IMAGE_SUFFIXES)
+    ):
+        return None
+    scope = current_scope.get()
+    tenant_id = scope.tenant_id if scope is not None else UNSCOPED
+    if config.LEGACY_IMAGE_TENANT and config.LEGACY_IMAGE_TENANT != tenant_id:
+        return None
+    path = Path(LEGACY_CACHE_DIR) / image_filename
+    if not path.is_file():
+        return None
+    return lineage_store.claim_legacy(path.read_bytes(), image_filename)
+
+
+def _debug_state(tool_context: ToolContext) -> Dict[str, Any]:
+    """The session state returned with edit results for debugging.
+
+    Earlier tool outputs and the conversation summary are left out; they
+    would otherwise nest every earlier result in each new one.
+    """
+    if not (hasattr(tool_context, "state") and hasattr(tool_context.state, "to_dict")):
+        return {}
+    return {
+        key: value
+        for key, value in tool_context.state.to_dict().items()
+        if not is_output_state_key(key, _TOOL_OUTPUT_STATE_KEYS)
+        and not key.startswith(HISTORY_STATE_PREFIX)
+    }
+
+
+def _source_reference(image_bytes: bytes) -> RawReferenceImage:
+    """Wrap source image bytes as the raw reference of an Imagen edit."""
+    return RawReferenceImage(
+        reference_id=1,
+        reference_image=types.Image(image_bytes=image_bytes),
+    )
+
+
+def _mask_reference(
+    mask_mode: MaskMode, mask_dilation: float, mask_bytes: Optional[bytes] = None
+) -> MaskReferenceImage:
+    """Build the mask reference of an Imagen edit.
+
+    A precomputed mask is always sent as a user-provided mask, which skips
+    Imagen's segmentation; otherwise Imagen computes one with `mask_mode`.
+    """
+    if mask_bytes is not None:
+        return MaskReferenceImage(
+            reference_id=2,
+            reference_image=types.Image(image_bytes=mask_bytes),
+            config=types.MaskReferenceConfig(
+                mask_mode=MaskMode.USER_PROVIDED.value,
+                mask_dilation=mask_dilation,
+            ),
+        )
+    return MaskReferenceImage(
+        reference_id=2,
+        config=types.MaskReferenceConfig(
+            mask_mode=mask_mode.value,
+            mask_dilation=mask_dilation,
+        ),
+    )
+
+
+async def _edit_image_with_imagen(
     image_bytes: bytes,
     prompt: str,
+    edit_mode: EditMode = EditMode.INPAINT,
+    mask_mode: MaskMode = MaskMode.FOREGROUND,
+    mask_dilation: float = 0.1,
+    mask_bytes: Optional[bytes] = None,
+    raw_ref_image: Optional[RawReferenceImage] = None,
+    mask_ref_image: Optional[MaskReferenceImage] = None,
 ) -> Optional[bytes]:
-    """Edit an image using Imagen 3.0 with fixed background masking and inpainting.
+    """Edit an image using Imagen 3.0 with a mask.
 
     Args:
         image_bytes: Raw bytes of the source image to edit.
         prompt: The text prompt describing the desired edit.
+        edit_mode: The Imagen edit mode.
+        mask_mode: How Imagen should compute the mask; ignored when `mask_bytes`
+            is given, which is always sent as a user-provided mask.
+        mask_dilation: Dilation of the mask as a fraction of the image size.
+        mask_bytes: A precomputed mask, white where the image may change.
+        raw_ref_image: A prebuilt reference of `image_bytes`, shared by edits
+            of the same source.
+        mask_ref_image: A prebuilt mask reference, replacing the mask arguments.
 
     Returns:
         bytes: The raw image bytes of the edited image, or None if editing failed.
+
+    Raises:
+        BudgetExceededError: If the session or tenant image budget is exhausted.
+        ModelUnavailableError: If the project cannot use the edit model.
+        DeadlineExceededError: If the turn's deadline passed first.
     """
+    ledger.check_budget(images=1)
     try:
-        # Create a raw reference image from the source image bytes
-        raw_image = types.Image(image_bytes=image_bytes)
-
-        raw_ref_image = RawReferenceImage(
-            reference_id=1,
-            reference_image=raw_image,
-        )
-
-        # Create mask reference with fixed BACKGROUND mode
-        mask_ref_image = MaskReferenceImage(
-            reference_id=2,
-            config=types.MaskReferenceConfig(
-                mask_mode="MASK_MODE_FOREGROUND",
-                mask_dilation=0.1,
+        raw_ref_image = raw_ref_image or _source_reference(image_bytes)
+        mask_ref_image = mask_ref_image or _mask_reference(mask_mode, mask_dilation, mask_bytes)
+
+        response = await with_deadline(
+            with_image_memory(
+                edit_footprint(image_bytes, mask_bytes),
+                circuit_breaker(GeminiModelOptions.IMAGEN_3_0_EDIT).call_async(
+                    genai_client.aio.models.edit_image,
+                    model=GeminiModelOptions.IMAGEN_3_0_EDIT,
+                    prompt=prompt,
+                    reference_images=[raw_ref_image, mask_ref_image],
+                    config=types.EditImageConfig(
+                        edit_mode=edit_mode.value,
+                        number_of_images=1,
+                        include_rai_reason=True,
+                        output_mime_type="image/png",
+                    ),
+                ),
             ),
+            config.IMAGE_EDIT_TIMEOUT_SECONDS,
         )
 
-        # Call the API to edit the image with fixed INPAINT mode
-        response = genai_client.models.edit_image(
-            model=GeminiModelOptions.IMAGEN_3_0_EDIT,
-            prompt=prompt,
-            reference_images=[raw_ref_image, mask_ref_image],
-            config=types.EditImageConfig(
-                edit_mode="EDIT_MODE_INPAINT_INSERTION",
-                number_of_images=1,
-                include_rai_reason=True,
-                output_mime_type="image/png",
-            ),
+        ledger.record(
+            GeminiModelOptions.IMAGEN_3_0_EDIT,
+            images=len(response.generated_images or []),
         )
 
         # Return the edited image bytes if available
@@ -74,14 +230,52 @@ def _edit_image_with_imagen(
 
         return None
 
+    except (ModelUnavailableError, DeadlineExceededError):
+        raise
     except Exception as e:
         print(f"Error editing image with Imagen: {e}")
         return None
 
 
-def _free_edit_image_with_imagen(
+def _probe_edit_model() -> None:
+    """Make the smallest free-form edit, to check the project can use the edit model."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), "white").save(buffer, format="PNG")
+    response = genai_client.models.edit_image(
+        model=GeminiModelOptions.IMAGEN_3_0_EDIT,
+        prompt="A plain white square",
+        reference_images=[_source_reference(buffer.getvalue())],
+        config=types.EditImageConfig(edit_mode=EditMode.BASIC.value, number_of_images=1),
+    )
+    ledger.record(
+        GeminiModelOptions.IMAGEN_3_0_EDIT, images=len(response.generated_images or [])
+    )
+
+
+def probe_edit_model() -> Optional[str]:
+    """Check whether this project can use the Imagen edit model.
+
+    Returns:
+        None if it can, otherwise the reason it cannot.
+    """
+    return probe_model(GeminiModelOptions.IMAGEN_3_0_EDIT, _probe_edit_model)
+
+
+async def _load_mask(mask_filename: str, tool_context: ToolContext) -> bytes:
+    """Read a mask from the cache, the lineage store or the session's artifacts."""
+    try:
+        return await asyncio.to_thread(_load_source_image, mask_filename)
+    except FileNotFoundError:
+        artifact = await load_session_artifact(tool_context, mask_filename)
+        if artifact is None or artifact.inline_data is None:
+            raise
+        return artifact.inline_data.data
+
+
+async def _free_edit_image_with_imagen(
     image_bytes: bytes,
     prompt: str,
+    raw_ref_image: Optional[RawReferenceImage] = None,
 ) -> Optional[bytes]:
     """Edit an image using Imagen 3.0 without applying a mask.
 
@@ -91,32 +285,46 @@ def _free_edit_image_with_imagen(
     Args:
         image_bytes: Raw bytes of the source image to edit.
         prompt: The text prompt describing the desired edit.
+        raw_ref_image: A prebuilt reference of `image_bytes`, shared by edits
+            of the same source.
 
     Returns:
         bytes: The raw image bytes of the edited image, or None if editing failed.
+
+    Raises:
+        BudgetExceededError: If the session or tenant image budget is exhausted.
+        ModelUnavailableError: If the project cannot use the edit model.
+        DeadlineExceededError: If the turn's deadline passed first.
     """
+    ledger.check_budget(images=1)
     try:
-        # Create a raw reference image from the source image bytes
-        raw_image = types.Image(image_bytes=image_bytes)
-
-        raw_ref_image = RawReferenceImage(
-            reference_id=1,
-            reference_image=raw_image,
-        )
+        raw_ref_image = raw_ref_image or _source_reference(image_bytes)
 
         # Call the API to edit the image with DEFAULT mode (no mask required)
-        response = genai_client.models.edit_image(
-            model=GeminiModelOptions.IMAGEN_3_0_EDIT,
-            prompt=prompt,
-            reference_images=[raw_ref_image],  # Only the raw image, no mask
-            config=types.EditImageConfig(
-                edit_mode="EDIT_MODE_DEFAULT",
-                number_of_images=1,
-                include_rai_reason=True,
-                safety_filter_level="BLOCK_ONLY_HIGH",
-                person_generation="DONT_ALLOW",  # Safety settings do not allow person generation
-                output_mime_type="image/png",
+        response = await with_deadline(
+            with_image_memory(
+                edit_footprint(image_bytes),
+                circuit_breaker(GeminiModelOptions.IMAGEN_3_0_EDIT).call_async(
+                    genai_client.aio.models.edit_image,
+                    model=GeminiModelOptions.IMAGEN_3_0_EDIT,
+                    prompt=prompt,
+                    reference_images=[raw_ref_image],  # Only the raw image, no mask
+                    config=types.EditImageConfig(
+                        edit_mode=EditMode.BASIC.value,
+                        number_of_images=1,
+                        include_rai_reason=True,
+                        safety_filter_level="BLOCK_ONLY_HIGH",
+                        person_generation="DONT_ALLOW",  # Safety settings do not allow person generation
+                        output_mime_type="image/png",
+                    ),
+                ),
             ),
+            config.IMAGE_EDIT_TIMEOUT_SECONDS,
+        )
+
+        ledger.record(
+            GeminiModelOptions.IMAGEN_3_0_EDIT,
+            images=len(response.generated_images or []),
         )
 
         # Return the edited image bytes if available
@@ -125,6 +333,8 @@ def _free_edit_image_with_imagen(
 
         return None
 
+    except (ModelUnavailableError, DeadlineExceededError):
+        raise
     except Exception as e:
         print(f"Error with free-form image editing: {e}")
         return None
@@ -134,31 +344,99 @@ async def edit_image(
     image_filename: str,
     prompt: str,
     tool_context: ToolContext,
+    edit_mode: str = EditMode.INPAINT.value,
+    mask_mode: str = MaskMode.FOREGROUND.value,
+    mask_dilation: float = 0.1,
+    mask_filename: str = "",
+    run_in_background: bool = False,
 ) -> Dict[str, Any]:
     """Tool to edit an existing image based on a text prompt.
 
+    A mask given as `mask_filename` is stored for the source image, so later
+    edits of the same image can use it again with MASK_MODE_USER_PROVIDED.
+
     Args:
         image_filename: The filename of the image to edit.
         prompt: The text prompt describing the desired edit.
         tool_context: The tool execution context with artifact service access.
+        edit_mode: One of EDIT_MODE_INPAINT_INSERTION (add or change objects),
+            EDIT_MODE_INPAINT_REMOVAL (remove objects) or EDIT_MODE_BGSWAP
+            (replace the background of a product shot).
+        mask_mode: MASK_MODE_FOREGROUND or MASK_MODE_BACKGROUND to have the
+            area found automatically, or MASK_MODE_USER_PROVIDED to use the
+            mask given by `mask_filename` or the one stored for this image.
+        mask_dilation: How far to grow the mask, as a fraction of the image size.
+        mask_filename: An image or artifact to use as the mask, white where the
+            image may change. It is stored for later edits of the same image.
+        run_in_background: When True, return a job id immediately and edit the
+            image on the background worker pool.
 
     Returns:
-        A dictionary with artifact information including filename and version.
+        A dictionary with artifact information including filename and version,
+        or with the `job_id` of a background job.
     """
     try:
-        # For testing, let's use a placeholder image instead of trying to get it from artifacts
-        with open(f".cache/{image_filename}", "rb") as f:
-            image_bytes = f.read()
+        edit_mode_option = EditMode(edit_mode)
+        mask_mode_option = MaskMode(mask_mode)
+    except ValueError as e:
+        return {
+            "success": False,
+            "error": f"{e}. Edit modes: {[m.value for m in EditMode]}; mask modes: {[m.value for m in MaskMode]}",
+        }
+
+    if run_in_background:
+        return submit_job(
+            "edit_image",
+            {
+                "image_filename": image_filename,
+                "prompt": prompt,
+                "edit_mode": edit_mode,
+                "mask_mode": mask_mode,
+                "mask_dilation": mask_dilation,
+                "mask_filename": mask_filename,
+            },
+            tool_context,
+        )
+
+    try:
+        image_bytes = await asyncio.to_thread(_load_source_image, image_filename)
+        source_digest = image_digest(image_bytes)
 
         # Include context state for debugging
-        context_state = {}
-        if hasattr(tool_context, "state") and hasattr(tool_context.state, "to_dict"):
-            context_state = tool_context.state.to_dict()
-
-        # Edit the image - simplified with fixed parameters
-        edited_image_bytes = _edit_image_with_imagen(
+        context_state = _debug_state(tool_context)
+
+        # Pick the mask: given by the user, stored for this image, or computed by Imagen
+        mask_bytes = None
+        mask_source = "imagen"
+        if mask_filename:
+            with Image.open(io.BytesIO(image_bytes)) as source_image:
+                source_size = source_image.size
+            mask_bytes = normalize_mask(await _load_mask(mask_filename, tool_context), source_size)
+            await asyncio.to_thread(mask_cache.put, source_digest, USER_MASK_SETTINGS, mask_bytes)
+            mask_source = "user"
+        elif mask_mode_option == MaskMode.USER_PROVIDED:
+            mask_bytes = await asyncio.to_thread(mask_cache.get, source_digest, USER_MASK_SETTINGS)
+            if mask_bytes is None:
+                return {
+                    "success": False,
+                    "error": "No mask is stored for this image; pass mask_filename",
+                }
+            mask_source = "stored"
+
+        # Edit the image off the event loop so progress streams meanwhile
+        emit_progress(
+            "edit_image",
+            ProgressStage.REQUEST_SENT,
+            model=GeminiModelOptions.IMAGEN_3_0_EDIT.value,
+            mask_source=mask_source,
+        )
+        edited_image_bytes = await _edit_image_with_imagen(
             image_bytes=image_bytes,
             prompt=prompt,
+            edit_mode=edit_mode_option,
+            mask_mode=mask_mode_option,
+            mask_dilation=mask_dilation,
+            mask_bytes=mask_bytes,
         )
 
         if not edited_image_bytes:
@@ -168,14 +446,22 @@ async def edit_image(
                 "context_state": context_state,
             }
 
+        emit_progress(
+            "edit_image",
+            ProgressStage.IMAGE_RECEIVED,
+            preview=image_preview(edited_image_bytes),
+        )
+
         # Create a Part object with the edited image data
         edited_image_artifact = types.Part.from_bytes(
             data=edited_image_bytes, mime_type="image/png"
         )
 
+        # No one is waiting for the edit once the turn's deadline has passed
+        check_deadline()
+
         # Generate a filename for the edited image
-        sanitized_prompt = "".join(c if c.isalnum() else "_" for c in prompt[:30])
-        edit_filename = f"edited_image_{sanitized_prompt}.png"
+        edit_filename = artifact_filename("edited_image", prompt, edited_image_bytes)
 
         saved_filepath = save_image_to_cache(
             image_bytes=edited_image_bytes, filename=edit_filename
@@ -192,13 +478,37 @@ async def edit_image(
         version = await tool_context.save_artifact(
             filename=edit_filename, artifact=edited_image_artifact
         )
+        emit_progress(
+            "edit_image",
+            ProgressStage.ARTIFACT_SAVED,
+            artifact_filename=edit_filename,
+            artifact_version=version,
+        )
+
+        applied_mask_mode = (
+            MaskMode.USER_PROVIDED if mask_bytes is not None else mask_mode_option
+        )
+        node = await asyncio.to_thread(
+            lineage_store.record,
+            edited_image_bytes,
+            filename=edit_filename,
+            operation="edit",
+            parent_bytes=image_bytes,
+            prompt=prompt,
+            edit_mode=edit_mode_option.value,
+            mask_mode=applied_mask_mode.value,
+        )
+        await asyncio.to_thread(index_asset, node, tool_context, prompt=prompt)
 
         # Return metadata about the saved artifact
         return {
             "requested_image": image_filename,
             "prompt": prompt,
-            "mask_mode": "MASK_MODE_BACKGROUND",
-            "edit_mode": "EDIT_MODE_INPAINT_INSERTION",
+            "mask_mode": applied_mask_mode.value,
+            "mask_source": mask_source,
+            "edit_mode": edit_mode_option.value,
+            "node_id": node.node_id,
+            "parent_node_id": node.to_dict()["parent_node_id"],
             "artifact_filename": edit_filename,
             "artifact_version": version,
             "mime_type": "image/png",
@@ -206,6 +516,10 @@ async def edit_image(
             "success": True,
         }
 
+    except (BudgetExceededError, ModelUnavailableError, DeadlineExceededError) as e:
+        return {"success": False, "error": str(e)}
+    except FileNotFoundError as e:
+        return {"success": False, "error": str(e)}
     except ValueError as e:
         print(f"Error with artifact service: {e}")
         return {"success": False, "error": f"Artifact service error: {str(e)}"}
@@ -218,6 +532,7 @@ async def free_edit_image(
     image_filename: str,
     prompt: str,
     tool_context: ToolContext,
+    run_in_background: bool = False,
 ) -> Dict[str, Any]:
     """Tool to perform a free-form edit on an image without applying masks.
 
@@ -228,22 +543,31 @@ async def free_edit_image(
         image_filename: The filename of the image to edit.
         prompt: The text prompt describing the desired edit.
         tool_context: The tool execution context with artifact service access.
+        run_in_background: When True, return a job id immediately and edit the
+            image on the background worker pool.
 
     Returns:
-        A dictionary with artifact information including filename and version.
+        A dictionary with artifact information including filename and version,
+        or with the `job_id` of a background job.
     """
+    if run_in_background:
+        return submit_job(
+            "free_edit_image", {"image_filename": image_filename, "prompt": prompt}, tool_context
+        )
+
     try:
-        # For testing, load the image from cache
-        with open(f".cache/{image_filename}", "rb") as f:
-            image_bytes = f.read()
+        image_bytes = await asyncio.to_thread(_load_source_image, image_filename)
 
         # Include context state for debugging
-        context_state = {}
-        if hasattr(tool_context, "state") and hasattr(tool_context.state, "to_dict"):
-            context_state = tool_context.state.to_dict()
+        context_state = _debug_state(tool_context)
 
-        # Edit the image without masking
-        edited_image_bytes = _free_edit_image_with_imagen(
+        # Edit the image without masking, off the event loop so progress streams meanwhile
+        emit_progress(
+            "free_edit_image",
+            ProgressStage.REQUEST_SENT,
+            model=GeminiModelOptions.IMAGEN_3_0_EDIT.value,
+        )
+        edited_image_bytes = await _free_edit_image_with_imagen(
             image_bytes=image_bytes,
             prompt=prompt,
         )
@@ -255,14 +579,22 @@ async def free_edit_image(
                 "context_state": context_state,
             }
 
+        emit_progress(
+            "free_edit_image",
+            ProgressStage.IMAGE_RECEIVED,
+            preview=image_preview(edited_image_bytes),
+        )
+
         # Create a Part object with the edited image data
         edited_image_artifact = types.Part.from_bytes(
             data=edited_image_bytes, mime_type="image/png"
         )
 
+        # No one is waiting for the edit once the turn's deadline has passed
+        check_deadline()
+
         # Generate a filename for the edited image
-        sanitized_prompt = "".join(c if c.isalnum() else "_" for c in prompt[:30])
-        edit_filename = f"free_edit_{sanitized_prompt}.png"
+        edit_filename = artifact_filename("free_edit", prompt, edited_image_bytes)
 
         # Save the edited image to cache
         saved_filepath = save_image_to_cache(
@@ -280,12 +612,31 @@ async def free_edit_image(
         version = await tool_context.save_artifact(
             filename=edit_filename, artifact=edited_image_artifact
         )
+        emit_progress(
+            "free_edit_image",
+            ProgressStage.ARTIFACT_SAVED,
+            artifact_filename=edit_filename,
+            artifact_version=version,
+        )
+
+        node = await asyncio.to_thread(
+            lineage_store.record,
+            edited_image_bytes,
+            filename=edit_filename,
+            operation="free_edit",
+            parent_bytes=image_bytes,
+            prompt=prompt,
+            edit_mode=EditMode.BASIC.value,
+        )
+        await asyncio.to_thread(index_asset, node, tool_context, prompt=prompt)
 
         # Return metadata
         return {
             "requested_image": image_filename,
             "prompt": prompt,
-            "edit_mode": "EDIT_MODE_DEFAULT",
+            "edit_mode": EditMode.BASIC.value,
+            "node_id": node.node_id,
+            "parent_node_id": node.to_dict()["parent_node_id"],
             "artifact_filename": edit_filename,
             "artifact_version": version,
             "mime_type": "image/png",
@@ -293,9 +644,336 @@ async def free_edit_image(
             "success": True,
         }
 
+    except (BudgetExceededError, ModelUnavailableError, DeadlineExceededError) as e:
+        return {"success": False, "error": str(e)}
     except ValueError as e:
         print(f"Error with artifact service: {e}")
         return {"success": False, "error": f"Artifact service error: {str(e)}"}
     except Exception as e:
         print(f"Unexpected error during free-form editing: {e}")
         return {"success": False, "error": f"Unexpected error: {str(e)}"}
+
+
+async def edit_image_variants(
+    image_filename: str,
+    prompts: list[str],
+    tool_context: ToolContext,
+    free_form: bool = False,
+    edit_mode: str = EditMode.INPAINT.value,
+    mask_mode: str = MaskMode.FOREGROUND.value,
+    mask_dilation: float = 0.1,
+    run_in_background: bool = False,
+) -> Dict[str, Any]:
+    """Tool to create several edits of one image at once, e.g. for A/B testing.
+
+    The source image is read and wrapped as an Imagen reference once and the
+    edits run concurrently, up to EDIT_VARIANT_CONCURRENCY at a time.
+
+    Args:
+        image_filename: The filename of the image to edit.
+        prompts: One edit prompt per variant.
+        tool_context: The tool execution context with artifact service access.
+        free_form: When True, edit the whole image like 'free_edit_image';
+            otherwise edit a masked area like 'edit_image'.
+        edit_mode: The edit mode of masked variants, as for 'edit_image'.
+        mask_mode: The mask mode of masked variants, as for 'edit_image'.
+        mask_dilation: How far to grow the mask of masked variants.
+        run_in_background: When True, return a job id immediately and edit the
+            variants on the background worker pool.
+
+    Returns:
+        A dictionary with the artifact information of each variant, grouped
+        under `variants` in prompt order, or with the `job_id` of a background job.
+    """
+    if not prompts:
+        return {"success": False, "error": "At least one prompt is required"}
+    try:
+        edit_mode_option = EditMode(edit_mode)
+        mask_mode_option = MaskMode(mask_mode)
+    except ValueError as e:
+        return {
+            "success": False,
+            "error": f"{e}. Edit modes: {[m.value for m in EditMode]}; mask modes: {[m.value for m in MaskMode]}",
+        }
+
+    if run_in_background:
+        return submit_job(
+            "edit_image_variants",
+            {
+                "image_filename": image_filename,
+                "prompts": prompts,
+                "free_form": free_form,
+                "edit_mode": edit_mode,
+                "mask_mode": mask_mode,
+                "mask_dilation": mask_dilation,
+            },
+            tool_context,
+        )
+
+    try:
+        ledger.check_budget(images=len(prompts))
+        image_bytes = await asyncio.to_thread(_load_source_image, image_filename)
+    except (BudgetExceededError, FileNotFoundError) as e:
+        return {"requested_image": image_filename, "success": False, "error": str(e)}
+
+    # Every variant shares the source bytes and the references built from them
+    raw_ref_image = _source_reference(image_bytes)
+    mask_ref_image = None
+    applied_mask_mode = MaskMode.NONE
+    if not free_form:
+        mask_bytes = None
+        if mask_mode_option == MaskMode.USER_PROVIDED:
+            mask_bytes = await asyncio.to_thread(
+                mask_cache.get, image_digest(image_bytes), USER_MASK_SETTINGS
+            )
+            if mask_bytes is None:
+                return {
+                    "requested_image": image_filename,
+                    "success": False,
+                    "error": "No mask is stored for this image; edit it once with mask_filename",
+                }
+        mask_ref_image = _mask_reference(mask_mode_option, mask_dilation, mask_bytes)
+        applied_mask_mode = MaskMode.USER_PROVIDED if mask_bytes is not None else mask_mode_option
+
+    semaphore = asyncio.Semaphore(config.EDIT_VARIANT_CONCURRENCY)
+
+    async def edit_variant(index: int, prompt: str) -> Dict[str, Any]:
+        async with semaphore:
+            emit_progress(
+                "edit_image_variants",
+                ProgressStage.REQUEST_SENT,
+                model=GeminiModelOptions.IMAGEN_3_0_EDIT.value,
+                variant=index,
+            )
+            try:
+                if free_form:
+                    edited_image_bytes = await _free_edit_image_with_imagen(
+                        image_bytes=image_bytes,
+                        prompt=prompt,
+                        raw_ref_image=raw_ref_image,
+                    )
+                else:
+                    edited_image_bytes = await _edit_image_with_imagen(
+                        image_bytes=image_bytes,
+                        prompt=prompt,
+                        edit_mode=edit_mode_option,
+                        raw_ref_image=raw_ref_image,
+                        mask_ref_image=mask_ref_image,
+                    )
+            except (BudgetExceededError, ModelUnavailableError, DeadlineExceededError) as e:
+                return {"prompt": prompt, "success": False, "error": str(e)}
+
+        if not edited_image_bytes:
+            return {"prompt": prompt, "success": False, "error": "Image editing failed"}
+
+        emit_progress(
+            "edit_image_variants",
+            ProgressStage.IMAGE_RECEIVED,
+            preview=image_preview(edited_image_bytes),
+            variant=index,
+        )
+
+        try:
+            check_deadline()
+        except DeadlineExceededError as e:
+            return {"prompt": prompt, "success": False, "error": str(e)}
+
+        # The index keeps variants with similar prompts from overwriting each other
+        variant_filename = artifact_filename(f"variant_{index + 1}", prompt, edited_image_bytes)
+        if not save_image_to_cache(image_bytes=edited_image_bytes, filename=variant_filename):
+            return {"prompt": prompt, "success": False, "error": "Failed to save image to cache"}
+
+        try:
+            version = await tool_context.save_artifact(
+                filename=variant_filename,
+                artifact=types.Part.from_bytes(data=edited_image_bytes, mime_type="image/png"),
+            )
+        except ValueError as e:
+            print(f"Error with artifact service: {e}")
+            return {"prompt": prompt, "success": False, "error": f"Artifact service error: {str(e)}"}
+        emit_progress(
+            "edit_image_variants",
+            ProgressStage.ARTIFACT_SAVED,
+            artifact_filename=variant_filename,
+            artifact_version=version,
+            variant=index,
+        )
+
+        node = await asyncio.to_thread(
+            lineage_store.record,
+            edited_image_bytes,
+            filename=variant_filename,
+            operation="free_edit" if free_form else "edit",
+            parent_bytes=image_bytes,
+            prompt=prompt,
+            edit_mode=EditMode.BASIC.value if free_form else edit_mode_option.value,
+            mask_mode=None if free_form else applied_mask_mode.value,
+        )
+        await asyncio.to_thread(index_asset, node, tool_context, prompt=prompt)
+        return {
+            "prompt": prompt,
+            "node_id": node.node_id,
+            "artifact_filename": variant_filename,
+            "artifact_version": version,
+            "mime_type": "image/png",
+            "success": True,
+        }
+
+    try:
+        variants = await asyncio.gather(
+            *(edit_variant(index, prompt) for index, prompt in enumerate(prompts))
+        )
+    except Exception as e:
+        print(f"Unexpected error during variant editing: {e}")
+        return {"requested_image": image_filename, "success": False, "error": f"Unexpected error: {str(e)}"}
+
+    succeeded = sum(1 for variant in variants if variant["success"])
+    return {
+        "requested_image": image_filename,
+        "edit_mode": EditMode.BASIC.value if free_form else edit_mode_option.value,
+        "mask_mode": None if free_form else applied_mask_mode.value,
+        "variants": variants,
+        "succeeded": succeeded,
+        "failed": len(variants) - succeeded,
+        "success": succeeded > 0,
+    }
+
+
+async def list_image_lineage(image_filename: str) -> Dict[str, Any]:
+    """Tool to list the edit history of an image and the branches edited from it.
+
+    Args:
+        image_filename: The filename or lineage node id of the image.
+
+    Returns:
+        A dictionary with the image's ancestors, newest first, and its direct
+        child edits. Each entry has a node_id usable with revert_image or as
+        the image to edit.
+    """
+    return await asyncio.to_thread(_image_lineage, image_filename)
+
+
+def _image_lineage(image_filename: str) -> Dict[str, Any]:
+    node = lineage_store.resolve(image_filename)
+    if node is None:
+        return {"success": False, "error": f"No edit history for '{image_filename}'"}
+
+    return {
+        "image": image_filename,
+        "ancestors": [
+            dict(ancestor.to_dict(), steps_back=steps_back)
+            for steps_back, ancestor in enumerate(lineage_store.ancestors(node))
+        ],
+        "branches": [child.to_dict() for child in lineage_store.children(node)],
+        "success": True,
+    }
+
+
+async def diff_images(image_filename: str, other_image_filename: str) -> Dict[str, Any]:
+    """Tool to compare two images by their edit history and their pixels.
+
+    Args:
+        image_filename: The filename or lineage node id of the first image.
+        other_image_filename: The filename or lineage node id of the second image.
+
+    Returns:
+        A dictionary with the common ancestor, the edits leading to each image
+        and pixel difference statistics.
+    """
+    return await asyncio.to_thread(_diff_images, image_filename, other_image_filename)
+
+
+def _diff_images(image_filename: str, other_image_filename: str) -> Dict[str, Any]:
+    first = lineage_store.resolve(image_filename)
+    second = lineage_store.resolve(other_image_filename)
+    if first is None or second is None:
+        missing = image_filename if first is None else other_image_filename
+        return {"success": False, "error": f"No edit history for '{missing}'"}
+
+    try:
+        return dict(lineage_store.diff(first, second), success=True)
+    except Exception as e:
+        print(f"Error comparing images: {e}")
+        return {"success": False, "error": f"Unexpected error: {str(e)}"}
+
+
+def _revert_target(
+    image_filename: str, steps_back: int, node_id: Optional[str]
+) -> Optional[LineageNode]:
+    if node_id:
+        return lineage_store.resolve(node_id)
+    current = lineage_store.resolve(image_filename)
+    ancestors = lineage_store.ancestors(current) if current else []
+    return ancestors[steps_back] if 0 <= steps_back < len(ancestors) else None
+
+
+async def revert_image(
+    image_filename: str,
+    tool_context: ToolContext,
+    steps_back: int = 1,
+    node_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Tool to restore an earlier version of an image without calling Imagen.
+
+    Args:
+        image_filename: The filename or lineage node id of the current image.
+        tool_context: The tool execution context with artifact service access.
+        steps_back: How many edits to undo, e.g. 2 for "go back two steps".
+        node_id: Restore this lineage node instead, e.g. from another branch.
+
+    Returns:
+        A dictionary with the restored image's artifact filename and node id.
+        Further edits of that filename branch from the restored version.
+    """
+    try:
+        target = await asyncio.to_thread(_revert_target, image_filename, steps_back, node_id)
+        if target is None:
+            return {
+                "requested_image": image_filename,
+                "success": False,
+                "error": "No matching earlier version found",
+            }
+
+        image_bytes = await asyncio.to_thread(lineage_store.load_bytes, target)
+        revert_filename = f"revert_{target.node_id}.png"
+
+        saved_filepath = save_image_to_cache(
+            image_bytes=image_bytes, filename=revert_filename
+        )
+        if not saved_filepath:
+            return {
+                "requested_image": image_filename,
+                "success": False,
+                "error": "Failed to save image to cache",
+            }
+        node = await asyncio.to_thread(
+            lineage_store.record, image_bytes, filename=revert_filename, operation="revert"
+        )
+        await asyncio.to_thread(index_asset, node, tool_context)
+
+        version = await tool_context.save_artifact(
+            filename=revert_filename,
+            artifact=types.Part.from_bytes(data=image_bytes, mime_type="image/png"),
+        )
+
+        return {
+            "requested_image": image_filename,
+            "restored": target.to_dict(),
+            "node_id": target.node_id,
+            "artifact_filename": revert_filename,
+            "artifact_version": version,
+            "mime_type": "image/png",
+            "success": True,
+        }
+
+    except ValueError as e:
+        print(f"Error with artifact service: {e}")
+        return {"success": False, "error": f"Artifact service error: {str(e)}"}
+    except Exception as e:
+        print(f"Unexpected error while reverting image: {e}")
+        return {"success": False, "error": f"Unexpected error: {str(e)}"}
+
+
+job_queue.register("edit_image", edit_image, state_key="image_editing_output")
+job_queue.register("free_edit_image", free_edit_image, state_key="image_editing_output")
+job_queue.register("edit_image_variants", edit_image_variants, state_key="image_editing_output")
@@ -0,0 +1,312 @@
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from google.adk.tools import ToolContext
+
+from MarketingAgent.assistants.generation.dedup import prompt_index
+from MarketingAgent.assistants.generation.dedup import prompt_terms
+from MarketingAgent.assistants.lineage import NODE_ID_LENGTH
+from MarketingAgent.assistants.lineage import LineageNode
+from MarketingAgent.assistants.lineage import LineageStore
+from MarketingAgent.assistants.lineage import lineage_store
+from MarketingAgent.ledger import UNSCOPED
+from MarketingAgent.ledger import current_scope
+
+# Session state key of the marketing channel the images of a request are for.
+CHANNEL_STATE_KEY = "asset_channel"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    id INTEGER PRIMARY KEY,
+    digest TEXT NOT NULL,
+    tenant_id TEXT NOT NULL,
+    parent_digest TEXT,
+    filename TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    channel TEXT NOT NULL DEFAULT '',
+    prompt TEXT NOT NULL DEFAULT '',
+    enhanced_prompt TEXT NOT NULL DEFAULT '',
+    lineage TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    UNIQUE (digest, tenant_id)
+);
+CREATE INDEX IF NOT EXISTS assets_tenant_created ON assets (tenant_id, created_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS assets_fts USING fts5(
+    prompt, enhanced_prompt, channel, lineage, filename,
+    content = 'assets', content_rowid = 'id', tokenize = 'porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS assets_insert AFTER INSERT ON assets BEGIN
+    INSERT INTO assets_fts (rowid, prompt, enhanced_prompt, channel, lineage, filename)
+    VALUES (new.id, new.prompt, new.enhanced_prompt, new.channel, new.lineage, new.filename);
+END;
+CREATE TRIGGER IF NOT EXISTS assets_update AFTER UPDATE ON assets BEGIN
+    INSERT INTO assets_fts (assets_fts, rowid, prompt, enhanced_prompt, channel, lineage, filename)
+    VALUES ('delete', old.id, old.prompt, old.enhanced_prompt, old.channel, old.lineage, old.filename);
+    INSERT INTO assets_fts (rowid, prompt, enhanced_prompt, channel, lineage, filename)
+    VALUES (new.id, new.prompt, new.enhanced_prompt, new.channel, new.lineage, new.filename);
+END;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_COLUMNS = (
+    "digest",
+    "tenant_id",
+    "parent_digest",
+    "filename",
+    "operation",
+    "channel",
+    "prompt",
+    "enhanced_prompt",
+    "lineage",
+    "created_at",
+)
+
+# A re-derived image keeps its first prompts and takes the latest name.
+_UPSERT = f"""
+INSERT INTO assets ({", ".join(_COLUMNS)}) VALUES ({", ".join("?" * len(_COLUMNS))})
+ON CONFLICT (digest, tenant_id) DO UPDATE SET
+    filename = excluded.filename,
+    channel = COALESCE(NULLIF(excluded.channel, ''), channel),
+    prompt = COALESCE(NULLIF(prompt, ''), excluded.prompt),
+    enhanced_prompt = COALESCE(NULLIF(enhanced_prompt, ''), excluded.enhanced_prompt),
+    created_at = excluded.created_at
+"""
+
+# bm25 weights of the prompt, enhanced prompt, channel, lineage and filename columns.
+_RANK = "bm25(assets_fts, 4.0, 2.0, 2.0, 1.0, 1.0)"
+
+
+@dataclass(frozen=True)
+class Asset:
+    """A generated or edited image of a tenant and what it was made from."""
+
+    digest: str
+    tenant_id: str
+    parent_digest: Optional[str]
+    filename: str
+    operation: str
+    channel: str
+    prompt: str
+    enhanced_prompt: str
+    lineage: str
+    created_at: float
+
+    @property
+    def node_id(self) -> str:
+        return self.digest[:NODE_ID_LENGTH]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "node_id": self.node_id,
+            "parent_node_id": self.parent_digest[:NODE_ID_LENGTH] if self.parent_digest else None,
+            "artifact_filename": self.filename,
+            "operation": self.operation,
+            "channel": self.channel,
+            "prompt": self.prompt,
+            "created_at": datetime.fromtimestamp(self.created_at, timezone.utc).isoformat(
+                timespec="minutes"
+            ),
+        }
+
+
+def _match_query(query: str) -> str:
+    """An FTS5 query matching any content word of `query`, as a word prefix."""
+    return " OR ".join(f'"{term}"*' for term in sorted(prompt_terms(query)))
+
+
+class AssetGallery:
+    """A full-text index of every image, for finding earlier assets by description.
+
+    Each image is indexed per tenant with its prompt, the enhanced prompt sent
+    to Imagen, the marketing channel it was made for and the prompts of the
+    images it was edited from, so "the beach image from last week" finds an
+    edit of it too. Lookups are SQLite FTS5 queries ranked by bm25.
+
+    Images recorded in the lineage store before the index existed are added
+    when it is first created, with the tenant known from the prompt index.
+
+    Args:
+        cache_dir: The directory to keep the index in.
+        lineage: The lineage store the indexed images are recorded in.
+    """
+
+    def __init__(self, cache_dir: str = ".cache", lineage: LineageStore = lineage_store):
+        self.db_path = Path(cache_dir) / "gallery.db"
+        self.lineage = lineage
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if not self._initialized:
+                self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                with closing(sqlite3.connect(self.db_path, timeout=30)) as connection:
+                    connection.execute("PRAGMA journal_mode=WAL")
+                    connection.executescript(_SCHEMA)
+                self._initialized = True
+                self._backfill()
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _backfill(self) -> None:
+        """Index the images of the lineage store once, when the index is new."""
+        with closing(sqlite3.connect(self.db_path, timeout=30, isolation_level=None)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                done = connection.execute("SELECT 1 FROM meta WHERE key = 'backfilled'").fetchone()
+                if done is None:
+                    rows = self._backfill_rows()
+                    connection.executemany(_UPSERT, rows)
+                    connection.execute("INSERT INTO meta VALUES ('backfilled', ?)", (str(time.time()),))
+                    if rows:
+                        print(f"Indexed {len(rows)} existing images in the asset gallery")
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def _backfill_rows(self) -> List[tuple]:
+        generations = {
+            (entry.tenant_id, entry.node_id): entry for entry in prompt_index.entries()
+        }
+        rows = []
+        for node in self.lineage.nodes():
+            generation = generations.get((node.tenant_id, node.node_id))
+            rows.append(
+                self._row(
+                    node,
+                    node.tenant_id,
+                    prompt=generation.prompt if generation else None,
+                    enhanced_prompt=generation.enhanced_prompt if generation else "",
+                )
+            )
+        return rows
+
+    def _row(
+        self,
+        node: LineageNode,
+        tenant_id: str,
+        channel: str = "",
+        prompt: Optional[str] = None,
+        enhanced_prompt: str = "",
+    ) -> tuple:
+        ancestors = self.lineage.ancestors(node)[1:]
+        lineage = " ".join(ancestor.prompt for ancestor in ancestors if ancestor.prompt)
+        return (
+            node.digest,
+            tenant_id,
+            node.parent_digest,
+            node.filename,
+            node.operation,
+            channel.strip().lower(),
+            (node.prompt if prompt is None else prompt) or "",
+            enhanced_prompt,
+            lineage,
+            node.created_at,
+        )
+
+    def index(
+        self,
+        node: LineageNode,
+        tenant_id: str,
+        channel: str = "",
+        prompt: Optional[str] = None,
+        enhanced_prompt: str = "",
+    ) -> None:
+        """Add or update the entry of an image.
+
+        Args:
+            node: The image's lineage node.
+            tenant_id: The tenant that owns the image.
+            channel: The marketing channel it was made for, e.g. "social".
+            prompt: The prompt it was made with; defaults to the node's, which
+                is the prompt of whoever first made identical bytes.
+            enhanced_prompt: The prompt sent to Imagen, for generated images.
+        """
+        row = self._row(node, tenant_id, channel, prompt, enhanced_prompt)
+        with closing(self._connect()) as connection:
+            connection.execute(_UPSERT, row)
+
+    def search(
+        self,
+        query: str,
+        tenant_id: str,
+        channel: str = "",
+        since: Optional[float] = None,
+        limit: int = 5,
+    ) -> List[Asset]:
+        """Find a tenant's images by description.
+
+        Args:
+            query: Words describing the image; any of them may match.
+            tenant_id: Only the tenant's own images are returned.
+            channel: When given, only images made for this channel.
+            since: When given, only images made at or after this time.
+            limit: Maximum number of results.
+
+        Returns:
+            The best matches first, or the newest images if `query` has no
+            content words.
+        """
+        filters = ["a.tenant_id = ?"]
+        params: List[Any] = [tenant_id]
+        if channel:
+            filters.append("a.channel = ?")
+            params.append(channel.strip().lower())
+        if since is not None:
+            filters.append("a.created_at >= ?")
+            params.append(since)
+
+        match = _match_query(query)
+        columns = ", ".join(f"a.{column}" for column in _COLUMNS)
+        if match:
+            sql = (
+                f"SELECT {columns} FROM assets_fts JOIN assets a ON a.id = assets_fts.rowid"
+                f" WHERE assets_fts MATCH ? AND {' AND '.join(filters)}"
+                f" ORDER BY {_RANK}, a.created_at DESC LIMIT ?"
+            )
+            params = [match, *params]
+        else:
+            sql = (
+                f"SELECT {columns} FROM assets a WHERE {' AND '.join(filters)}"
+                " ORDER BY a.created_at DESC LIMIT ?"
+            )
+        with closing(self._connect()) as connection:
+            rows = connection.execute(sql, [*params, limit]).fetchall()
+        return [Asset(*row) for row in rows]
+
+
+asset_gallery = AssetGallery()
+
+
+def index_asset(
+    node: LineageNode,
+    tool_context: Optional[ToolContext] = None,
+    prompt: Optional[str] = None,
+    enhanced_prompt: str = "",
+) -> None:
+    """Index an image for the tenant of the current call.
+
+    The channel is read from the `CHANNEL_STATE_KEY` state key. Indexing never
+    fails the tool that made the image.
+    """
+    scope = current_scope.get()
+    state = getattr(tool_context, "state", None) or {}
+    try:
+        asset_gallery.index(
+            node,
+            tenant_id=scope.tenant_id if scope else UNSCOPED,
+            channel=str(state.get(CHANNEL_STATE_KEY) or ""),
+            prompt=prompt,
+            enhanced_prompt=enhanced_prompt,
+        )
+    except Exception as e:
+        print(f"Error indexing image {node.filename} in the asset gallery: {e}")
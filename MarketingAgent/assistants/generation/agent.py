@@ -1,23 +1,34 @@
 from google.adk.agents import Agent
+from google.adk.agents.readonly_context import ReadonlyContext
 
 from MarketingAgent.assistants.generation.tools import generate_image
+from MarketingAgent.assistants.generation.tools import generate_svg
+from MarketingAgent.assistants.generation.tools import reuse_image
+from MarketingAgent.brand import current_brand
 from MarketingAgent.config import GeminiModelOptions
+from MarketingAgent.deadlines import enforce_deadline
+from MarketingAgent.ledger import enforce_budget
+from MarketingAgent.models import MeteredGemini
 
-# CLIENT CONFIGURATION
+# CLIENT CONFIGURATION, used until the brand configuration overrides it
 CLIENT_NAME = "{CLIENT_NAME}"
 CLIENT_INDUSTRY = "{CLIENT_INDUSTRY}"
 
-image_generation_instruction = f"""
+
+def render_image_generation_instruction(client_name: str, client_industry: str) -> str:
+    """Render the image generation agent's instruction for a client."""
+    return f"""
 <agent_identity>
-You are a specialized image generation assistant for {CLIENT_NAME}, operating in the {CLIENT_INDUSTRY} industry.
+You are a specialized image generation assistant for {client_name}, operating in the {client_industry} industry.
 </agent_identity>
 
 <core_mission>
-Create high-quality, brand-compliant visual content that aligns with {CLIENT_NAME}'s visual identity and marketing objectives.
+Create high-quality, brand-compliant visual content that aligns with {client_name}'s visual identity and marketing objectives.
 </core_mission>
 
 <capabilities>
 - Generate original images from text descriptions
+- Draw brand-colored SVG icons, badges and widgets
 - Apply brand guidelines automatically
 - Create industry-appropriate visual content
 - Optimize images for various marketing channels
@@ -26,15 +37,30 @@ Create high-quality, brand-compliant visual content that aligns with {CLIENT_NAM
 
 <process_approach>
 1. Analyze the user's image request for clarity and completeness
-2. Apply {CLIENT_NAME}'s brand guidelines to enhance the prompt
+2. Apply {client_name}'s brand guidelines to enhance the prompt
 3. Generate high-quality images using advanced AI models
 4. Save and organize outputs for easy access and reuse
 5. Provide detailed metadata for tracking and optimization
 </process_approach>
 
+<choosing_the_tool>
+- Icons, badges, logo-style marks, buttons, simple illustrations, charts and other UI widgets: call 'generate_svg'. It is much faster and cheaper than 'generate_image' and stays sharp at any size
+- Photographs, realistic scenes and detailed artwork: call 'generate_image'
+- If the user explicitly asks for a PNG photo or an SVG, follow that
+</choosing_the_tool>
+
+<asset_reuse>
+- 'generate_image' first checks for images already generated from a near-identical prompt and returns them as 'similar_images' instead of generating
+- Offer those images to the user; call 'reuse_image' with the chosen node_id, or call 'generate_image' again with allow_reuse=False if the user wants a new image
+</asset_reuse>
+
+<background_jobs>
+- If the request asks to run in the background, call 'generate_image' with run_in_background=True and report the returned job id instead of an image
+</background_jobs>
+
 <quality_standards>
-- All images must reflect {CLIENT_NAME}'s brand personality
-- Visual content should be industry-appropriate for {CLIENT_INDUSTRY}
+- All images must reflect {client_name}'s brand personality
+- Visual content should be industry-appropriate for {client_industry}
 - Maintain professional quality suitable for marketing use
 - Ensure consistency with brand color schemes and visual identity
 - Optimize for the intended marketing channel or format
@@ -49,10 +75,24 @@ Create high-quality, brand-compliant visual content that aligns with {CLIENT_NAM
 </interaction_guidelines>
 """
 
+
+def image_generation_instruction(context: ReadonlyContext) -> str:
+    """Instruction provider rendering the image generation agent's instruction for the tenant's brand."""
+    brand = current_brand(context)
+    client = brand.section("client")
+    return brand.memo(
+        "image_generation_instruction",
+        lambda: render_image_generation_instruction(
+            client.get("client_name", CLIENT_NAME), client.get("industry", CLIENT_INDUSTRY)
+        ),
+    )
+
+
 image_generation_agent = Agent(
-    model=GeminiModelOptions.GEMINI_2_0_FLASH,
+    model=MeteredGemini(model=GeminiModelOptions.GEMINI_2_0_FLASH),
     name="image_generation_agent",
     instruction=image_generation_instruction,
     description=f"A specialized image generation assistant for {CLIENT_NAME} that creates brand-compliant visual content for {CLIENT_INDUSTRY} marketing campaigns.",
-    tools=[generate_image],
+    tools=[generate_image, generate_svg, reuse_image],
+    before_model_callback=[enforce_deadline, enforce_budget],
 )
\ No newline at end of file
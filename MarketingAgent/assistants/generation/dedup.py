@@ -0,0 +1,256 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Words that change phrasing but not what the image shows.
+_STOPWORDS = frozenset(
+    """a an the of in on at to for with and or by from into onto over under near
+    is are be this that these those some any its it as up out very image picture
+    photo photograph shot show showing create generate make me us our please""".split()
+)
+
+# MinHash signature of NUM_BANDS * ROWS_PER_BAND values. Sets with Jaccard
+# similarity s collide in at least one band with probability
+# 1 - (1 - s ** ROWS_PER_BAND) ** NUM_BANDS, about 0.67 at s = 0.6 and 0.99 at s = 0.8.
+NUM_BANDS = 8
+ROWS_PER_BAND = 4
+_MERSENNE_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [
+    (
+        int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest()) | 1,
+        int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest()),
+    )
+    for i in range(NUM_BANDS * ROWS_PER_BAND)
+]
+
+
+def prompt_terms(text: str) -> FrozenSet[str]:
+    """Reduce a prompt to its set of content words, ignoring order and plurals."""
+    terms = set()
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        terms.add(token)
+    return frozenset(terms)
+
+
+@lru_cache(maxsize=65536)
+def _term_permutations(term: str) -> Tuple[int, ...]:
+    """The term's hash under every MinHash permutation."""
+    h = int.from_bytes(hashlib.blake2b(term.encode(), digest_size=8).digest())
+    return tuple((a * h + b) % _MERSENNE_PRIME for a, b in _PERMUTATIONS)
+
+
+def _band_keys(terms: FrozenSet[str]) -> List[Tuple[int, ...]]:
+    # Terms repeat across prompts, so their permuted hashes are computed once.
+    signature = [min(column) for column in zip(*map(_term_permutations, terms))]
+    return [
+        (band, *signature[band * ROWS_PER_BAND : (band + 1) * ROWS_PER_BAND])
+        for band in range(NUM_BANDS)
+    ]
+
+
+def _jaccard(first: FrozenSet[str], second: FrozenSet[str]) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+@dataclass(frozen=True)
+class PromptEntry:
+    """A past generation and the asset it produced.
+
+    `config_hash` is the hash of the brand configuration the image was made
+    under; it is empty for entries recorded before it was tracked.
+    """
+
+    prompt: str
+    enhanced_prompt: str
+    artifact_filename: str
+    node_id: str
+    tenant_id: str
+    created_at: float
+    config_hash: str = ""
+
+
+@dataclass(frozen=True)
+class PromptMatch:
+    """A past generation similar to a new prompt."""
+
+    entry: PromptEntry
+    similarity: float
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "prompt": self.entry.prompt,
+            "artifact_filename": self.entry.artifact_filename,
+            "node_id": self.entry.node_id,
+            "similarity": round(self.similarity, 3),
+        }
+
+
+class PromptIndex:
+    """Incremental MinHash/LSH index of past prompts for near-duplicate lookups.
+
+    Both the user's prompt and the enhanced prompt of every generation are
+    indexed. Entries are appended to a JSON Lines log so the index survives
+    restarts; the server loads it at startup with `load`. Lines appended by
+    other server workers sharing the log are picked up on the next lookup.
+
+    Reading the log blocks, for seconds when it holds many thousands of
+    prompts; call the methods with `asyncio.to_thread`.
+
+    Args:
+        cache_dir: The directory to keep the index log in.
+    """
+
+    def __init__(self, cache_dir: str = ".cache"):
+        self.log_path = Path(cache_dir) / "prompt_index.jsonl"
+        self._lock = threading.Lock()
+        self._offset = 0
+        self._entries: List[PromptEntry] = []
+        self._terms: List[Tuple[FrozenSet[str], FrozenSet[str]]] = []
+        self._buckets: Dict[Tuple[int, ...], List[int]] = defaultdict(list)
+
+    def _index(self, entry: PromptEntry) -> None:
+        entry_id = len(self._entries)
+        indexed_terms = (prompt_terms(entry.prompt), prompt_terms(entry.enhanced_prompt))
+        self._entries.append(entry)
+        self._terms.append(indexed_terms)
+        for terms in set(indexed_terms):
+            if terms:
+                for key in _band_keys(terms):
+                    self._buckets[key].append(entry_id)
+
+    def _refresh(self) -> None:
+        """Index the lines appended to the log since it was last read."""
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A line another worker is still writing is left for the next refresh.
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                self._index(PromptEntry(**json.loads(line)))
+        self._offset += end
+
+    def load(self) -> int:
+        """Index the whole log now instead of on the first lookup.
+
+        Returns:
+            The number of indexed generations.
+        """
+        return len(self)
+
+    def add(
+        self,
+        prompt: str,
+        enhanced_prompt: str,
+        artifact_filename: str,
+        node_id: str,
+        tenant_id: str,
+        config_hash: str = "",
+    ) -> PromptEntry:
+        """Index a completed generation.
+
+        Args:
+            prompt: The user's prompt.
+            enhanced_prompt: The prompt sent to Imagen.
+            artifact_filename: The artifact the image was saved as.
+            node_id: The lineage node id of the image.
+            tenant_id: The tenant that owns the image.
+            config_hash: The hash of the brand configuration it was made under.
+
+        Returns:
+            The stored entry.
+        """
+        entry = PromptEntry(
+            prompt=prompt,
+            enhanced_prompt=enhanced_prompt,
+            artifact_filename=artifact_filename,
+            node_id=node_id,
+            tenant_id=tenant_id,
+            created_at=time.time(),
+            config_hash=config_hash,
+        )
+        with self._lock:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            # One write per entry, so appends from several workers never interleave.
+            with open(self.log_path, "ab") as f:
+                f.write((json.dumps(asdict(entry)) + "\n").encode())
+            self._refresh()
+        return entry
+
+    def search(
+        self,
+        prompt: str,
+        tenant_id: str,
+        threshold: float,
+        limit: int = 3,
+        config_hash: Optional[str] = None,
+    ) -> List[PromptMatch]:
+        """Find past generations of the tenant whose prompts resemble `prompt`.
+
+        Args:
+            prompt: The new prompt.
+            tenant_id: Only the tenant's own generations are returned.
+            threshold: Minimum Jaccard similarity of the content words.
+            limit: Maximum number of matches.
+            config_hash: When given, generations made under a different brand
+                configuration are skipped.
+
+        Returns:
+            Matches above the threshold, most similar and then newest first.
+        """
+        terms = prompt_terms(prompt)
+        if not terms:
+            return []
+
+        with self._lock:
+            self._refresh()
+            candidates = {
+                entry_id
+                for key in _band_keys(terms)
+                for entry_id in self._buckets.get(key, ())
+            }
+            matches = []
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry.tenant_id != tenant_id:
+                    continue
+                if config_hash and entry.config_hash and entry.config_hash != config_hash:
+                    continue
+                similarity = max(_jaccard(terms, indexed) for indexed in self._terms[entry_id])
+                if similarity >= threshold:
+                    matches.append(PromptMatch(entry, similarity))
+
+        matches.sort(key=lambda match: (match.similarity, match.entry.created_at), reverse=True)
+        return matches[:limit]
+
+    def entries(self) -> List[PromptEntry]:
+        """Every indexed generation, oldest first."""
+        with self._lock:
+            self._refresh()
+            return list(self._entries)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._entries)
+
+
+prompt_index = PromptIndex()
@@ -0,0 +1,171 @@
+import io
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Pixels are quantized to this many bits per channel before scoring.
+QUANTIZE_BITS = 5
+# Images are scored at this longest side; palette use does not need more.
+SCORE_SIZE = 128
+# CIE76 distances: up to MATCH_DELTA_E a color matches a brand color, beyond
+# MAX_DELTA_E it is off-brand, and closeness falls off linearly in between.
+MATCH_DELTA_E = 10.0
+MAX_DELTA_E = 25.0
+# Colors with less Lab chroma than this are neutrals, allowed in any image.
+NEUTRAL_CHROMA = 12.0
+# Off-brand colors reported per image.
+OFF_BRAND_COLORS = 3
+
+_HEX_PATTERN = re.compile(r"^#?([0-9a-fA-F]{6})$")
+_LEVELS = 1 << QUANTIZE_BITS
+_SHIFT = 8 - QUANTIZE_BITS
+
+# sRGB (D65) to CIE XYZ.
+_RGB_TO_XYZ = np.array(
+    [
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ]
+)
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """Convert sRGB colors in 0-255, shape (..., 3), to CIELAB."""
+    srgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(srgb <= 0.04045, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ _RGB_TO_XYZ.T / _D65_WHITE
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack(
+        [116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])],
+        axis=-1,
+    )
+
+
+def _bin_colors() -> np.ndarray:
+    """The RGB center of every quantization bin, indexed like `_quantize`."""
+    levels = (np.arange(_LEVELS) << _SHIFT) + (1 << _SHIFT) // 2
+    r, g, b = np.meshgrid(levels, levels, levels, indexing="ij")
+    return np.stack([r, g, b], axis=-1).reshape(-1, 3)
+
+
+_BIN_RGB = _bin_colors()
+_BIN_LAB = rgb_to_lab(_BIN_RGB)
+_BIN_NEUTRAL = np.hypot(_BIN_LAB[:, 1], _BIN_LAB[:, 2]) < NEUTRAL_CHROMA
+
+
+def _quantize(image_bytes: bytes) -> np.ndarray:
+    """Pixel counts per quantization bin of a downscaled copy of the image."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.draft("RGB", (SCORE_SIZE, SCORE_SIZE))
+        image = image.convert("RGB")
+        image.thumbnail((SCORE_SIZE, SCORE_SIZE), Image.Resampling.NEAREST)
+        pixels = np.asarray(image, dtype=np.uint16).reshape(-1, 3) >> _SHIFT
+    bins = (pixels[:, 0] << (2 * QUANTIZE_BITS)) | (pixels[:, 1] << QUANTIZE_BITS) | pixels[:, 2]
+    return np.bincount(bins, minlength=_LEVELS**3)
+
+
+@dataclass(frozen=True)
+class PaletteScore:
+    """How closely an image keeps to the brand palette.
+
+    Attributes:
+        score: 0-1, the share of non-neutral pixels close to a brand color,
+            weighted by how close they are.
+        coverage: Share of all pixels close to each brand color, by name.
+        off_brand_colors: The most common colors far from every brand color.
+    """
+
+    score: float
+    coverage: Dict[str, float] = field(default_factory=dict)
+    off_brand_colors: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "score": round(self.score, 3),
+            "coverage": {name: round(share, 3) for name, share in self.coverage.items()},
+            "off_brand_colors": self.off_brand_colors,
+        }
+
+
+class BrandPalette:
+    """Scores images against the brand colors in a perceptual color space.
+
+    The CIELAB distance from every quantization bin to its nearest brand color
+    is computed once, so scoring an image is a histogram of its downscaled
+    pixels and a few dot products.
+
+    Args:
+        colors: Brand color hex codes by name.
+    """
+
+    def __init__(self, colors: Mapping[str, str]):
+        self.colors = dict(colors)
+        brand_rgb = np.array(
+            [[int(code.lstrip("#")[i : i + 2], 16) for i in (0, 2, 4)] for code in self.colors.values()],
+            dtype=np.float64,
+        ).reshape(-1, 3)
+        distances = np.linalg.norm(_BIN_LAB[:, None, :] - rgb_to_lab(brand_rgb)[None, :, :], axis=-1)
+        self._nearest = distances.argmin(axis=1)
+        self._delta_e = distances.min(axis=1)
+        self._closeness = np.clip(
+            (MAX_DELTA_E - self._delta_e) / (MAX_DELTA_E - MATCH_DELTA_E), 0.0, 1.0
+        )
+        self._on_brand = self._delta_e <= MAX_DELTA_E
+        # Neutrals only count when they are themselves a brand color.
+        self._considered = ~_BIN_NEUTRAL | self._on_brand
+
+    @classmethod
+    def from_config(cls, brand_colors: Mapping[str, str]) -> Optional["BrandPalette"]:
+        """Build the palette from `CLIENT_VISUAL_CONFIG['brand_colors']`.
+
+        Returns:
+            The palette, or None while the brand colors are unconfigured.
+        """
+        colors = {}
+        for role, code in brand_colors.items():
+            match = _HEX_PATTERN.match(str(code).strip())
+            if role.endswith("_name") or match is None:
+                continue
+            colors[brand_colors.get(f"{role}_name", role)] = f"#{match.group(1).lower()}"
+        return cls(colors) if colors else None
+
+    def score(self, image_bytes: bytes) -> PaletteScore:
+        """Score one image.
+
+        Args:
+            image_bytes: The encoded image.
+
+        Returns:
+            Its PaletteScore.
+        """
+        counts = _quantize(image_bytes).astype(np.float64)
+        total = counts.sum()
+        considered = counts * self._considered
+        considered_total = considered.sum()
+        score = float(considered @ self._closeness / considered_total) if considered_total else 0.0
+
+        on_brand = counts * self._on_brand
+        coverage = {
+            name: float(on_brand[self._nearest == index].sum() / total) if total else 0.0
+            for index, name in enumerate(self.colors)
+        }
+
+        off_brand = np.where(self._considered & ~self._on_brand, counts, 0)
+        top_bins = [index for index in np.argsort(off_brand)[::-1][:OFF_BRAND_COLORS] if off_brand[index]]
+        off_brand_colors = ["#%02x%02x%02x" % tuple(_BIN_RGB[index]) for index in top_bins]
+        return PaletteScore(score=score, coverage=coverage, off_brand_colors=off_brand_colors)
+
+    def best(self, candidates: Sequence[bytes]) -> Tuple[int, List[PaletteScore]]:
+        """Score every candidate and pick the most on-brand one.
+
+        Returns:
+            The index of the best candidate and the scores of all of them.
+        """
+        scores = [self.score(candidate) for candidate in candidates]
+        best_index = max(range(len(scores)), key=lambda index: scores[index].score)
+        return best_index, scores
@@ -0,0 +1,292 @@
+import asyncio
+import re
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+# PNG previews are optional; cairosvg raises OSError when the cairo library is missing.
+try:
+    import cairosvg
+except (ImportError, OSError):
+    cairosvg = None
+
+from MarketingAgent.config import config
+from MarketingAgent.deadlines import with_deadline
+
+SVG_NAMESPACE = "http://www.w3.org/2000/svg"
+XLINK_NAMESPACE = "http://www.w3.org/1999/xlink"
+
+# Most elements accepted in one SVG, and drawn once every <use> is expanded,
+# to keep rendering cheap; nested <use> could otherwise multiply them.
+MAX_ELEMENTS = 2000
+MAX_EXPANDED_ELEMENTS = 10_000
+
+# Static shapes, text, paint servers and references within the document. No
+# scripts, styles, animation, foreign content or embedded images.
+ALLOWED_ELEMENTS = frozenset(
+    {
+        "svg", "g", "defs", "title", "desc", "symbol", "use",
+        "path", "rect", "circle", "ellipse", "line", "polyline", "polygon",
+        "text", "tspan",
+        "linearGradient", "radialGradient", "stop", "pattern", "clipPath", "mask",
+    }
+)
+
+# Geometry and presentation attributes; `style` is left out, colors go in `fill` and `stroke`.
+ALLOWED_ATTRIBUTES = frozenset(
+    {
+        "id", "class", "role", "aria-label", "aria-hidden", "version",
+        "viewBox", "preserveAspectRatio", "width", "height", "transform",
+        "x", "y", "x1", "y1", "x2", "y2", "cx", "cy", "r", "rx", "ry", "fx", "fy",
+        "dx", "dy", "d", "points", "pathLength", "href",
+        "fill", "fill-opacity", "fill-rule", "opacity", "visibility", "display",
+        "stroke", "stroke-width", "stroke-opacity", "stroke-linecap", "stroke-linejoin",
+        "stroke-dasharray", "stroke-dashoffset", "stroke-miterlimit",
+        "clip-path", "clip-rule", "mask", "offset", "stop-color", "stop-opacity",
+        "gradientUnits", "gradientTransform", "spreadMethod",
+        "patternUnits", "patternContentUnits", "patternTransform",
+        "clipPathUnits", "maskUnits", "maskContentUnits",
+        "font-family", "font-size", "font-weight", "font-style",
+        "text-anchor", "dominant-baseline", "letter-spacing",
+    }
+)
+
+_COLOR_ATTRIBUTES = ("fill", "stroke", "stop-color")
+_SVG_PATTERN = re.compile(r"<svg\b.*</svg\s*>", re.DOTALL | re.IGNORECASE)
+# DOCTYPE, ENTITY and CDATA declarations; comments are fine.
+_DECLARATION_PATTERN = re.compile(r"<!(?!--)")
+_LOCAL_REFERENCE_PATTERN = re.compile(r"""url\(\s*['"]?#[\w.:-]+['"]?\s*\)""")
+_HEX_COLOR_PATTERN = re.compile(r"#(?:[0-9a-fA-F]{6}|[0-9a-fA-F]{3})\b")
+_NUMBER_PATTERN = re.compile(r"\s*(\d+(?:\.\d+)?)\s*(?:px)?\s*$")
+
+
+class InvalidSvgError(ValueError):
+    """Raised when model output is not usable SVG markup."""
+
+
+@dataclass(frozen=True)
+class SanitizedSvg:
+    """SVG markup that is safe to store, serve and render.
+
+    Attributes:
+        markup: The cleaned document, in the default SVG namespace.
+        colors: The hex colors it paints with, lowercased, in order of first use.
+        removed: What was stripped, e.g. "element script" or "attribute onclick".
+    """
+
+    markup: str
+    colors: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+
+def _local_name(name: str) -> str:
+    return name.rsplit("}", 1)[-1]
+
+
+def _namespace(name: str) -> str:
+    return name[1:].split("}", 1)[0] if name.startswith("{") else ""
+
+
+def _safe_value(name: str, value: str) -> bool:
+    """Whether an attribute value only refers to things inside the document."""
+    if name == "href":
+        return value.strip().startswith("#")
+    if "url(" in value:
+        return "url(" not in _LOCAL_REFERENCE_PATTERN.sub("", value)
+    return "javascript:" not in value.lower()
+
+
+def _clean_attributes(element: ET.Element, removed: List[str]) -> None:
+    for name, value in list(element.attrib.items()):
+        del element.attrib[name]
+        local = _local_name(name)
+        namespace = _namespace(name)
+        # xlink:href is kept as the SVG 2 `href`.
+        if namespace not in ("", XLINK_NAMESPACE) or (namespace == XLINK_NAMESPACE and local != "href"):
+            removed.append(f"attribute {local}")
+        elif local not in ALLOWED_ATTRIBUTES or not _safe_value(local, value):
+            removed.append(f"attribute {local}")
+        else:
+            element.set(local, value)
+
+
+def _clean(element: ET.Element, removed: List[str], count: List[int]) -> None:
+    """Strip disallowed children and attributes of `element`, recursively."""
+    _clean_attributes(element, removed)
+    if _local_name(element.tag) not in ("text", "tspan", "title", "desc"):
+        element.text = None
+    for child in list(element):
+        namespace = _namespace(child.tag)
+        local = _local_name(child.tag)
+        if namespace not in ("", SVG_NAMESPACE) or local not in ALLOWED_ELEMENTS or local == "svg":
+            element.remove(child)
+            removed.append(f"element {local}")
+            continue
+        count[0] += 1
+        if count[0] > MAX_ELEMENTS:
+            raise InvalidSvgError(f"The SVG has more than {MAX_ELEMENTS} elements")
+        child.tag = local
+        if local not in ("text", "tspan"):
+            child.tail = None
+        _clean(child, removed, count)
+
+
+def _check_expansion(root: ET.Element) -> None:
+    """Reject documents whose <use> references expand past MAX_EXPANDED_ELEMENTS or loop.
+
+    Call after `_clean`, which leaves `href` as the only reference attribute.
+    """
+    by_id = {element.get("id"): element for element in root.iter() if element.get("id")}
+    sizes: Dict[int, int] = {}
+
+    def expanded(element: ET.Element, expanding: Set[int]) -> int:
+        key = id(element)
+        if key in sizes:
+            return sizes[key]
+        if key in expanding:
+            raise InvalidSvgError("The SVG has a <use> that refers to itself")
+        expanding.add(key)
+        size = 1 + sum(expanded(child, expanding) for child in element)
+        if element.tag == "use":
+            target = by_id.get(element.get("href", "").strip()[1:])
+            if target is not None:
+                size += expanded(target, expanding)
+        expanding.discard(key)
+        if size > MAX_EXPANDED_ELEMENTS:
+            raise InvalidSvgError(
+                f"The SVG draws more than {MAX_EXPANDED_ELEMENTS} elements once <use> is expanded"
+            )
+        sizes[key] = size
+        return size
+
+    expanded(root, set())
+
+
+def _ensure_view_box(root: ET.Element) -> None:
+    """Derive a viewBox from a numeric size, so the image scales."""
+    if root.get("viewBox"):
+        return
+    width = _NUMBER_PATTERN.match(root.get("width", ""))
+    height = _NUMBER_PATTERN.match(root.get("height", ""))
+    if not (width and height):
+        raise InvalidSvgError("The <svg> element needs a viewBox")
+    root.set("viewBox", f"0 0 {width[1]} {height[1]}")
+
+
+def _colors(root: ET.Element) -> List[str]:
+    colors: List[str] = []
+    for element in root.iter():
+        for name in _COLOR_ATTRIBUTES:
+            for color in _HEX_COLOR_PATTERN.findall(element.get(name, "")):
+                color = color.lower()
+                if len(color) == 4:
+                    color = "#" + "".join(2 * c for c in color[1:])
+                if color not in colors:
+                    colors.append(color)
+    return colors
+
+
+def sanitize_svg(text: str, max_bytes: Optional[int] = None) -> SanitizedSvg:
+    """Extract, validate and sanitize the SVG document in a model response.
+
+    Anything outside the first `<svg>...</svg>` (prose, code fences) is
+    ignored. Inside it only the allowlisted elements and attributes are kept,
+    and references must point into the document, so the result cannot run
+    script or load anything when a browser or the rasterizer opens it.
+
+    Args:
+        text: The model response.
+        max_bytes: Largest accepted markup; defaults to SVG_MAX_KB.
+
+    Returns:
+        The sanitized SVG.
+
+    Raises:
+        InvalidSvgError: If there is no well-formed, reasonably sized SVG
+            document in the text.
+    """
+    max_bytes = config.SVG_MAX_KB * 1024 if max_bytes is None else max_bytes
+    match = _SVG_PATTERN.search(text or "")
+    if match is None:
+        raise InvalidSvgError("The response contains no <svg> document")
+    markup = match.group(0)
+    if len(markup.encode("utf-8")) > max_bytes:
+        raise InvalidSvgError(f"The SVG is larger than {max_bytes // 1024} KB")
+    if _DECLARATION_PATTERN.search(markup):
+        raise InvalidSvgError("The SVG contains a DOCTYPE, ENTITY or CDATA declaration")
+
+    try:
+        root = ET.fromstring(markup)
+    except ET.ParseError as e:
+        raise InvalidSvgError(f"The SVG is not well-formed XML: {e}") from e
+    if _local_name(root.tag) != "svg" or _namespace(root.tag) not in ("", SVG_NAMESPACE):
+        raise InvalidSvgError("The document's root element is not <svg>")
+
+    removed: List[str] = []
+    root.tag = "svg"
+    _clean(root, removed, [1])
+    _check_expansion(root)
+    _ensure_view_box(root)
+    if not len(root):
+        raise InvalidSvgError("The SVG draws nothing")
+    root.set("xmlns", SVG_NAMESPACE)
+
+    return SanitizedSvg(
+        markup=ET.tostring(root, encoding="unicode"),
+        colors=_colors(root),
+        removed=sorted(set(removed)),
+    )
+
+
+_raster_pool: Optional[ThreadPoolExecutor] = None
+_raster_pool_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _raster_pool
+    with _raster_pool_lock:
+        if _raster_pool is None:
+            _raster_pool = ThreadPoolExecutor(
+                max_workers=max(1, config.SVG_RASTER_WORKERS), thread_name_prefix="svg-raster"
+            )
+        return _raster_pool
+
+
+def can_rasterize() -> bool:
+    """Whether PNG previews are enabled and cairosvg is installed."""
+    return cairosvg is not None and config.SVG_PREVIEW_SIZE > 0
+
+
+def _render_png(markup: str, width: int) -> bytes:
+    # unsafe=False keeps cairosvg from resolving external files and entities.
+    return cairosvg.svg2png(bytestring=markup.encode("utf-8"), output_width=width, unsafe=False)
+
+
+async def rasterize_svg(markup: str, width: Optional[int] = None) -> Optional[bytes]:
+    """Render sanitized SVG to a PNG preview on the raster worker pool.
+
+    Rendering is CPU-bound, so it runs on SVG_RASTER_WORKERS threads shared
+    by every session instead of on the event loop. The preview is given up
+    after SVG_RENDER_TIMEOUT_SECONDS or when the turn's deadline passes; the
+    render itself cannot be interrupted and finishes in the background.
+
+    Args:
+        markup: Sanitized SVG markup.
+        width: Preview width in pixels; defaults to SVG_PREVIEW_SIZE.
+
+    Returns:
+        The PNG bytes, or None when previews are unavailable or rendering failed.
+    """
+    if not can_rasterize():
+        return None
+    loop = asyncio.get_running_loop()
+    try:
+        return await with_deadline(
+            loop.run_in_executor(_pool(), _render_png, markup, width or config.SVG_PREVIEW_SIZE),
+            config.SVG_RENDER_TIMEOUT_SECONDS,
+        )
+    except Exception as e:
+        print(f"Error rendering SVG preview: {e}")
+        return None
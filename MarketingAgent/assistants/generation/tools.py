@@ -1,13 +1,45 @@
+import asyncio
 from typing import Any
 from typing import Dict
+from typing import List
 from typing import Optional
+from typing import Tuple
 
 from google.adk.tools import ToolContext
 from google.genai import types
 
 from MarketingAgent.config import GeminiModelOptions
+from MarketingAgent.config import config
 from MarketingAgent.config import genai_client
+from MarketingAgent.assistants.common import artifact_filename
 from MarketingAgent.assistants.common import save_image_to_cache
+from MarketingAgent.brand import Brand
+from MarketingAgent.brand import brand_registry
+from MarketingAgent.brand import current_brand
+from MarketingAgent.circuits import ModelUnavailableError
+from MarketingAgent.circuits import circuit_breaker
+from MarketingAgent.deadlines import DeadlineExceededError
+from MarketingAgent.deadlines import check_deadline
+from MarketingAgent.deadlines import with_deadline
+from MarketingAgent.assistants.generation.dedup import prompt_index
+from MarketingAgent.assistants.generation.palette import BrandPalette
+from MarketingAgent.assistants.generation.palette import PaletteScore
+from MarketingAgent.assistants.generation.svg import InvalidSvgError
+from MarketingAgent.assistants.generation.svg import rasterize_svg
+from MarketingAgent.assistants.generation.svg import sanitize_svg
+from MarketingAgent.assistants.gallery import index_asset
+from MarketingAgent.assistants.lineage import lineage_store
+from MarketingAgent.assistants.memory import generation_footprint
+from MarketingAgent.assistants.memory import with_image_memory
+from MarketingAgent.jobs import job_queue
+from MarketingAgent.jobs import submit_job
+from MarketingAgent.ledger import UNSCOPED
+from MarketingAgent.ledger import BudgetExceededError
+from MarketingAgent.ledger import current_scope
+from MarketingAgent.ledger import ledger
+from MarketingAgent.progress import ProgressStage
+from MarketingAgent.progress import emit_progress
+from MarketingAgent.progress import image_preview
 
 # CLIENT VISUAL IDENTITY CONFIGURATION
 CLIENT_VISUAL_CONFIG = {
@@ -37,36 +69,41 @@ CLIENT_VISUAL_CONFIG = {
     "brand_personality": "{BRAND_PERSONALITY}"
 }
 
-GUIDELINES = f"""
+brand_registry.register("visual", CLIENT_VISUAL_CONFIG)
+
+
+def render_guidelines(visual: Dict[str, Any]) -> str:
+    """Render the brand guidelines sent with every prompt enhancement."""
+    return f"""
 <visual_identity>
 <brand_colors>
 Primary Colors:
-- {CLIENT_VISUAL_CONFIG['brand_colors']['primary_name']}: {CLIENT_VISUAL_CONFIG['brand_colors']['primary']} - {CLIENT_VISUAL_CONFIG['brand_personality']}
-- {CLIENT_VISUAL_CONFIG['brand_colors']['secondary_name']}: {CLIENT_VISUAL_CONFIG['brand_colors']['secondary']} - {CLIENT_VISUAL_CONFIG['brand_colors']['secondary_name']} represents innovation and trust
-- {CLIENT_VISUAL_CONFIG['brand_colors']['accent_name']}: {CLIENT_VISUAL_CONFIG['brand_colors']['accent']} - Used for highlights and accents
+- {visual['brand_colors']['primary_name']}: {visual['brand_colors']['primary']} - {visual['brand_personality']}
+- {visual['brand_colors']['secondary_name']}: {visual['brand_colors']['secondary']} - {visual['brand_colors']['secondary_name']} represents innovation and trust
+- {visual['brand_colors']['accent_name']}: {visual['brand_colors']['accent']} - Used for highlights and accents
 
-Always use these exact hex codes. {CLIENT_VISUAL_CONFIG['brand_colors']['primary_name']} should dominate visual elements.
+Always use these exact hex codes. {visual['brand_colors']['primary_name']} should dominate visual elements.
 </brand_colors>
 
 <logo_guidelines>
-- {CLIENT_VISUAL_CONFIG['logo_guidelines']['style']}
-- {CLIENT_VISUAL_CONFIG['logo_guidelines']['colors']}
-- {CLIENT_VISUAL_CONFIG['logo_guidelines']['elements']}
-- {CLIENT_VISUAL_CONFIG['logo_guidelines']['restrictions']}
+- {visual['logo_guidelines']['style']}
+- {visual['logo_guidelines']['colors']}
+- {visual['logo_guidelines']['elements']}
+- {visual['logo_guidelines']['restrictions']}
 - Never alter proportions, colors, or orientation
 - Maintain clear space around logo
 </logo_guidelines>
 
 <imagery_style>
-- {CLIENT_VISUAL_CONFIG['imagery_style']['composition']}
-- {CLIENT_VISUAL_CONFIG['imagery_style']['subject_matter']}
-- {CLIENT_VISUAL_CONFIG['imagery_style']['setting']}
-- {CLIENT_VISUAL_CONFIG['imagery_style']['mood']}
-- {CLIENT_VISUAL_CONFIG['imagery_style']['style']}
+- {visual['imagery_style']['composition']}
+- {visual['imagery_style']['subject_matter']}
+- {visual['imagery_style']['setting']}
+- {visual['imagery_style']['mood']}
+- {visual['imagery_style']['style']}
 - Incorporate brand colors naturally in backgrounds and settings
-- Avoid {CLIENT_VISUAL_CONFIG['imagery_style']['avoid']}
+- Avoid {visual['imagery_style']['avoid']}
 - Hero images should showcase products and reinforce campaign themes
-- Focus on {CLIENT_VISUAL_CONFIG['industry_focus']} industry context and scenarios
+- Focus on {visual['industry_focus']} industry context and scenarios
 </imagery_style>
 </visual_identity>
 
@@ -76,7 +113,7 @@ Professional, informative, solution-focused. Balance technical accuracy with acc
 </website>
 
 <social_media>
-Visual how-tos, team stories, {CLIENT_VISUAL_CONFIG['industry_focus']} lifestyle content. Keep approachable and community-focused.
+Visual how-tos, team stories, {visual['industry_focus']} lifestyle content. Keep approachable and community-focused.
 </social_media>
 
 <customer_service>
@@ -96,17 +133,73 @@ INSTRUCTIONS = """
 <avoid>Adding any other elements that are not part of the brand guidelines.</avoid>
 <avoid>Adding the company name or any other brand name to the image.</avoid>
 <response_output>A single paragraph of text with the enhanced prompt.</response_output>
-""".format(CLIENT_NAME="{CLIENT_NAME}")
+"""
+
+SVG_INSTRUCTIONS = """
+<who_are_you>You are a professional brand designer for {CLIENT_NAME}, drawing icons and UI widgets as SVG.</who_are_you>
+<tasks>
+  <task>Draw what the user requested as a single, self-contained SVG document.</task>
+  <task>Paint only with the brand colors, plus white or a dark neutral where contrast needs it. {PRIMARY_COLOR_NAME} ({PRIMARY_COLOR}) should dominate, {SECONDARY_COLOR_NAME} ({SECONDARY_COLOR}) supports it and {ACCENT_COLOR_NAME} ({ACCENT_COLOR}) is for highlights.</task>
+  <task>Keep it simple and legible at small sizes: flat shapes, consistent stroke widths, no photographic detail.</task>
+</tasks>
+<requirements>
+  <requirement>The root element is <svg xmlns="http://www.w3.org/2000/svg"> with a viewBox.</requirement>
+  <requirement>Use shapes, paths, text, groups and gradients only. Set colors with fill and stroke attributes.</requirement>
+  <requirement>No script, style, animation, foreignObject, image or external references.</requirement>
+</requirements>
+<response_output>Only the SVG markup, without explanation or code fences.</response_output>
+"""
+
+# Model calls per SVG request; a failed validation is sent back for one retry.
+SVG_ATTEMPTS = 2
+
+# Imagen bills every returned image; the most on-brand one is kept.
+IMAGES_PER_GENERATION = 2
 
 
-def _enhanche_prompt(prompt: str) -> str:
-    """Enhance the prompt for better image generation."""
+def _brand_guidelines(brand: Brand) -> Tuple[str, str]:
+    """The enhancement instructions and brand guidelines, rendered once per configuration."""
+
+    def render() -> Tuple[str, str]:
+        client_name = brand.section("client").get("client_name", "{CLIENT_NAME}")
+        guidelines = render_guidelines(brand.section("visual"))
+        return (
+            INSTRUCTIONS.format(CLIENT_NAME=client_name),
+            f"<brand_guidelines>{guidelines}</brand_guidelines>",
+        )
+
+    return brand.memo("enhance_prompt", render)
+
+
+def _brand_palette() -> Optional[BrandPalette]:
+    """The palette of the current tenant's brand.
+
+    None until the brand colors are real hex codes, which disables screening.
+    """
+    brand = current_brand()
+    return brand.memo(
+        "palette", lambda: BrandPalette.from_config(brand.section("visual").get("brand_colors", {}))
+    )
+
+
+def _tenant_id() -> str:
+    scope = current_scope.get()
+    return scope.tenant_id if scope else UNSCOPED
+
+
+async def _enhanche_prompt(prompt: str, brand: Brand) -> str:
+    """Enhance the prompt for better image generation, following the brand's guidelines."""
     user_request = f"<user_request>{prompt}</user_request>"
-    brand_guidelines = f"<brand_guidelines>{GUIDELINES}</brand_guidelines>"
-    response = genai_client.models.generate_content(
-        model=GeminiModelOptions.GEMINI_2_0_FLASH,
-        contents=[INSTRUCTIONS, brand_guidelines, user_request],
+    instructions, brand_guidelines = _brand_guidelines(brand)
+    response = await with_deadline(
+        circuit_breaker(GeminiModelOptions.GEMINI_2_0_FLASH).call_async(
+            genai_client.aio.models.generate_content,
+            model=GeminiModelOptions.GEMINI_2_0_FLASH,
+            contents=[instructions, brand_guidelines, user_request],
+        ),
+        config.TEXT_MODEL_TIMEOUT_SECONDS,
     )
+    ledger.record_response(GeminiModelOptions.GEMINI_2_0_FLASH, response)
 
     if not response or not response.text:
         return prompt
@@ -114,45 +207,164 @@ def _enhanche_prompt(prompt: str) -> str:
     return response.text
 
 
-def _generate_image_with_imagen(
-    prompt: str, number_of_images: int = 2, aspect_ratio: str = "1:1"
-) -> Optional[bytes]:
-    """Generate images using Imagen 3.0 and return the first image's bytes.
+def _svg_instructions(brand: Brand) -> str:
+    """The SVG drawing instructions with the brand's colors, rendered once per configuration."""
+
+    def render() -> str:
+        colors = brand.section("visual")["brand_colors"]
+        return SVG_INSTRUCTIONS.format(
+            CLIENT_NAME=brand.section("client").get("client_name", "{CLIENT_NAME}"),
+            PRIMARY_COLOR_NAME=colors["primary_name"],
+            PRIMARY_COLOR=colors["primary"],
+            SECONDARY_COLOR_NAME=colors["secondary_name"],
+            SECONDARY_COLOR=colors["secondary"],
+            ACCENT_COLOR_NAME=colors["accent_name"],
+            ACCENT_COLOR=colors["accent"],
+        )
+
+    return brand.memo("svg_instructions", render)
+
+
+async def _draw_svg(prompt: str, brand: Brand, previous_error: str = "") -> str:
+    """Ask Gemini Flash for SVG markup of the request."""
+    contents = [_svg_instructions(brand), f"<user_request>{prompt}</user_request>"]
+    if previous_error:
+        contents.append(
+            f"<previous_attempt_error>{previous_error}. Fix this in your answer.</previous_attempt_error>"
+        )
+    response = await with_deadline(
+        circuit_breaker(GeminiModelOptions.GEMINI_2_0_FLASH).call_async(
+            genai_client.aio.models.generate_content,
+            model=GeminiModelOptions.GEMINI_2_0_FLASH,
+            contents=contents,
+            config=types.GenerateContentConfig(temperature=0.2),
+        ),
+        config.TEXT_MODEL_TIMEOUT_SECONDS,
+    )
+    ledger.record_response(GeminiModelOptions.GEMINI_2_0_FLASH, response)
+    if not response or not response.text:
+        return ""
+    return response.text
+
+
+async def _generate_images_with_imagen(
+    prompt: str, number_of_images: int = IMAGES_PER_GENERATION, aspect_ratio: str = "1:1"
+) -> List[bytes]:
+    """Generate images using Imagen 3.0.
 
     Args:
-        prompt: The text prompt for image generation.
-        number_of_images: Number of images to generate (defaults to 2).
+        prompt: The enhanced text prompt for image generation.
+        number_of_images: Number of images to generate (defaults to IMAGES_PER_GENERATION).
         aspect_ratio: The aspect ratio of the generated images (defaults to "1:1").
 
     Returns:
-        bytes: The raw image bytes of the first generated image, or None if generation failed.
+        The raw image bytes of every generated image, empty if generation failed.
+
+    Raises:
+        BudgetExceededError: If the session or tenant image budget is exhausted.
+        ModelUnavailableError: If the project cannot use the Imagen model.
+        DeadlineExceededError: If the turn's deadline passed first.
     """
-    prompt = _enhanche_prompt(prompt)
+    ledger.check_budget(images=number_of_images)
     try:
-        response = genai_client.models.generate_images(
-            model=GeminiModelOptions.IMAGEN_3_0_GENERATE,
-            prompt=prompt,
-            config=types.GenerateImagesConfig(
-                number_of_images=number_of_images,
-                aspect_ratio=aspect_ratio,  # Square image
-                enhance_prompt=True,
+        response = await with_deadline(
+            with_image_memory(
+                generation_footprint(number_of_images),
+                circuit_breaker(GeminiModelOptions.IMAGEN_3_0_GENERATE).call_async(
+                    genai_client.aio.models.generate_images,
+                    model=GeminiModelOptions.IMAGEN_3_0_GENERATE,
+                    prompt=prompt,
+                    config=types.GenerateImagesConfig(
+                        number_of_images=number_of_images,
+                        aspect_ratio=aspect_ratio,  # Square image
+                        enhance_prompt=True,
+                    ),
+                ),
             ),
+            config.IMAGE_GENERATION_TIMEOUT_SECONDS,
+        )
+        ledger.record(
+            GeminiModelOptions.IMAGEN_3_0_GENERATE,
+            images=len(response.generated_images or []),
         )
 
-        # Return the first image's bytes if images were generated
-        if response.generated_images and len(response.generated_images) > 0:
-            return response.generated_images[0].image.image_bytes
-
-        return None
+        return [
+            generated.image.image_bytes
+            for generated in response.generated_images or []
+            if generated.image and generated.image.image_bytes
+        ]
 
+    except (ModelUnavailableError, DeadlineExceededError):
+        raise
     except Exception as e:
         print(f"Error generating image with Imagen: {e}")
-        return None
+        return []
+
+
+def _pick_on_brand(candidates: List[bytes]) -> Tuple[bytes, Optional[PaletteScore]]:
+    """The candidate closest to the brand palette, or the first one without a palette."""
+    brand_palette = _brand_palette()
+    if brand_palette is None:
+        return candidates[0], None
+    best_index, scores = brand_palette.best(candidates)
+    return candidates[best_index], scores[best_index]
+
+
+def _on_brand_prompt(prompt: str, palette_score: PaletteScore) -> str:
+    """Restate the brand colors for a regeneration of an off-brand image."""
+    colors = ", ".join(f"{name} ({code})" for name, code in _brand_palette().colors.items())
+    prompt += f"\nUse the brand colors {colors} prominently, with the first one dominating."
+    if palette_score.off_brand_colors:
+        prompt += f" Avoid colors such as {', '.join(palette_score.off_brand_colors)}."
+    return prompt
+
+
+async def _regenerate_off_brand(
+    enhanced_prompt: str, image_bytes: bytes, palette_score: Optional[PaletteScore]
+) -> Tuple[bytes, Optional[PaletteScore], int]:
+    """Regenerate while the best image scores below PALETTE_MIN_SCORE.
+
+    Stops after PALETTE_MAX_REGENERATIONS attempts or when the image budget
+    runs out, keeping the most on-brand image seen.
+
+    Returns:
+        The kept image, its palette score and the number of regenerations.
+    """
+    regenerations = 0
+    while (
+        palette_score is not None
+        and config.PALETTE_MIN_SCORE is not None
+        and palette_score.score < config.PALETTE_MIN_SCORE
+        and regenerations < config.PALETTE_MAX_REGENERATIONS
+    ):
+        regenerations += 1
+        emit_progress(
+            "generate_image",
+            ProgressStage.REQUEST_SENT,
+            model=GeminiModelOptions.IMAGEN_3_0_GENERATE.value,
+            regeneration=regenerations,
+            palette_score=round(palette_score.score, 3),
+        )
+        try:
+            candidates = await _generate_images_with_imagen(
+                _on_brand_prompt(enhanced_prompt, palette_score)
+            )
+        except (BudgetExceededError, ModelUnavailableError, DeadlineExceededError) as e:
+            print(f"Stopping brand palette regeneration: {e}")
+            break
+        if not candidates:
+            break
+        candidate, candidate_score = await asyncio.to_thread(_pick_on_brand, candidates)
+        if candidate_score.score > palette_score.score:
+            image_bytes, palette_score = candidate, candidate_score
+    return image_bytes, palette_score, regenerations
 
 
 async def generate_image(
     prompt: str,
     tool_context: ToolContext,
+    allow_reuse: bool = True,
+    run_in_background: bool = False,
 ) -> Dict[str, Any]:
     """Tool to generate an image based on a text prompt and save it as an artifact.
 
@@ -162,19 +374,87 @@ async def generate_image(
     Args:
         prompt: The text prompt for image generation.
         tool_context: The tool execution context with artifact service access.
+        allow_reuse: When True, existing images generated from a near-identical
+            prompt are offered instead of generating a new one. Set to False
+            once the user has declined the offered images.
+        run_in_background: When True, return a job id immediately and generate
+            the image on the background worker pool.
 
     Returns:
-        A dictionary with artifact information including filename and version.
+        A dictionary with artifact information including filename and version,
+        with `similar_images` to offer the user when reuse is possible, or with
+        the `job_id` of a background job.
     """
-    # Generate the image using Imagen
-    image_bytes = _generate_image_with_imagen(prompt)
+    if run_in_background:
+        return submit_job(
+            "generate_image", {"prompt": prompt, "allow_reuse": allow_reuse}, tool_context
+        )
+
+    # Images made under an earlier brand configuration are not offered for reuse.
+    brand = current_brand()
+    if allow_reuse:
+        matches = await asyncio.to_thread(
+            prompt_index.search,
+            prompt,
+            tenant_id=_tenant_id(),
+            threshold=config.PROMPT_REUSE_THRESHOLD,
+            config_hash=brand.config_hash,
+        )
+        if matches:
+            return {
+                "prompt": prompt,
+                "similar_images": [match.to_dict() for match in matches],
+                "message": (
+                    "Similar images already exist. Offer them to the user: call "
+                    "reuse_image with a node_id to use one, or generate_image with "
+                    "allow_reuse=False to create a new image."
+                ),
+                "success": True,
+            }
+
+    # Generate the image using Imagen; the calls are abandoned when the turn's deadline passes
+    try:
+        ledger.check_budget(images=IMAGES_PER_GENERATION)
+        enhanced_prompt = await _enhanche_prompt(prompt, brand)
+        emit_progress(
+            "generate_image", ProgressStage.PROMPT_ENHANCED, enhanced_prompt=enhanced_prompt
+        )
+        emit_progress(
+            "generate_image",
+            ProgressStage.REQUEST_SENT,
+            model=GeminiModelOptions.IMAGEN_3_0_GENERATE.value,
+        )
+        candidates = await _generate_images_with_imagen(enhanced_prompt)
+    except (BudgetExceededError, ModelUnavailableError, DeadlineExceededError) as e:
+        return {"prompt": prompt, "success": False, "error": str(e)}
+
+    if not candidates:
+        return {"prompt": prompt, "success": False, "error": "Image generation failed"}
+
+    # Keep the most on-brand candidate, regenerating if none is close enough
+    image_bytes, palette_score = await asyncio.to_thread(_pick_on_brand, candidates)
+    image_bytes, palette_score, regenerations = await _regenerate_off_brand(
+        enhanced_prompt, image_bytes, palette_score
+    )
+
+    emit_progress(
+        "generate_image",
+        ProgressStage.IMAGE_RECEIVED,
+        preview=image_preview(image_bytes),
+        palette_score=round(palette_score.score, 3) if palette_score else None,
+    )
+
+    # No one is waiting for the image once the turn's deadline has passed
+    try:
+        check_deadline()
+    except DeadlineExceededError as e:
+        return {"prompt": prompt, "success": False, "error": str(e)}
 
     # Create a Part object with the image data and MIME type
     image_artifact = types.Part.from_bytes(data=image_bytes, mime_type="image/png")
 
-    # Generate a filename based on the prompt
-    sanitized_prompt = "".join(c if c.isalnum() else "_" for c in prompt[:30])
-    filename = f"generated_image_{sanitized_prompt}.png"
+    # Generate a filename based on the prompt and the image
+    filename = artifact_filename("generated_image", prompt, image_bytes)
 
     saved_filepath = save_image_to_cache(image_bytes=image_bytes, filename=filename)
     if not saved_filepath:
@@ -191,14 +471,43 @@ async def generate_image(
             filename=filename, artifact=image_artifact
         )
 
+        emit_progress(
+            "generate_image",
+            ProgressStage.ARTIFACT_SAVED,
+            artifact_filename=filename,
+            artifact_version=version,
+        )
+
+        node = await asyncio.to_thread(
+            lineage_store.record,
+            image_bytes, filename=filename, operation="generate", prompt=prompt
+        )
+        await asyncio.to_thread(
+            prompt_index.add,
+            prompt,
+            enhanced_prompt=enhanced_prompt,
+            artifact_filename=filename,
+            node_id=node.node_id,
+            tenant_id=_tenant_id(),
+            config_hash=brand.config_hash,
+        )
+        await asyncio.to_thread(
+            index_asset, node, tool_context, prompt=prompt, enhanced_prompt=enhanced_prompt
+        )
+
         # Return metadata about the saved artifact
-        return {
+        result = {
             "prompt": prompt,
+            "node_id": node.node_id,
             "artifact_filename": filename,
             "artifact_version": version,
             "mime_type": "image/png",
             "success": True,
         }
+        if palette_score is not None:
+            result["brand_palette"] = palette_score.to_dict()
+            result["regenerations"] = regenerations
+        return result
     except ValueError as e:
         # Handle case where artifact service is not configured
         print(f"Error saving artifact: {e}. Is ArtifactService configured?")
@@ -214,4 +523,171 @@ async def generate_image(
             "prompt": prompt,
             "success": False,
             "error": f"Unexpected error: {str(e)}",
-        }
\ No newline at end of file
+        }
+
+
+async def reuse_image(
+    node_id: str,
+    tool_context: ToolContext,
+) -> Dict[str, Any]:
+    """Tool to reuse a previously generated image instead of generating a new one.
+
+    Args:
+        node_id: The node_id of an image offered in `similar_images`.
+        tool_context: The tool execution context with artifact service access.
+
+    Returns:
+        A dictionary with artifact information including filename and version.
+    """
+    # Only the current tenant's images resolve.
+    node = await asyncio.to_thread(lineage_store.resolve, node_id)
+    if node is None:
+        return {"node_id": node_id, "success": False, "error": "Image not found"}
+
+    try:
+        image_bytes = await asyncio.to_thread(lineage_store.load_bytes, node)
+        if not save_image_to_cache(image_bytes=image_bytes, filename=node.filename):
+            return {
+                "node_id": node_id,
+                "success": False,
+                "error": "Failed to save image to cache",
+            }
+
+        version = await tool_context.save_artifact(
+            filename=node.filename,
+            artifact=types.Part.from_bytes(data=image_bytes, mime_type="image/png"),
+        )
+
+        return {
+            "prompt": node.prompt,
+            "node_id": node.node_id,
+            "artifact_filename": node.filename,
+            "artifact_version": version,
+            "mime_type": "image/png",
+            "reused": True,
+            "success": True,
+        }
+    except Exception as e:
+        print(f"Unexpected error while reusing image: {e}")
+        return {
+            "node_id": node_id,
+            "success": False,
+            "error": f"Unexpected error: {str(e)}",
+        }
+
+
+async def generate_svg(
+    prompt: str,
+    tool_context: ToolContext,
+    preview: bool = True,
+) -> Dict[str, Any]:
+    """Tool to draw a brand-colored SVG icon, badge or widget and save it as an artifact.
+
+    The SVG is written by Gemini Flash, which takes seconds instead of an
+    Imagen call's tens of seconds, then validated and sanitized locally.
+
+    Args:
+        prompt: What to draw, e.g. "a calendar icon with a check mark".
+        tool_context: The tool execution context with artifact service access.
+        preview: When True, also render a PNG preview, if cairosvg is installed.
+
+    Returns:
+        A dictionary with the SVG artifact's filename and version, the colors
+        it uses, and the `preview_filename` and `node_id` of the PNG preview
+        when one was rendered.
+    """
+    brand = current_brand()
+    error = ""
+    try:
+        for attempt in range(SVG_ATTEMPTS):
+            emit_progress(
+                "generate_svg",
+                ProgressStage.REQUEST_SENT,
+                model=GeminiModelOptions.GEMINI_2_0_FLASH.value,
+                attempt=attempt + 1,
+            )
+            text = await _draw_svg(prompt, brand, previous_error=error)
+            try:
+                svg = sanitize_svg(text)
+                break
+            except InvalidSvgError as e:
+                error = str(e)
+                print(f"Rejected SVG for '{prompt[:30]}': {error}")
+        else:
+            return {"prompt": prompt, "success": False, "error": f"SVG generation failed: {error}"}
+    except (BudgetExceededError, ModelUnavailableError, DeadlineExceededError) as e:
+        return {"prompt": prompt, "success": False, "error": str(e)}
+
+    png_bytes = await rasterize_svg(svg.markup) if preview else None
+    emit_progress(
+        "generate_svg",
+        ProgressStage.IMAGE_RECEIVED,
+        preview=image_preview(png_bytes) if png_bytes else None,
+        colors=svg.colors,
+    )
+
+    # No one is waiting for the image once the turn's deadline has passed
+    try:
+        check_deadline()
+    except DeadlineExceededError as e:
+        return {"prompt": prompt, "success": False, "error": str(e)}
+
+    svg_bytes = svg.markup.encode("utf-8")
+    filename = artifact_filename("generated_svg", prompt, svg_bytes, extension="svg")
+    preview_filename = artifact_filename("generated_svg", prompt, svg_bytes)
+    if not save_image_to_cache(image_bytes=svg_bytes, filename=filename):
+        return {"prompt": prompt, "success": False, "error": "Failed to save image to cache"}
+
+    try:
+        version = await tool_context.save_artifact(
+            filename=filename,
+            artifact=types.Part.from_bytes(data=svg_bytes, mime_type="image/svg+xml"),
+        )
+        emit_progress(
+            "generate_svg",
+            ProgressStage.ARTIFACT_SAVED,
+            artifact_filename=filename,
+            artifact_version=version,
+        )
+        result = {
+            "prompt": prompt,
+            "artifact_filename": filename,
+            "artifact_version": version,
+            "mime_type": "image/svg+xml",
+            "colors": svg.colors,
+            "success": True,
+        }
+        if svg.removed:
+            result["removed"] = svg.removed
+
+        # The preview is what the editing tools and the asset gallery work with
+        if png_bytes and save_image_to_cache(image_bytes=png_bytes, filename=preview_filename):
+            result["preview_version"] = await tool_context.save_artifact(
+                filename=preview_filename,
+                artifact=types.Part.from_bytes(data=png_bytes, mime_type="image/png"),
+            )
+            node = await asyncio.to_thread(
+                lineage_store.record,
+                png_bytes, filename=preview_filename, operation="generate_svg", prompt=prompt
+            )
+            await asyncio.to_thread(index_asset, node, tool_context, prompt=prompt)
+            result["preview_filename"] = preview_filename
+            result["node_id"] = node.node_id
+        return result
+    except ValueError as e:
+        print(f"Error saving artifact: {e}. Is ArtifactService configured?")
+        return {
+            "prompt": prompt,
+            "success": False,
+            "error": "Artifact service not configured",
+        }
+    except Exception as e:
+        print(f"Unexpected error during artifact save: {e}")
+        return {
+            "prompt": prompt,
+            "success": False,
+            "error": f"Unexpected error: {str(e)}",
+        }
+
+
+job_queue.register("generate_image", generate_image, state_key="image_generation_output")
@@ -0,0 +1,388 @@
+import hashlib
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from string import hexdigits
+from typing import Any, Dict, List, Optional
+
+from PIL import Image, ImageChops, ImageStat
+
+from MarketingAgent.ledger import UNSCOPED
+from MarketingAgent.ledger import current_scope
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    tenant_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    parent_digest TEXT,
+    filename TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    edit_mode TEXT,
+    mask_mode TEXT,
+    prompt TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (tenant_id, digest)
+);
+CREATE INDEX IF NOT EXISTS nodes_parent ON nodes (tenant_id, parent_digest);
+CREATE TABLE IF NOT EXISTS names (
+    tenant_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (tenant_id, filename)
+);
+"""
+
+_COLUMNS = "digest, parent_digest, filename, operation, edit_mode, mask_mode, prompt, created_at, tenant_id"
+
+# Short digests shown to the agent; long enough to be unique in practice.
+NODE_ID_LENGTH = 12
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """SHA-256 hex digest identifying an image by its content."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+@dataclass(frozen=True)
+class LineageNode:
+    """One image in the edit graph and the operation that produced it."""
+
+    digest: str
+    parent_digest: Optional[str]
+    filename: str
+    operation: str
+    edit_mode: Optional[str]
+    mask_mode: Optional[str]
+    prompt: Optional[str]
+    created_at: float
+    tenant_id: str = UNSCOPED
+
+    @property
+    def node_id(self) -> str:
+        return self.digest[:NODE_ID_LENGTH]
+
+    def to_dict(self) -> Dict[str, Any]:
+        summary = asdict(self)
+        summary["node_id"] = self.node_id
+        summary["parent_node_id"] = (
+            self.parent_digest[:NODE_ID_LENGTH] if self.parent_digest else None
+        )
+        del summary["digest"], summary["parent_digest"], summary["tenant_id"]
+        return summary
+
+
+def _current_tenant() -> str:
+    scope = current_scope.get()
+    return scope.tenant_id if scope is not None else UNSCOPED
+
+
+class LineageStore:
+    """Records how every generated and edited image was derived.
+
+    Each image is a node keyed by its tenant and the digest of its bytes,
+    pointing at the digest of the image it was edited from. The bytes of every
+    node are kept as content-addressed blobs, so any ancestor can be restored
+    without another Imagen call.
+
+    Nodes and filenames belong to the tenant of the call that recorded them,
+    and lookups only see the current tenant's, so node ids and filenames of
+    other tenants cannot be used to reach their images. The methods block on
+    SQLite and disk; call them from async code with `asyncio.to_thread`.
+
+    Args:
+        cache_dir: The directory to keep the lineage database and blobs in.
+    """
+
+    def __init__(self, cache_dir: str = ".cache"):
+        self.root_dir = Path(cache_dir) / "lineage"
+        self.blob_dir = self.root_dir / "blobs"
+        self.db_path = self.root_dir / "lineage.db"
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if not self._initialized:
+                self.blob_dir.mkdir(parents=True, exist_ok=True)
+                with closing(sqlite3.connect(self.db_path, timeout=30, isolation_level=None)) as connection:
+                    connection.execute("PRAGMA journal_mode=WAL")
+                    connection.executescript(_SCHEMA)
+                self._initialized = True
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _write_blob(self, digest: str, image_bytes: bytes) -> None:
+        path = self.blob_dir / digest
+        if path.exists():
+            return
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.blob_dir, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(image_bytes)
+        os.replace(temp_path, path)
+
+    def load_bytes(self, node: LineageNode) -> bytes:
+        """Read the stored bytes of a node."""
+        return (self.blob_dir / node.digest).read_bytes()
+
+    def record(
+        self,
+        image_bytes: bytes,
+        filename: str,
+        operation: str,
+        parent_bytes: Optional[bytes] = None,
+        prompt: Optional[str] = None,
+        edit_mode: Optional[str] = None,
+        mask_mode: Optional[str] = None,
+    ) -> LineageNode:
+        """Record an image and the operation that produced it.
+
+        Args:
+            image_bytes: The resulting image.
+            filename: The cache and artifact filename the image was saved under.
+            operation: What produced the image, e.g. "generate" or "edit".
+            parent_bytes: The source image of an edit, if any. Sources that were
+                never recorded are added as "import" roots.
+            prompt: The prompt used for the operation.
+            edit_mode: The Imagen edit mode, for edits.
+            mask_mode: The Imagen mask mode, for masked edits.
+
+        Returns:
+            The recorded node, owned by the tenant of the current call.
+        """
+        tenant_id = _current_tenant()
+        parent_digest = None
+        if parent_bytes is not None:
+            parent_digest = image_digest(parent_bytes)
+            if self.get(parent_digest) is None:
+                self.record(parent_bytes, filename=f"imported_{parent_digest[:NODE_ID_LENGTH]}.png", operation="import")
+
+        node = LineageNode(
+            digest=image_digest(image_bytes),
+            parent_digest=parent_digest,
+            filename=filename,
+            operation=operation,
+            edit_mode=edit_mode,
+            mask_mode=mask_mode,
+            prompt=prompt,
+            created_at=time.time(),
+            tenant_id=tenant_id,
+        )
+        self._write_blob(node.digest, image_bytes)
+
+        with closing(self._connect()) as connection:
+            # The first derivation of identical bytes wins; later ones only rename.
+            connection.execute(
+                f"INSERT OR IGNORE INTO nodes ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    node.digest,
+                    node.parent_digest,
+                    node.filename,
+                    node.operation,
+                    node.edit_mode,
+                    node.mask_mode,
+                    node.prompt,
+                    node.created_at,
+                    node.tenant_id,
+                ),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO names VALUES (?, ?, ?)", (tenant_id, filename, node.digest)
+            )
+
+        return self.get(node.digest, tenant_id) or node
+
+    def claim_legacy(self, image_bytes: bytes, filename: str) -> Optional[LineageNode]:
+        """Record an image cached before the lineage store as the current tenant's.
+
+        Images made since are recorded when they are cached, so a file whose
+        name and content no tenant has recorded predates the store. The first
+        tenant to claim one owns it; later claims by other tenants fail.
+
+        Args:
+            image_bytes: The cached image.
+            filename: Its filename in the cache.
+
+        Returns:
+            The current tenant's node for the image, or None if another
+            tenant has recorded the name or the content.
+        """
+        tenant_id = _current_tenant()
+        node = LineageNode(
+            digest=image_digest(image_bytes),
+            parent_digest=None,
+            filename=filename,
+            operation="import",
+            edit_mode=None,
+            mask_mode=None,
+            prompt=None,
+            created_at=time.time(),
+            tenant_id=tenant_id,
+        )
+        self._write_blob(node.digest, image_bytes)
+
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                owners = {
+                    row[0]
+                    for row in connection.execute(
+                        "SELECT tenant_id FROM names WHERE filename = ?"
+                        " UNION SELECT tenant_id FROM nodes WHERE digest = ?",
+                        (filename, node.digest),
+                    )
+                }
+                if owners - {tenant_id}:
+                    connection.execute("ROLLBACK")
+                    return None
+                connection.execute(
+                    f"INSERT OR IGNORE INTO nodes ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        node.digest,
+                        node.parent_digest,
+                        node.filename,
+                        node.operation,
+                        node.edit_mode,
+                        node.mask_mode,
+                        node.prompt,
+                        node.created_at,
+                        node.tenant_id,
+                    ),
+                )
+                connection.execute(
+                    "INSERT OR IGNORE INTO names VALUES (?, ?, ?)", (tenant_id, filename, node.digest)
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+        print(f"Imported cached image {filename} into the lineage store")
+        return self.get(node.digest, tenant_id)
+
+    def get(self, digest: str, tenant_id: Optional[str] = None) -> Optional[LineageNode]:
+        """Look up a node by its full digest.
+
+        Args:
+            digest: The node's digest.
+            tenant_id: The tenant to look in; defaults to the current call's.
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                f"SELECT {_COLUMNS} FROM nodes WHERE tenant_id = ? AND digest = ?",
+                (tenant_id or _current_tenant(), digest),
+            ).fetchone()
+        return LineageNode(*row) if row else None
+
+    def nodes(self) -> List[LineageNode]:
+        """Every node of every tenant, oldest first, for maintenance such as reindexing."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(f"SELECT {_COLUMNS} FROM nodes ORDER BY created_at").fetchall()
+        return [LineageNode(*row) for row in rows]
+
+    def resolve(self, reference: str) -> Optional[LineageNode]:
+        """Find a node of the current tenant by filename or by node id (a digest prefix).
+
+        Args:
+            reference: An image filename or a node id from `ancestors`.
+
+        Returns:
+            The matching node, or None if the reference is unknown, ambiguous
+            or belongs to another tenant.
+        """
+        tenant_id = _current_tenant()
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT digest FROM names WHERE tenant_id = ? AND filename = ?",
+                (tenant_id, reference),
+            ).fetchone()
+            if row is None and len(reference) >= 6 and all(c in hexdigits for c in reference):
+                rows = connection.execute(
+                    "SELECT digest FROM nodes WHERE tenant_id = ? AND digest LIKE ? LIMIT 2",
+                    (tenant_id, reference.lower() + "%"),
+                ).fetchall()
+                row = rows[0] if len(rows) == 1 else None
+        return self.get(row[0], tenant_id) if row else None
+
+    def ancestors(self, node: LineageNode) -> List[LineageNode]:
+        """The node followed by its parent, grandparent and so on up to the root.
+
+        Only the node's own tenant's nodes are followed.
+        """
+        chain = [node]
+        seen = {node.digest}
+        while chain[-1].parent_digest and chain[-1].parent_digest not in seen:
+            parent = self.get(chain[-1].parent_digest, node.tenant_id)
+            if parent is None:
+                break
+            chain.append(parent)
+            seen.add(parent.digest)
+        return chain
+
+    def children(self, node: LineageNode) -> List[LineageNode]:
+        """Nodes edited directly from `node`, i.e. its branches."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                f"SELECT {_COLUMNS} FROM nodes WHERE tenant_id = ? AND parent_digest = ?"
+                " ORDER BY created_at",
+                (node.tenant_id, node.digest),
+            ).fetchall()
+        return [LineageNode(*row) for row in rows]
+
+    def diff(self, first: LineageNode, second: LineageNode) -> Dict[str, Any]:
+        """Compare two nodes by lineage and by pixels.
+
+        Args:
+            first: The node to compare from.
+            second: The node to compare to.
+
+        Returns:
+            The closest common ancestor, the operations leading from it to each
+            node, and pixel difference statistics.
+        """
+        first_chain = self.ancestors(first)
+        second_chain = self.ancestors(second)
+        second_digests = {node.digest for node in second_chain}
+        common = next((node for node in first_chain if node.digest in second_digests), None)
+
+        def steps_from_common(chain: List[LineageNode]) -> List[Dict[str, Any]]:
+            steps = []
+            for node in chain:
+                if common is not None and node.digest == common.digest:
+                    break
+                steps.append(node.to_dict())
+            return list(reversed(steps))
+
+        return {
+            "common_ancestor": common.to_dict() if common else None,
+            "first_operations": steps_from_common(first_chain),
+            "second_operations": steps_from_common(second_chain),
+            "pixels": _pixel_diff(self.load_bytes(first), self.load_bytes(second)),
+        }
+
+
+def _pixel_diff(first: bytes, second: bytes, threshold: int = 16) -> Dict[str, Any]:
+    first_image = Image.open(io.BytesIO(first)).convert("RGB")
+    second_image = Image.open(io.BytesIO(second)).convert("RGB")
+    resized = second_image.size != first_image.size
+    if resized:
+        second_image = second_image.resize(first_image.size)
+
+    difference = ImageChops.difference(first_image, second_image)
+    changed = difference.convert("L").point(lambda value: 255 if value > threshold else 0)
+    histogram = changed.histogram()
+    total = first_image.size[0] * first_image.size[1]
+
+    return {
+        "mean_abs_difference": round(sum(ImageStat.Stat(difference).mean) / 3, 2),
+        "changed_pixel_ratio": round(histogram[255] / total, 4) if total else 0.0,
+        "size_changed": resized,
+    }
+
+
+lineage_store = LineageStore()
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Optional, Tuple, TypeVar
+
+from MarketingAgent.config import config
+
+T = TypeVar("T")
+
+# The genai SDK holds about this many copies of every image it sends or
+# receives: a base64 string, the JSON body and its encoded bytes.
+WIRE_COPIES = 4
+# Expected size of one generated PNG, before the response says otherwise.
+GENERATED_IMAGE_BYTES = 2 * 1024 * 1024
+
+
+def edit_footprint(image_bytes: bytes, mask_bytes: Optional[bytes] = None) -> int:
+    """Memory an Imagen edit holds while in flight.
+
+    The request carries the source and mask, and the response an image
+    about the size of the source.
+    """
+    return WIRE_COPIES * (2 * len(image_bytes) + len(mask_bytes or b""))
+
+
+def generation_footprint(number_of_images: int) -> int:
+    """Memory an Imagen generation of `number_of_images` holds while in flight."""
+    return WIRE_COPIES * number_of_images * GENERATED_IMAGE_BYTES
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class ImageMemoryBudget:
+    """Caps the image memory of the Imagen calls in flight in this process.
+
+    Calls reserve their estimated footprint before sending and wait, first
+    come first served, while the reservations would exceed the limit. The
+    budget is shared by the request handlers' event loop and the background
+    job threads, each running their own.
+
+    Args:
+        limit_bytes: The cap; 0 disables it. A call needing more than the cap
+            runs once nothing else is in flight.
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.in_flight = 0
+        self.peak = 0
+        self.waits = 0
+        self._lock = threading.Lock()
+        self._waiters: Deque[Tuple[int, asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.in_flight + nbytes <= self.limit_bytes
+
+    def _grant(self, nbytes: int) -> None:
+        self.in_flight += nbytes
+        self.peak = max(self.peak, self.in_flight)
+
+    async def acquire(self, nbytes: int) -> int:
+        """Wait until `nbytes` can be reserved, then reserve them.
+
+        Returns:
+            The bytes reserved, to hand back to `release`.
+        """
+        if not self.limit_bytes:
+            return 0
+        nbytes = min(nbytes, self.limit_bytes)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters and self._fits(nbytes):
+                self._grant(nbytes)
+                return nbytes
+            waiter = (nbytes, loop, loop.create_future())
+            self._waiters.append(waiter)
+            self.waits += 1
+
+        try:
+            await waiter[2]
+        except BaseException:
+            with self._lock:
+                granted = waiter not in self._waiters
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:
+                self.release(nbytes)
+            else:
+                # The head of the queue may have been holding others back.
+                self.release(0)
+            raise
+        return nbytes
+
+    def release(self, nbytes: int) -> None:
+        """Hand back a reservation and admit the waiters that now fit."""
+        with self._lock:
+            self.in_flight -= nbytes
+            while self._waiters and self._fits(self._waiters[0][0]):
+                size, loop, future = self._waiters.popleft()
+                self._grant(size)
+                loop.call_soon_threadsafe(_wake, future)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limit_bytes": self.limit_bytes,
+                "in_flight_bytes": self.in_flight,
+                "peak_bytes": self.peak,
+                "waiting": len(self._waiters),
+                "waits": self.waits,
+            }
+
+
+image_memory = ImageMemoryBudget(config.IMAGE_MEMORY_LIMIT_MB * 1024 * 1024)
+
+
+async def with_image_memory(nbytes: int, awaitable: Awaitable[T]) -> T:
+    """Await an Imagen call once `nbytes` of image memory is reserved for it.
+
+    Args:
+        nbytes: The call's estimated footprint.
+        awaitable: The call.
+
+    Returns:
+        Its result.
+    """
+    try:
+        reserved = await image_memory.acquire(nbytes)
+    except BaseException:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+    try:
+        return await awaitable
+    finally:
+        image_memory.release(reserved)
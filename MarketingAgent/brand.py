@@ -0,0 +1,211 @@
+import copy
+import hashlib
+import json
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from google.adk.agents.readonly_context import ReadonlyContext
+
+from MarketingAgent.config import Config
+from MarketingAgent.config import config
+from MarketingAgent.config import reload_config
+from MarketingAgent.ledger import UNSCOPED
+from MarketingAgent.ledger import current_scope
+from MarketingAgent.ledger import tenant_for_user
+
+T = TypeVar("T")
+
+# Overrides for every tenant; `<tenant_id>.json` next to it overrides one tenant.
+DEFAULT_BRAND_FILE = "default.json"
+
+_TENANT_FILE_PATTERN = re.compile(r"^[\w.-]+$")
+
+
+def _merge(base: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """Deep-merge `overrides` into a copy of `base`; lists and scalars are replaced."""
+    merged = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def config_hash(sections: Dict[str, Any]) -> str:
+    """A short, stable hash of a brand configuration."""
+    encoded = json.dumps(sections, sort_keys=True, ensure_ascii=False).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+class Brand:
+    """One tenant's brand configuration and everything rendered from it.
+
+    A Brand never changes. When the configuration of a tenant changes, the
+    registry swaps in a new Brand, so instructions, guidelines and palettes
+    memoized on the old one are dropped with it.
+
+    Args:
+        tenant_id: The tenant the configuration applies to.
+        sections: Configuration sections by name, e.g. "client" and "visual".
+    """
+
+    def __init__(self, tenant_id: str, sections: Dict[str, Dict[str, Any]]):
+        self.tenant_id = tenant_id
+        self.sections = sections
+        self.config_hash = config_hash(sections)
+        self._memo: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def section(self, name: str) -> Dict[str, Any]:
+        return self.sections.get(name, {})
+
+    def memo(self, key: str, factory: Callable[[], T]) -> T:
+        """Build a value from this configuration once, e.g. a rendered instruction."""
+        with self._lock:
+            if key not in self._memo:
+                self._memo[key] = factory()
+            return self._memo[key]
+
+
+class BrandRegistry:
+    """Serves each tenant's brand configuration and reloads it when files change.
+
+    The defaults are the configuration dicts in the code, registered per
+    section by the modules that own them. `default.json` in `directory`
+    overrides them for every tenant and `<tenant_id>.json` for one tenant,
+    both shaped like `{"client": {...}, "visual": {...}}`.
+
+    At most every `reload_interval` seconds, a lookup checks `.env` and the
+    brand files for changes. A changed `.env` is read into `config`; changed
+    brand files replace the Brand of only the tenants whose configuration
+    hash changed, so caches keyed to other tenants' hashes stay valid.
+
+    Args:
+        directory: The directory holding the brand override files.
+        reload_interval: Seconds between change checks, 0 disables reloading.
+    """
+
+    def __init__(
+        self,
+        directory: str = config.BRAND_CONFIG_DIR,
+        reload_interval: float = config.CONFIG_RELOAD_INTERVAL,
+    ):
+        self.directory = Path(directory)
+        self.env_path = Path(Config.__wrapped__.model_config["env_file"])
+        self.reload_interval = reload_interval
+        self._defaults: Dict[str, Dict[str, Any]] = {}
+        self._brands: Dict[str, Brand] = {}
+        self._lock = threading.Lock()
+        self._signature = self._file_signature()
+        self._checked_at = time.monotonic()
+
+    def register(self, section: str, defaults: Dict[str, Any]) -> None:
+        """Register the in-code defaults of a configuration section."""
+        with self._lock:
+            self._defaults[section] = defaults
+            self._brands.clear()
+
+    def _file_signature(self) -> Tuple[Tuple[str, int, int], ...]:
+        paths = [self.env_path]
+        if self.directory.is_dir():
+            paths.extend(sorted(self.directory.glob("*.json")))
+        signature = []
+        for path in paths:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            signature.append((str(path), stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _read_overrides(self, filename: str) -> Dict[str, Any]:
+        path = self.directory / filename
+        try:
+            overrides = json.loads(path.read_text())
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f"Ignoring invalid brand configuration {path}: {e}")
+            return {}
+        return overrides if isinstance(overrides, dict) else {}
+
+    def _load(self, tenant_id: str) -> Brand:
+        sections = _merge(self._defaults, self._read_overrides(DEFAULT_BRAND_FILE))
+        if _TENANT_FILE_PATTERN.match(tenant_id) and tenant_id != Path(DEFAULT_BRAND_FILE).stem:
+            sections = _merge(sections, self._read_overrides(f"{tenant_id}.json"))
+        return Brand(tenant_id, sections)
+
+    def get(self, tenant_id: Optional[str] = None) -> Brand:
+        """The current Brand of a tenant, or of unscoped calls."""
+        tenant_id = tenant_id or UNSCOPED
+        self.refresh()
+        brand = self._brands.get(tenant_id)
+        if brand is None:
+            brand = self._load(tenant_id)
+            with self._lock:
+                brand = self._brands.setdefault(tenant_id, brand)
+        return brand
+
+    def refresh(self, force: bool = False) -> List[str]:
+        """Reload `.env` and the brand files if they changed since the last check.
+
+        Args:
+            force: Check now, regardless of `reload_interval`.
+
+        Returns:
+            The tenants whose brand configuration changed.
+        """
+        if not force:
+            if not self.reload_interval:
+                return []
+            if time.monotonic() - self._checked_at < self.reload_interval:
+                return []
+        with self._lock:
+            self._checked_at = time.monotonic()
+            signature = self._file_signature()
+            if signature == self._signature:
+                return []
+            changed_files = {entry[0] for entry in set(signature) ^ set(self._signature)}
+            env_changed = str(self.env_path) in changed_files
+            self._signature = signature
+
+            if env_changed:
+                try:
+                    changed_settings = reload_config()
+                except Exception as e:
+                    print(f"Error reloading {self.env_path}: {e}")
+                else:
+                    if changed_settings:
+                        print(f"Reloaded settings: {', '.join(changed_settings)}")
+
+            changed = []
+            for tenant_id, brand in list(self._brands.items()):
+                reloaded = self._load(tenant_id)
+                if reloaded.config_hash != brand.config_hash:
+                    self._brands[tenant_id] = reloaded
+                    changed.append(tenant_id)
+        if changed:
+            print(f"Reloaded brand configuration for tenants: {', '.join(changed)}")
+        return changed
+
+
+brand_registry = BrandRegistry()
+
+
+def current_brand(context: Optional[ReadonlyContext] = None) -> Brand:
+    """The Brand of the tenant the current call is for.
+
+    Inside a turn the tenant comes from the bound usage scope. Before the root
+    agent's first model call binds it, it is read from `context` the same way
+    `bind_usage_scope` does.
+    """
+    scope = current_scope.get()
+    if scope is not None:
+        return brand_registry.get(scope.tenant_id)
+    if context is not None:
+        return brand_registry.get(tenant_for_user(context._invocation_context.user_id))
+    return brand_registry.get()
@@ -0,0 +1,537 @@
+"""Headless bulk campaign runner.
+
+Reads a campaign spec, one row per asset (CSV with a header row, or JSON
+Lines), and writes each row's ad copy and image to the artifact store
+without a chat session. Progress is checkpointed per row and step, so
+running the same spec again picks up where a crash or exhausted quota
+stopped it. Run it with::
+
+    python -m MarketingAgent.campaign spring.csv --tenant acme --concurrency 4
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+from dataclasses import asdict, dataclass, field, fields
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.genai import types
+
+from MarketingAgent.agent import render_global_instruction
+from MarketingAgent.agent import render_root_agent_instruction
+from MarketingAgent.artifacts import LocalArtifactService
+from MarketingAgent.assistants.gallery import CHANNEL_STATE_KEY
+from MarketingAgent.assistants.generation.tools import IMAGES_PER_GENERATION
+from MarketingAgent.assistants.generation.tools import generate_image
+from MarketingAgent.assistants.generation.tools import reuse_image
+from MarketingAgent.brand import Brand
+from MarketingAgent.brand import current_brand
+from MarketingAgent.circuits import CircuitState
+from MarketingAgent.circuits import ModelUnavailableError
+from MarketingAgent.circuits import circuit_breaker
+from MarketingAgent.config import GeminiModelOptions
+from MarketingAgent.config import config
+from MarketingAgent.config import genai_client
+from MarketingAgent.deadlines import Deadline
+from MarketingAgent.deadlines import current_deadline
+from MarketingAgent.deadlines import with_deadline
+from MarketingAgent.jobs import DetachedToolContext
+from MarketingAgent.jobs import JobStatus
+from MarketingAgent.ledger import UNSCOPED
+from MarketingAgent.ledger import BudgetExceededError
+from MarketingAgent.ledger import UsageScope
+from MarketingAgent.ledger import current_scope
+from MarketingAgent.ledger import ledger
+
+APP_NAME = "MarketingAgent"
+
+# Steps of a row, in the order they run.
+COPY_STEP = "ad_copy"
+IMAGE_STEP = "image"
+
+COPY_MODEL = GeminiModelOptions.GEMINI_2_5_PRO
+# Tokens an ad copy call is expected to use, checked against the budget before it starts.
+COPY_TOKEN_ESTIMATE = 8000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaign_steps (
+    campaign TEXT NOT NULL,
+    row_id TEXT NOT NULL,
+    step TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (campaign, row_id, step)
+);
+"""
+
+BRIEF = """Write new ad copy for the brief below. It is confirmed and complete: do not ask for confirmation or more information, and answer with the ad copy only.
+* Product/Service: {product}
+* Target Audience: {audience}
+* Promotion: {promotion}
+* Format: {format}
+"""
+
+
+class CampaignStopped(Exception):
+    """Raised when a quota or model outage means later rows would fail too."""
+
+
+@dataclass(frozen=True)
+class CampaignRow:
+    """One asset of a campaign spec.
+
+    A row gets ad copy when it has a product and an audience, and an image
+    when it has an image prompt.
+    """
+
+    row_id: str
+    product: str = ""
+    audience: str = ""
+    promotion: str = ""
+    format: str = ""
+    image_prompt: str = ""
+    channel: str = ""
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], line: int) -> "CampaignRow":
+        """Build a row from a CSV or JSON record, ignoring unknown columns.
+
+        Column names are matched case-insensitively, with spaces read as
+        underscores. The row id is the `id` column, or the line number.
+
+        Raises:
+            ValueError: If the row asks for neither ad copy nor an image.
+        """
+        values = {
+            str(key).strip().lower().replace(" ", "_"): str(value).strip()
+            for key, value in record.items()
+            if key is not None and value is not None
+        }
+        names = {f.name for f in fields(cls)} - {"row_id"}
+        row = cls(
+            row_id=values.get("id") or values.get("row_id") or str(line),
+            **{name: values[name] for name in names if name in values},
+        )
+        if not (row.wants_copy or row.image_prompt):
+            raise ValueError(
+                f"Line {line} needs a product and audience, an image_prompt, or both"
+            )
+        return row
+
+    @property
+    def wants_copy(self) -> bool:
+        return bool(self.product and self.audience)
+
+    def steps(self) -> List[Tuple[str, str]]:
+        """The row's steps and a digest of the inputs each one uses."""
+        steps = []
+        if self.wants_copy:
+            steps.append(
+                (COPY_STEP, _digest(self.product, self.audience, self.promotion, self.format))
+            )
+        if self.image_prompt:
+            steps.append((IMAGE_STEP, _digest(self.image_prompt, self.channel)))
+        return steps
+
+
+def _digest(*values: str) -> str:
+    return hashlib.sha256(json.dumps(values).encode("utf-8")).hexdigest()[:16]
+
+
+def load_rows(path: Path) -> List[CampaignRow]:
+    """Read a campaign spec from a `.csv` or `.jsonl` file.
+
+    Raises:
+        ValueError: If a row is invalid or two rows share an id.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if path.suffix.lower() in (".jsonl", ".ndjson"):
+            records = [
+                (line, json.loads(text))
+                for line, text in enumerate(f, start=1)
+                if text.strip()
+            ]
+        else:
+            # Line 1 is the header.
+            records = list(enumerate(csv.DictReader(f), start=2))
+
+    rows = [CampaignRow.from_record(record, line) for line, record in records]
+    seen = set()
+    for row in rows:
+        if row.row_id in seen:
+            raise ValueError(f"Row id {row.row_id!r} appears more than once")
+        seen.add(row.row_id)
+    return rows
+
+
+@dataclass
+class StepOutcome:
+    """What a row's step did in this run."""
+
+    row_id: str
+    step: str
+    status: str
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+
+class CampaignStore:
+    """SQLite checkpoint of every campaign row's steps.
+
+    A step is skipped on later runs once it has succeeded with the same
+    inputs; steps that failed, were interrupted or whose row was edited
+    since run again.
+
+    Args:
+        db_path: The checkpoint database.
+    """
+
+    def __init__(self, db_path: str = config.CAMPAIGN_DB_PATH):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if not self._initialized:
+                self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                with closing(sqlite3.connect(self.db_path, timeout=30)) as connection:
+                    connection.execute("PRAGMA journal_mode=WAL")
+                    connection.executescript(_SCHEMA)
+                self._initialized = True
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def completed(self, campaign: str) -> Dict[Tuple[str, str], str]:
+        """The input digests of the campaign's succeeded steps, by row id and step."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT row_id, step, digest FROM campaign_steps WHERE campaign = ? AND status = ?",
+                (campaign, JobStatus.SUCCEEDED.value),
+            ).fetchall()
+        return {(row["row_id"], row["step"]): row["digest"] for row in rows}
+
+    def start(self, campaign: str, row_id: str, step: str, digest: str) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "INSERT INTO campaign_steps (campaign, row_id, step, digest, status, attempts, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, 1, ?)"
+                " ON CONFLICT (campaign, row_id, step) DO UPDATE SET digest = excluded.digest,"
+                " status = excluded.status, error = NULL, attempts = attempts + 1,"
+                " updated_at = excluded.updated_at",
+                (campaign, row_id, step, digest, JobStatus.RUNNING.value, time.time()),
+            )
+
+    def finish(
+        self,
+        campaign: str,
+        row_id: str,
+        step: str,
+        status: JobStatus,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE campaign_steps SET status = ?, result = ?, error = ?, updated_at = ?"
+                " WHERE campaign = ? AND row_id = ? AND step = ?",
+                (
+                    status.value,
+                    json.dumps(result, default=str) if result is not None else None,
+                    error,
+                    time.time(),
+                    campaign,
+                    row_id,
+                    step,
+                ),
+            )
+
+
+def _check_available(model: str, tokens: int = 0, images: int = 0) -> None:
+    """Stop the campaign before a call that the budget or an open circuit would refuse.
+
+    Raises:
+        CampaignStopped: If the budget is exhausted or the model's circuit is open.
+    """
+    try:
+        ledger.check_budget(tokens=tokens, images=images)
+    except BudgetExceededError as e:
+        raise CampaignStopped(str(e)) from e
+    if circuit_breaker(model).state == CircuitState.OPEN:
+        raise CampaignStopped(f"{model} is unavailable right now; calls are paused.")
+
+
+def _copy_instruction(brand: Brand) -> str:
+    """The root agent's system instruction, as a chat turn would send it."""
+    client = brand.section("client")
+    brand_instruction = brand.memo("global_instruction", lambda: render_global_instruction(client))
+    root_instruction = brand.memo(
+        "root_agent_instruction", lambda: render_root_agent_instruction(client)
+    )
+    today = date.today().strftime("%B %d, %Y")
+    return (
+        f"\n<TODAYS_DATE>\nToday's date is {today}.\n</TODAYS_DATE>\n{brand_instruction}"
+        f"\n\n{root_instruction}"
+    )
+
+
+async def write_ad_copy(row: CampaignRow, tool_context: DetachedToolContext) -> Dict[str, Any]:
+    """Write a row's ad copy with the root agent's instructions and save it as an artifact.
+
+    Raises:
+        CampaignStopped: If the budget, the model's quota or its circuit
+            stops further copy.
+    """
+    _check_available(COPY_MODEL, tokens=COPY_TOKEN_ESTIMATE)
+    brief = BRIEF.format(
+        product=row.product,
+        audience=row.audience,
+        promotion=row.promotion or "N/A",
+        format=row.format or "General Use",
+    )
+    try:
+        response = await with_deadline(
+            circuit_breaker(COPY_MODEL).call_async(
+                genai_client.aio.models.generate_content,
+                model=COPY_MODEL,
+                contents=[brief],
+                config=types.GenerateContentConfig(
+                    system_instruction=_copy_instruction(current_brand()),
+                    temperature=0.01,
+                ),
+            ),
+            config.TURN_TIMEOUT_SECONDS,
+        )
+    except ModelUnavailableError as e:
+        # Rate limits (429) arrive here too, as transient unavailability.
+        raise CampaignStopped(str(e)) from e
+    ledger.record_response(COPY_MODEL, response)
+
+    copy = response.text if response else None
+    if not copy:
+        return {"success": False, "error": "The model returned no ad copy"}
+
+    filename = f"ad_copy_{''.join(c if c.isalnum() else '_' for c in row.row_id[:40])}.txt"
+    version = await tool_context.save_artifact(
+        filename=filename,
+        artifact=types.Part.from_bytes(data=copy.encode("utf-8"), mime_type="text/plain"),
+    )
+    return {
+        "artifact_filename": filename,
+        "artifact_version": version,
+        "mime_type": "text/plain",
+        "success": True,
+    }
+
+
+async def make_image(row: CampaignRow, tool_context: DetachedToolContext) -> Dict[str, Any]:
+    """Generate a row's image, reusing an earlier image of a near-identical prompt.
+
+    Raises:
+        CampaignStopped: If the image budget or an open Imagen circuit stops
+            further images.
+    """
+    _check_available(GeminiModelOptions.IMAGEN_3_0_GENERATE, images=IMAGES_PER_GENERATION)
+    tool_context.state[CHANNEL_STATE_KEY] = row.channel
+    result = await generate_image(row.image_prompt, tool_context)
+    if result.get("similar_images"):
+        return await reuse_image(result["similar_images"][0]["node_id"], tool_context)
+    return result
+
+
+_STEPS = {COPY_STEP: write_ad_copy, IMAGE_STEP: make_image}
+
+
+class CampaignRunner:
+    """Runs a campaign's rows with bounded parallelism, checkpointing each step.
+
+    Rows run `concurrency` at a time on one event loop; every model call is
+    async, so waiting on Gemini or Imagen does not hold up other rows. Each
+    row gets the job deadline. Once a step reports an exhausted budget or
+    quota, or a model whose circuit opened, no further rows are started and
+    the rows in flight finish.
+
+    Args:
+        campaign: The campaign name; its artifacts are saved to the session of
+            this name, under the tenant's user id.
+        tenant_id: The tenant whose brand and budgets apply.
+        store: The checkpoint store.
+        artifact_service: Where the ad copy and images are saved.
+        concurrency: Rows worked on at the same time.
+    """
+
+    def __init__(
+        self,
+        campaign: str,
+        tenant_id: str,
+        store: CampaignStore,
+        artifact_service: LocalArtifactService,
+        concurrency: int = config.CAMPAIGN_CONCURRENCY,
+    ):
+        self.campaign = campaign
+        self.tenant_id = tenant_id
+        self.store = store
+        self.artifact_service = artifact_service
+        self.concurrency = max(1, concurrency)
+        self.stopped_reason: Optional[str] = None
+
+    @property
+    def session_id(self) -> str:
+        return f"campaign-{self.campaign}"
+
+    async def run(self, rows: List[CampaignRow]) -> "CampaignReport":
+        """Run every step not yet checkpointed as done with the same inputs."""
+        current_scope.set(
+            UsageScope(
+                app_name=APP_NAME,
+                user_id=self.tenant_id,
+                session_id=self.session_id,
+                tenant_id=self.tenant_id,
+            )
+        )
+        completed = self.store.completed(self.campaign)
+        report = CampaignReport(campaign=self.campaign, rows=len(rows))
+        slots = asyncio.Semaphore(self.concurrency)
+        started = time.perf_counter()
+
+        async def run_row(row: CampaignRow) -> None:
+            pending = [
+                (step, digest)
+                for step, digest in row.steps()
+                if completed.get((row.row_id, step)) != digest
+            ]
+            report.skipped += len(row.steps()) - len(pending)
+            if not pending:
+                return
+            async with slots:
+                for step, digest in pending:
+                    if self.stopped_reason:
+                        report.pending += 1
+                        continue
+                    report.add(await self._run_step(row, step, digest))
+
+        await asyncio.gather(*(run_row(row) for row in rows))
+        report.stopped_reason = self.stopped_reason
+        report.wall_time_s = round(time.perf_counter() - started, 3)
+        return report
+
+    async def _run_step(self, row: CampaignRow, step: str, digest: str) -> StepOutcome:
+        self.store.start(self.campaign, row.row_id, step, digest)
+        tool_context = DetachedToolContext(
+            self.artifact_service, APP_NAME, self.tenant_id, self.session_id
+        )
+        current_deadline.set(
+            Deadline.after(config.JOB_TIMEOUT_SECONDS, owner=f"{self.campaign}/{row.row_id}")
+        )
+        try:
+            result = await _STEPS[step](row, tool_context)
+        except CampaignStopped as e:
+            if not self.stopped_reason:
+                self.stopped_reason = str(e)
+                print(f"Stopping campaign {self.campaign} at row {row.row_id}: {e}")
+            result = {"success": False, "error": str(e)}
+        except Exception as e:
+            print(f"Error in campaign row {row.row_id} ({step}): {e}")
+            result = {"success": False, "error": f"Unexpected error: {e}"}
+
+        if result.get("success") is False:
+            self.store.finish(
+                self.campaign, row.row_id, step, JobStatus.FAILED, result, result.get("error")
+            )
+            return StepOutcome(row.row_id, step, JobStatus.FAILED.value, result, result.get("error"))
+        self.store.finish(self.campaign, row.row_id, step, JobStatus.SUCCEEDED, result)
+        return StepOutcome(row.row_id, step, JobStatus.SUCCEEDED.value, result)
+
+
+@dataclass
+class CampaignReport:
+    """What a run did. Everything but `rows` counts steps (ad copy or image) of rows."""
+
+    campaign: str
+    rows: int
+    succeeded: int = 0
+    failed: int = 0
+    skipped: int = 0
+    pending: int = 0
+    stopped_reason: Optional[str] = None
+    wall_time_s: float = 0.0
+    failures: List[StepOutcome] = field(default_factory=list)
+
+    def add(self, outcome: StepOutcome) -> None:
+        if outcome.status == JobStatus.SUCCEEDED.value:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+            self.failures.append(outcome)
+
+    @property
+    def done(self) -> bool:
+        return not (self.failed or self.pending)
+
+    def summary(self) -> Dict[str, Any]:
+        summary = asdict(self)
+        summary["failures"] = [
+            {"row_id": f.row_id, "step": f.step, "error": f.error} for f in self.failures
+        ]
+        return summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command-line entry point for the campaign runner."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("spec", type=Path, help="Campaign spec, .csv with a header row or .jsonl.")
+    parser.add_argument(
+        "--campaign", help="Campaign name for checkpoints and artifacts (defaults to the file name)."
+    )
+    parser.add_argument(
+        "--tenant", default=UNSCOPED, help="Tenant whose brand configuration and budgets apply."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=config.CAMPAIGN_CONCURRENCY,
+        help="Rows worked on at the same time (default: CAMPAIGN_CONCURRENCY).",
+    )
+    parser.add_argument("--json", dest="json_path", help="Write the summary to this file.")
+    args = parser.parse_args(argv)
+
+    try:
+        rows = load_rows(args.spec)
+    except (OSError, ValueError) as e:
+        parser.error(f"Cannot read {args.spec}: {e}")
+
+    runner = CampaignRunner(
+        campaign=args.campaign or args.spec.stem,
+        tenant_id=args.tenant,
+        store=CampaignStore(),
+        artifact_service=LocalArtifactService(),
+        concurrency=args.concurrency,
+    )
+    report = asyncio.run(runner.run(rows))
+
+    summary = report.summary()
+    print(json.dumps(summary, indent=2))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(summary, f, indent=2)
+    if not report.done:
+        print("Run the same command again to resume the unfinished rows.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
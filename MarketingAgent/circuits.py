@@ -0,0 +1,304 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from enum import StrEnum
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from google.genai import errors
+
+from MarketingAgent.config import config
+
+T = TypeVar("T")
+
+# API errors meaning the project cannot use the model, as opposed to a bad request.
+UNAVAILABLE_STATUSES = {"PERMISSION_DENIED", "NOT_FOUND"}
+UNAVAILABLE_CODES = {403, 404}
+# API errors meaning the model is overloaded or the project is over its rate
+# limit for now. They pause calls only briefly, and the call can be retried.
+TRANSIENT_STATUSES = {"UNAVAILABLE", "RESOURCE_EXHAUSTED"}
+TRANSIENT_CODES = {429, 503}
+# How long a capability probe result is reused across restarts and workers.
+PROBE_MAX_AGE_SECONDS = 24 * 3600
+
+
+class CircuitState(StrEnum):
+    """States of a model's circuit breaker."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class ModelUnavailableError(Exception):
+    """Raised when a model is unavailable to this project, or its circuit is open.
+
+    Args:
+        model: The model that was called.
+        reason: The error the model last failed with.
+        retry_after: Seconds until the circuit half-opens, if it is open.
+        transient: Whether the model is only overloaded or rate limited, so
+            the call can be retried shortly.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        reason: str,
+        retry_after: Optional[float] = None,
+        transient: bool = False,
+    ):
+        self.model = model
+        self.reason = reason
+        self.retry_after = retry_after
+        self.transient = transient
+        if transient:
+            message = f"{model} is temporarily overloaded or rate limited ({reason})."
+        else:
+            message = f"{model} is unavailable to this project ({reason})."
+        if retry_after is not None:
+            message += f" Calls are paused for the next {retry_after:.0f}s."
+        if transient:
+            message += " Tell the user and offer to try again in a minute."
+        else:
+            message += " Do not retry; tell the user this capability is unavailable right now."
+        super().__init__(message)
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Whether `error` says the model is overloaded or rate limited for now."""
+    if not isinstance(error, errors.APIError):
+        return False
+    return error.code in TRANSIENT_CODES or error.status in TRANSIENT_STATUSES
+
+
+def is_unavailable_error(error: BaseException) -> bool:
+    """Whether `error` says the model cannot be used, for now or at all, not that a request was bad."""
+    if not isinstance(error, errors.APIError):
+        return False
+    if is_transient_error(error):
+        return True
+    return error.code in UNAVAILABLE_CODES or error.status in UNAVAILABLE_STATUSES
+
+
+class CircuitBreaker:
+    """Fails calls to a model fast once it keeps reporting that it is unavailable.
+
+    After `failure_threshold` permission, availability, overload or rate
+    limit errors in a row the circuit opens and calls raise
+    ModelUnavailableError without a round trip. It stays open for
+    `reset_seconds`, or `transient_reset_seconds` when the last error was an
+    overload (503) or rate limit (429), then half-opens and lets one trial
+    call through: if the model answers, even with an error about the
+    request, the circuit closes, otherwise it opens again.
+
+    Args:
+        model: The model guarded by the breaker.
+        failure_threshold: Consecutive unavailability errors that open the circuit.
+        reset_seconds: Seconds the circuit stays open before a trial call.
+        transient_reset_seconds: The same after overload or rate limit errors.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        failure_threshold: int = config.CIRCUIT_FAILURE_THRESHOLD,
+        reset_seconds: float = config.CIRCUIT_RESET_SECONDS,
+        transient_reset_seconds: float = config.CIRCUIT_TRANSIENT_RESET_SECONDS,
+    ):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.transient_reset_seconds = transient_reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._last_error = ""
+        self._last_transient = False
+
+    def _open_seconds(self) -> float:
+        return self.transient_reset_seconds if self._last_transient else self.reset_seconds
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> CircuitState:
+        if self._opened_at is None:
+            return CircuitState.CLOSED
+        if time.monotonic() - self._opened_at >= self._open_seconds():
+            return CircuitState.HALF_OPEN
+        return CircuitState.OPEN
+
+    def _before_call(self) -> None:
+        with self._lock:
+            state = self._state()
+            if state == CircuitState.CLOSED:
+                return
+            if state == CircuitState.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            retry_after = max(self._opened_at + self._open_seconds() - time.monotonic(), 0.0)
+            raise ModelUnavailableError(
+                self.model,
+                self._last_error,
+                retry_after=retry_after,
+                transient=self._last_transient,
+            )
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self, error: BaseException) -> None:
+        with self._lock:
+            self._failures += 1
+            self._last_error = str(error)
+            self._last_transient = is_transient_error(error)
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"Opening circuit for {self.model} after: {error}")
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def release_trial(self) -> None:
+        """Let another trial through after one that ended without an answer."""
+        with self._lock:
+            self._trial_running = False
+
+    def trip(self, reason: str) -> None:
+        """Open the circuit now, e.g. after a failed capability probe."""
+        with self._lock:
+            self._failures = max(self._failures, self.failure_threshold)
+            self._last_error = reason
+            self._last_transient = False
+            self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def call(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Call `function` through the breaker.
+
+        Raises:
+            ModelUnavailableError: If the circuit is open, or the call failed
+                because the model is unavailable.
+        """
+        self._before_call()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            if not is_unavailable_error(e):
+                # The model answered, so it is available.
+                self.record_success()
+                raise
+            self.record_failure(e)
+            raise ModelUnavailableError(self.model, str(e), transient=is_transient_error(e)) from e
+        self.record_success()
+        return result
+
+    async def call_async(self, function: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """Await `function` through the breaker, like `call`.
+
+        A call cancelled or timed out before the model answered says nothing
+        about its availability, so it is not counted either way.
+        """
+        self._before_call()
+        try:
+            result = await function(*args, **kwargs)
+        except (asyncio.CancelledError, TimeoutError):
+            self.release_trial()
+            raise
+        except Exception as e:
+            if not is_unavailable_error(e):
+                self.record_success()
+                raise
+            self.record_failure(e)
+            raise ModelUnavailableError(self.model, str(e), transient=is_transient_error(e)) from e
+        self.record_success()
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "model": self.model,
+                "state": self._state().value,
+                "consecutive_failures": self._failures,
+                "last_error": self._last_error or None,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(model: str) -> CircuitBreaker:
+    """The process-wide circuit breaker of `model`."""
+    model = str(model)
+    with _breakers_lock:
+        if model not in _breakers:
+            _breakers[model] = CircuitBreaker(str(model))
+        return _breakers[model]
+
+
+def circuit_summary() -> Dict[str, Dict[str, Any]]:
+    """The state of every model's circuit breaker."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.model: breaker.to_dict() for breaker in breakers}
+
+
+def probe_model(model: str, probe: Callable[[], Any], cache_dir: str = ".cache") -> Optional[str]:
+    """Check once whether this project can use `model`.
+
+    The result is kept in `capabilities.json` for PROBE_MAX_AGE_SECONDS so
+    restarts and other worker processes do not pay for the probe again. An
+    unavailable model has its circuit opened.
+
+    Args:
+        model: The model to probe.
+        probe: Makes the smallest possible call to the model.
+        cache_dir: The directory to keep probe results in.
+
+    Returns:
+        None if the model is available, otherwise the reason it is not.
+    """
+    path = Path(cache_dir) / "capabilities.json"
+    key = f"{config.GOOGLE_CLOUD_PROJECT}:{model}"
+    try:
+        results = json.loads(path.read_text())
+    except (FileNotFoundError, ValueError):
+        results = {}
+
+    result = results.get(key)
+    if result is None or time.time() - result["checked_at"] > PROBE_MAX_AGE_SECONDS:
+        try:
+            circuit_breaker(model).call(probe)
+            reason = None
+        except ModelUnavailableError as e:
+            if e.transient:
+                # An overloaded model says nothing about whether the project can use it.
+                print(f"Capability probe of {model} was inconclusive: {e.reason}")
+                return None
+            reason = e.reason
+        except Exception as e:
+            # Anything else is not conclusive; assume the model is available.
+            print(f"Capability probe of {model} failed: {e}")
+            return None
+
+        result = {"reason": reason, "checked_at": time.time()}
+        results[key] = result
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(results, f, indent=2)
+        os.replace(temp_path, path)
+
+    if result["reason"] is not None:
+        circuit_breaker(model).trip(result["reason"])
+    return result["reason"]
@@ -1,6 +1,9 @@
+import asyncio
+import threading
 from enum import StrEnum
 from functools import lru_cache
 from pathlib import Path
+from typing import Any, Callable, Dict, List
 
 from jinja2 import Environment, FileSystemLoader
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -23,6 +26,97 @@ class Config(BaseSettings):
     HOST_URL: str = "0.0.0.0"
     DEVELOPMENT: bool = False
 
+    # JSON file mapping user ids to tenant ids, kept on the server; unset or unlisted users are their own tenant
+    TENANTS_FILE: str | None = None
+    # Tenant owning .cache images from before the lineage store; unset lets the first tenant to edit one claim it
+    LEGACY_IMAGE_TENANT: str | None = None
+
+    # Usage budgets, unset means unlimited
+    SESSION_TOKEN_BUDGET: int | None = None
+    SESSION_IMAGE_BUDGET: int | None = None
+    TENANT_TOKEN_BUDGET: int | None = None
+    TENANT_IMAGE_BUDGET: int | None = None
+    BUDGET_SOFT_LIMIT_RATIO: float = 0.8
+    # Usage database shared by server workers, so budgets survive restarts
+    USAGE_DB_PATH: str = ".cache/usage.db"
+
+    # Local artifact store, unset retention limits keep everything, and minutes between retention runs of the server
+    ARTIFACT_STORE_DIR: str = ".artifacts"
+    ARTIFACT_MAX_VERSIONS: int | None = None
+    ARTIFACT_MAX_AGE_DAYS: float | None = None
+    ARTIFACT_RETENTION_INTERVAL_MINUTES: float = 60.0
+
+    # Minimum word-overlap similarity for offering an existing image instead of generating
+    PROMPT_REUSE_THRESHOLD: float = 0.75
+
+    # Background image jobs running at the same time, and seconds between heartbeats of running jobs
+    JOB_WORKERS: int = 4
+    JOB_HEARTBEAT_SECONDS: float = 10.0
+
+    # Imagen edits of one source running at the same time in edit_image_variants
+    EDIT_VARIANT_CONCURRENCY: int = 4
+
+    # Recent turns sent verbatim to root_agent; older turns are summarized
+    HISTORY_KEEP_TURNS: int = 6
+
+    # Local session store; queued session writes are flushed at least this often in seconds
+    SESSION_DB_PATH: str = ".cache/sessions.db"
+    SESSION_FLUSH_INTERVAL: float = 0.2
+    SESSION_CACHE_SIZE: int = 256
+    SESSION_EVENT_PAGE_SIZE: int = 100
+
+    # Permission/availability errors in a row that pause calls to a model, and for how long in seconds
+    CIRCUIT_FAILURE_THRESHOLD: int = 3
+    CIRCUIT_RESET_SECONDS: float = 300.0
+    # Seconds calls to a model stay paused after overload (503) or rate limit (429) errors
+    CIRCUIT_TRANSIENT_RESET_SECONDS: float = 30.0
+
+    # Brand palette score (0-1) below which a generated image is regenerated, unset never regenerates
+    PALETTE_MIN_SCORE: float | None = None
+    PALETTE_MAX_REGENERATIONS: int = 1
+
+    # Probe the Imagen edit model at startup (one billed edit) and hide its tools if unavailable
+    PROBE_MODEL_CAPABILITIES: bool = False
+
+    # Production server worker processes (unset runs one), and seconds to drain in-flight work on shutdown
+    SERVER_WORKERS: int | None = None
+    SHUTDOWN_GRACE_SECONDS: float = 60.0
+
+    # Cap in MB on the image memory of Imagen calls in flight per process, 0 disables it
+    IMAGE_MEMORY_LIMIT_MB: int = 512
+
+    # Stream root agent text to /run_sse clients as it is generated, unless a request sets "streaming"
+    STREAM_RESPONSES: bool = True
+
+    # Deadlines in seconds for a root agent turn and a background job, and per model call stage
+    TURN_TIMEOUT_SECONDS: float = 300.0
+    JOB_TIMEOUT_SECONDS: float = 900.0
+    TEXT_MODEL_TIMEOUT_SECONDS: float = 30.0
+    IMAGE_GENERATION_TIMEOUT_SECONDS: float = 120.0
+    IMAGE_EDIT_TIMEOUT_SECONDS: float = 120.0
+
+    # SVG icons and widgets: largest accepted markup in KB, PNG preview width in pixels (0 skips previews), preview rendering threads, and seconds a preview may take
+    SVG_MAX_KB: int = 256
+    SVG_PREVIEW_SIZE: int = 512
+    SVG_RASTER_WORKERS: int = 2
+    SVG_RENDER_TIMEOUT_SECONDS: float = 10.0
+
+    # Run the function calls of one model response concurrently instead of one after another
+    PARALLEL_TOOL_CALLS: bool = True
+
+    # Opt-in cache of new ad copy per tenant and confirmed brief, hours an entry is served, and its database
+    AD_COPY_CACHE: bool = False
+    AD_COPY_CACHE_TTL_HOURS: float = 24.0
+    AD_COPY_CACHE_DB_PATH: str = ".cache/ad_copy.db"
+
+    # Campaign spreadsheet rows the bulk runner works on at the same time, and its checkpoint database
+    CAMPAIGN_CONCURRENCY: int = 4
+    CAMPAIGN_DB_PATH: str = ".cache/campaigns.db"
+
+    # Brand overrides (default.json, <tenant_id>.json), and seconds between checks of them and .env for changes
+    BRAND_CONFIG_DIR: str = "brands"
+    CONFIG_RELOAD_INTERVAL: float = 5.0
+
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
     @model_validator(mode="after")
@@ -42,24 +136,80 @@ class Config(BaseSettings):
 config = Config()
 
 
-@lru_cache()
-def get_genai_client() -> genai.Client:
-    """Get a configured GenAI client instance.
+def reload_config() -> List[str]:
+    """Re-read `.env` and the environment into the shared `config` instance.
+
+    Settings read when they are used take effect right away. Settings used
+    once at startup, such as worker counts or the GenAI client, still need a
+    restart.
 
     Returns:
-        genai.Client: A configured client instance.
+        The names of the settings that changed.
+    """
+    fresh = Config.__wrapped__()
+    changed = [
+        name for name in type(fresh).model_fields if getattr(fresh, name) != getattr(config, name)
+    ]
+    for name in changed:
+        setattr(config, name, getattr(fresh, name))
+    return changed
+
+
+class LoopLocalClient:
+    """GenAI client whose async API is a separate client per event loop.
+
+    The httpx client behind `genai.Client.aio` binds its connections to the
+    first event loop that uses it, and fails on any other loop. The server
+    loop, the background job loop and the loops of command-line runners each
+    get a client of their own; clients of closed loops are dropped.
+
+    Args:
+        factory: Builds a new client.
     """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._client = factory()
+        self._lock = threading.Lock()
+        self._loop_clients: Dict[asyncio.AbstractEventLoop, Any] = {}
+
+    @property
+    def aio(self) -> Any:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self._client.aio
+        with self._lock:
+            client = self._loop_clients.get(loop)
+            if client is None:
+                for closed in [other for other in self._loop_clients if other.is_closed()]:
+                    del self._loop_clients[closed]
+                client = self._loop_clients[loop] = self._factory()
+        return client.aio
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+def _new_genai_client() -> genai.Client:
     if config.GOOGLE_GENAI_USE_VERTEXAI:
-        client = genai.Client(
+        return genai.Client(
             project=config.GOOGLE_CLOUD_PROJECT,
             location=config.GOOGLE_CLOUD_LOCATION,
         )
 
     # If not using Vertex AI, use the API key for authentication
-    else:
-        client = genai.Client(api_key=config.GEMINI_API_KEY)
+    return genai.Client(api_key=config.GEMINI_API_KEY)
 
-    return client
+
+@lru_cache()
+def get_genai_client() -> LoopLocalClient:
+    """Get a configured GenAI client instance.
+
+    Returns:
+        LoopLocalClient: A configured client, safe to use from any event loop.
+    """
+    return LoopLocalClient(_new_genai_client)
 
 
 genai_client = get_genai_client()
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+from MarketingAgent.brand import current_brand
+from MarketingAgent.config import config
+from MarketingAgent.ledger import UNSCOPED
+from MarketingAgent.ledger import current_scope
+
+# The confirmed brief of the ad copy the root agent is about to write.
+BRIEF_STATE_KEY = "ad_copy_brief"
+# The tool the root agent records the brief with.
+BRIEF_TOOL_NAME = "start_ad_copy"
+
+# Ways of saying there is no promotion, all meaning the same brief.
+_NO_PROMOTION = frozenset({"", "n/a", "na", "none", "no", "no promotion"})
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ad_copy (
+    tenant_id TEXT NOT NULL,
+    cache_key TEXT NOT NULL,
+    brief TEXT NOT NULL,
+    copy TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (tenant_id, cache_key)
+);
+"""
+
+
+def _normalize(value: str) -> str:
+    return _WHITESPACE_PATTERN.sub(" ", str(value or "")).strip().strip(".!").strip().lower()
+
+
+@dataclass(frozen=True)
+class AdCopyBrief:
+    """What new ad copy is for, as confirmed by the user.
+
+    Attributes:
+        product: The product or service.
+        audience: The target audience.
+        promotion: The promotion details, empty without one.
+        ad_format: The format, e.g. "banner", "social" or "email".
+    """
+
+    product: str
+    audience: str
+    promotion: str = ""
+    ad_format: str = ""
+
+    def normalized(self) -> "AdCopyBrief":
+        """The brief with case, spacing and "no promotion" spellings made uniform."""
+        promotion = _normalize(self.promotion)
+        return AdCopyBrief(
+            product=_normalize(self.product),
+            audience=_normalize(self.audience),
+            promotion="" if promotion in _NO_PROMOTION else promotion,
+            ad_format=_normalize(self.ad_format) or "general",
+        )
+
+
+def cache_key(brief: AdCopyBrief, instructions: str, model: str, temperature: Optional[float]) -> str:
+    """The cache key of copy written for `brief` with these instructions and model.
+
+    Changing the instructions, the brand configuration they render, the model
+    or its temperature changes the key, so stale copy is never served.
+    """
+    encoded = json.dumps(
+        {
+            "brief": asdict(brief.normalized()),
+            "instructions": hashlib.sha256(instructions.encode("utf-8")).hexdigest(),
+            "model": model,
+            "temperature": temperature,
+        },
+        sort_keys=True,
+    ).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class AdCopyCache:
+    """SQLite store of ad copy per tenant and cache key.
+
+    Entries are served for AD_COPY_CACHE_TTL_HOURS after they were written;
+    expired entries of a tenant are dropped when it writes a new one.
+
+    Args:
+        db_path: The cache database.
+    """
+
+    def __init__(self, db_path: str = config.AD_COPY_CACHE_DB_PATH):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if not self._initialized:
+                self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                with closing(sqlite3.connect(self.db_path, timeout=30)) as connection:
+                    connection.execute("PRAGMA journal_mode=WAL")
+                    connection.executescript(_SCHEMA)
+                self._initialized = True
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    @staticmethod
+    def _oldest_fresh() -> float:
+        return time.time() - config.AD_COPY_CACHE_TTL_HOURS * 3600
+
+    def get(self, tenant_id: str, key: str) -> Optional[str]:
+        """The tenant's unexpired copy for `key`, if any."""
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT copy FROM ad_copy WHERE tenant_id = ? AND cache_key = ? AND created_at >= ?",
+                (tenant_id, key, self._oldest_fresh()),
+            ).fetchone()
+        return row["copy"] if row else None
+
+    def put(self, tenant_id: str, key: str, brief: AdCopyBrief, copy: str) -> None:
+        """Store copy for `key`, replacing what the tenant had for it."""
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO ad_copy (tenant_id, cache_key, brief, copy, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (tenant_id, key, json.dumps(asdict(brief)), copy, time.time()),
+            )
+            connection.execute(
+                "DELETE FROM ad_copy WHERE tenant_id = ? AND created_at < ?",
+                (tenant_id, self._oldest_fresh()),
+            )
+
+    def clear(self, tenant_id: Optional[str] = None) -> int:
+        """Drop the cached copy of one tenant, or of all tenants.
+
+        Returns:
+            The number of entries dropped.
+        """
+        with closing(self._connect()) as connection:
+            if tenant_id is None:
+                cursor = connection.execute("DELETE FROM ad_copy")
+            else:
+                cursor = connection.execute("DELETE FROM ad_copy WHERE tenant_id = ?", (tenant_id,))
+        return cursor.rowcount
+
+
+# Create a global ad copy cache instance
+ad_copy_cache = AdCopyCache()
+
+
+def _tenant_id() -> str:
+    scope = current_scope.get()
+    return scope.tenant_id if scope is not None else UNSCOPED
+
+
+def _answers_brief_tool(llm_request: LlmRequest) -> bool:
+    """Whether the request's latest content is the response to the brief tool alone.
+
+    When the brief tool ran alongside other tools, the model has to answer
+    their results too, so the copy cannot be served in its place.
+    """
+    latest = llm_request.contents[-1] if llm_request.contents else None
+    parts = (latest.parts or []) if latest is not None else []
+    return bool(parts) and all(
+        part.function_response and part.function_response.name == BRIEF_TOOL_NAME
+        for part in parts
+    )
+
+
+def serve_cached_ad_copy(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    """Before-model callback that answers a confirmed ad copy brief from the cache.
+
+    Runs on the root agent's model call right after `start_ad_copy` recorded
+    the brief. On a hit the cached copy is the response and the model is not
+    called. On a miss, or when the user asked to regenerate, the key is kept
+    in state so `store_ad_copy` can save what the model writes.
+    """
+    pending: Optional[Dict[str, Any]] = callback_context.state.get(BRIEF_STATE_KEY)
+    if not (config.AD_COPY_CACHE and pending):
+        return None
+    if not _answers_brief_tool(llm_request):
+        # The model also answers other tool results; what it writes is not
+        # the copy for the brief alone, so it is not stored either.
+        callback_context.state[BRIEF_STATE_KEY] = None
+        return None
+
+    agent = callback_context._invocation_context.agent
+    brief = AdCopyBrief(**pending["brief"])
+    key = cache_key(
+        brief,
+        # The brand configuration is rendered into the global instruction.
+        agent.canonical_instruction(callback_context) + current_brand(callback_context).config_hash,
+        llm_request.model or agent.canonical_model.model,
+        llm_request.config.temperature if llm_request.config else None,
+    )
+
+    if not pending.get("regenerate"):
+        try:
+            copy = ad_copy_cache.get(_tenant_id(), key)
+        except sqlite3.Error as e:
+            print(f"Error reading the ad copy cache: {e}")
+            copy = None
+        if copy is not None:
+            callback_context.state[BRIEF_STATE_KEY] = None
+            return LlmResponse(
+                content=types.Content(role="model", parts=[types.Part.from_text(text=copy)])
+            )
+
+    callback_context.state[BRIEF_STATE_KEY] = {**pending, "key": key}
+    return None
+
+
+def store_ad_copy(
+    callback_context: CallbackContext, llm_response: LlmResponse
+) -> Optional[LlmResponse]:
+    """After-model callback that caches the copy written for a confirmed brief."""
+    pending: Optional[Dict[str, Any]] = callback_context.state.get(BRIEF_STATE_KEY)
+    if not (pending and pending.get("key")) or llm_response.partial or not llm_response.content:
+        return None
+
+    parts = llm_response.content.parts or []
+    copy = "".join(part.text or "" for part in parts if not part.thought)
+    callback_context.state[BRIEF_STATE_KEY] = None
+    # The model asked something or called a tool instead of writing the copy.
+    if not copy.strip() or any(part.function_call for part in parts):
+        return None
+
+    try:
+        ad_copy_cache.put(_tenant_id(), pending["key"], AdCopyBrief(**pending["brief"]), copy)
+    except sqlite3.Error as e:
+        print(f"Error writing the ad copy cache: {e}")
+    return None
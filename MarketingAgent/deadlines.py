@@ -0,0 +1,130 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Awaitable, Optional, TypeVar
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+from MarketingAgent.config import config
+
+T = TypeVar("T")
+
+
+class DeadlineExceededError(Exception):
+    """Raised when work is started or still running after its turn's deadline."""
+
+
+@dataclass
+class Deadline:
+    """The point in time by which a turn or background job must finish.
+
+    Attributes:
+        expires_at: `time.monotonic()` value of the deadline.
+        owner: The invocation or job the deadline belongs to.
+    """
+
+    expires_at: float
+    owner: str = ""
+    created_at: float = field(default_factory=time.monotonic)
+
+    @classmethod
+    def after(cls, seconds: float, owner: str = "") -> "Deadline":
+        return cls(expires_at=time.monotonic() + seconds, owner=owner)
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def check(self) -> None:
+        """Raise DeadlineExceededError if the deadline has passed."""
+        if self.remaining() <= 0:
+            raise DeadlineExceededError(
+                f"The request ran past its {self.expires_at - self.created_at:.0f}s deadline "
+                "and was stopped. Tell the user and offer to try again, e.g. as a background job."
+            )
+
+
+# The deadline of the turn or job the current task works for.
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+
+def check_deadline() -> None:
+    """Raise DeadlineExceededError if the current deadline has passed.
+
+    Called before writing results no one is waiting for any more.
+    """
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def stage_timeout(stage_seconds: float) -> float:
+    """Seconds a stage may take: its own timeout, capped by the current deadline.
+
+    Raises:
+        DeadlineExceededError: If the deadline has already passed.
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return stage_seconds
+    deadline.check()
+    return min(stage_seconds, deadline.remaining())
+
+
+async def with_deadline(awaitable: Awaitable[T], stage_seconds: float) -> T:
+    """Await a model call for at most its stage timeout or the time left in the turn.
+
+    On timeout the call is cancelled, which aborts its HTTP request.
+
+    Raises:
+        DeadlineExceededError: If the deadline passes first.
+    """
+    try:
+        timeout = stage_timeout(stage_seconds)
+    except DeadlineExceededError:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except TimeoutError as e:
+        raise DeadlineExceededError(
+            f"The model call did not finish within its {timeout:.0f}s timeout. "
+            "Tell the user and offer to try again."
+        ) from e
+
+
+def _timed_out_response(error: DeadlineExceededError) -> LlmResponse:
+    return LlmResponse(
+        content=types.Content(role="model", parts=[types.Part.from_text(text=str(error))])
+    )
+
+
+def bind_turn_deadline(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    """Before-model callback that gives each root agent turn TURN_TIMEOUT_SECONDS.
+
+    The deadline starts at the turn's first model call and flows through the
+    sub-agent tools into every model call they make. Once it has passed, the
+    turn ends with a message instead of another model call.
+    """
+    invocation_id = callback_context.invocation_id
+    deadline = current_deadline.get()
+    if deadline is None or deadline.owner != invocation_id:
+        current_deadline.set(Deadline.after(config.TURN_TIMEOUT_SECONDS, owner=invocation_id))
+        return None
+    return enforce_deadline(callback_context, llm_request)
+
+
+def enforce_deadline(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    """Before-model callback that stops a sub-agent once the turn's deadline has passed."""
+    try:
+        check_deadline()
+    except DeadlineExceededError as e:
+        return _timed_out_response(e)
+    return None
@@ -0,0 +1,173 @@
+import json
+import re
+from typing import Any, List, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+from MarketingAgent.circuits import circuit_breaker
+from MarketingAgent.config import GeminiModelOptions
+from MarketingAgent.config import config
+from MarketingAgent.config import genai_client
+from MarketingAgent.deadlines import with_deadline
+from MarketingAgent.ledger import ledger
+
+HISTORY_STATE_PREFIX = "history_"
+SUMMARY_STATE_KEY = HISTORY_STATE_PREFIX + "summary"
+SUMMARIZED_TURNS_STATE_KEY = HISTORY_STATE_PREFIX + "summarized_turns"
+ARTIFACTS_STATE_KEY = HISTORY_STATE_PREFIX + "artifacts"
+
+SUMMARY_MODEL = GeminiModelOptions.GEMINI_2_0_FLASH_LITE
+# Artifact references kept for compacted turns, newest last.
+MAX_ARTIFACT_REFERENCES = 50
+# Characters of each tool call or response shown to the summarizer.
+MAX_PAYLOAD_CHARS = 300
+
+_ARTIFACT_PATTERN = re.compile(r"[\w.-]+\.(?:png|jpe?g|webp|svg)\b")
+
+SUMMARY_INSTRUCTIONS = """
+<task>You maintain the running summary of a conversation between a marketing assistant and a user.</task>
+<task>Update the current summary with the new turns.</task>
+<keep>Confirmed product or service, target audience, promotion details and ad formats.</keep>
+<keep>Brand voice decisions, approved copy and the user's stated preferences.</keep>
+<keep>Images requested, generated or edited, with their artifact filenames.</keep>
+<keep>Open questions the assistant is still waiting on.</keep>
+<avoid>Pleasantries, superseded drafts and details of tool calls.</avoid>
+<response_output>At most 250 words of short bullet points.</response_output>
+"""
+
+
+def _starts_turn(content: types.Content) -> bool:
+    """A turn starts with a user message, not with a function response."""
+    parts = content.parts or []
+    return content.role == "user" and any(part.text for part in parts) and not any(
+        part.function_response for part in parts
+    )
+
+
+def split_turns(contents: List[types.Content]) -> List[List[types.Content]]:
+    """Group request contents into turns, each starting with a user message."""
+    turns: List[List[types.Content]] = []
+    for content in contents:
+        if _starts_turn(content) or not turns:
+            turns.append([content])
+        else:
+            turns[-1].append(content)
+    return turns
+
+
+def artifact_references(turns: List[List[types.Content]]) -> List[str]:
+    """Artifact filenames mentioned by the tool calls and responses of `turns`."""
+    references: List[str] = []
+    for turn in turns:
+        for content in turn:
+            for part in content.parts or []:
+                payload: Any = None
+                if part.function_response:
+                    payload = part.function_response.response
+                elif part.function_call:
+                    payload = part.function_call.args
+                if payload is None:
+                    continue
+                for name in _ARTIFACT_PATTERN.findall(json.dumps(payload, default=str)):
+                    if name not in references:
+                        references.append(name)
+    return references
+
+
+def _render_turns(turns: List[List[types.Content]]) -> str:
+    lines = []
+    for turn in turns:
+        for content in turn:
+            for part in content.parts or []:
+                if part.text:
+                    lines.append(f"{content.role}: {part.text}")
+                elif part.function_call:
+                    args = json.dumps(part.function_call.args, default=str)[:MAX_PAYLOAD_CHARS]
+                    lines.append(f"{content.role} called {part.function_call.name}({args})")
+                elif part.function_response:
+                    response = json.dumps(part.function_response.response, default=str)
+                    lines.append(
+                        f"{part.function_response.name} returned: {response[:MAX_PAYLOAD_CHARS]}"
+                    )
+                elif part.inline_data:
+                    lines.append(f"{content.role}: [{part.inline_data.mime_type} attachment]")
+    return "\n".join(lines)
+
+
+async def _summarize(summary: str, turns: List[List[types.Content]]) -> str:
+    """Fold `turns` into `summary` with a small Gemini model."""
+    response = await with_deadline(
+        circuit_breaker(SUMMARY_MODEL).call_async(
+            genai_client.aio.models.generate_content,
+            model=SUMMARY_MODEL,
+            contents=[
+                SUMMARY_INSTRUCTIONS,
+                f"<current_summary>{summary or 'None yet.'}</current_summary>",
+                f"<new_turns>\n{_render_turns(turns)}\n</new_turns>",
+            ],
+        ),
+        config.TEXT_MODEL_TIMEOUT_SECONDS,
+    )
+    ledger.record_response(SUMMARY_MODEL, response)
+    if not response or not response.text:
+        raise ValueError("The summary model returned no text")
+    return response.text.strip()
+
+
+async def compact_history(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    """Before-model callback that bounds the history sent to the root agent.
+
+    The last `HISTORY_KEEP_TURNS` turns are sent verbatim. Older turns are
+    folded into a rolling summary kept in session state, each turn exactly
+    once, and their tool payloads are replaced by the artifact filenames they
+    referenced. If summarizing fails, times out or finds the summary model's
+    circuit open, the full history is sent instead, so no decisions are lost.
+    """
+    turns = split_turns(llm_request.contents)
+    keep = max(config.HISTORY_KEEP_TURNS, 1)
+    if len(turns) <= keep:
+        return None
+
+    older, recent = turns[:-keep], turns[-keep:]
+    summary = callback_context.state.get(SUMMARY_STATE_KEY, "")
+    summarized = callback_context.state.get(SUMMARIZED_TURNS_STATE_KEY, 0)
+    artifacts = list(callback_context.state.get(ARTIFACTS_STATE_KEY, []))
+    if summarized > len(older):
+        # The history was rewound or replaced; start the summary over.
+        summary, summarized, artifacts = "", 0, []
+
+    if summarized < len(older):
+        new_turns = older[summarized:]
+        try:
+            summary = await _summarize(summary, new_turns)
+        except Exception as e:
+            print(f"Error compacting conversation history: {e}")
+            return None
+
+        for name in artifact_references(new_turns):
+            if name in artifacts:
+                artifacts.remove(name)
+            artifacts.append(name)
+        artifacts = artifacts[-MAX_ARTIFACT_REFERENCES:]
+
+        callback_context.state[SUMMARY_STATE_KEY] = summary
+        callback_context.state[SUMMARIZED_TURNS_STATE_KEY] = len(older)
+        callback_context.state[ARTIFACTS_STATE_KEY] = artifacts
+
+    llm_request.contents = [content for turn in recent for content in turn]
+    earlier_artifacts = "\n".join(f"- {name}" for name in artifacts) or "- None"
+    llm_request.append_instructions(
+        [
+            "<conversation_summary>\n"
+            "Earlier turns of this conversation were condensed into this summary:\n"
+            f"{summary}\n"
+            "Artifacts created in those turns, which load_artifacts can load by name:\n"
+            f"{earlier_artifacts}\n"
+            "</conversation_summary>"
+        ]
+    )
+    return None
@@ -0,0 +1,645 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, wait
+from contextlib import closing
+from dataclasses import asdict, dataclass
+from enum import StrEnum
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.artifacts import BaseArtifactService
+from google.adk.models import LlmRequest
+from google.adk.tools import ToolContext
+from google.genai import types
+
+from MarketingAgent.config import config
+from MarketingAgent.deadlines import Deadline
+from MarketingAgent.deadlines import DeadlineExceededError
+from MarketingAgent.deadlines import current_deadline
+from MarketingAgent.deadlines import with_deadline
+from MarketingAgent.ledger import UsageScope
+from MarketingAgent.ledger import current_scope
+from MarketingAgent.ledger import tenant_for_user
+from MarketingAgent.parallel import output_state_key
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    args TEXT NOT NULL,
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    tenant_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    notified INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_session ON jobs (app_name, user_id, session_id, created_at);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+
+# Running jobs whose worker has not reported for this many heartbeats are
+# taken to be abandoned by a crashed process and are run again.
+STALE_HEARTBEATS = 3
+
+JobHandler = Callable[..., Awaitable[Dict[str, Any]]]
+JobListener = Callable[["Job"], None]
+
+
+class JobStatus(StrEnum):
+    """Lifecycle of a background job."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+@dataclass(frozen=True)
+class Job:
+    """A tool call deferred to the background worker pool."""
+
+    job_id: str
+    kind: str
+    args: Dict[str, Any]
+    app_name: str
+    user_id: str
+    session_id: str
+    tenant_id: str
+    status: JobStatus
+    result: Optional[Dict[str, Any]]
+    error: Optional[str]
+    attempts: int
+    notified: bool
+    created_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    heartbeat_at: Optional[float] = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        values = dict(row)
+        values["args"] = json.loads(values["args"])
+        values["result"] = json.loads(values["result"]) if values["result"] else None
+        values["status"] = JobStatus(values["status"])
+        values["notified"] = bool(values["notified"])
+        return cls(**values)
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        summary = {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status.value,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if self.result is not None:
+            summary["result"] = self.result
+        if self.error:
+            summary["error"] = self.error
+        return summary
+
+
+class JobStore:
+    """SQLite record of every background job, so queued work survives restarts.
+
+    Args:
+        cache_dir: The directory to keep the job database in.
+    """
+
+    def __init__(self, cache_dir: str = ".cache"):
+        self.db_path = Path(cache_dir) / "jobs.db"
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if not self._initialized:
+                self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                with closing(sqlite3.connect(self.db_path, timeout=30)) as connection:
+                    connection.execute("PRAGMA journal_mode=WAL")
+                    connection.executescript(_SCHEMA)
+                    columns = {row[1] for row in connection.execute("PRAGMA table_info(jobs)")}
+                    if "heartbeat_at" not in columns:
+                        connection.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+                self._initialized = True
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def insert(self, job: Job) -> None:
+        values = asdict(job)
+        values["args"] = json.dumps(job.args)
+        values["result"] = None
+        values["status"] = job.status.value
+        values["notified"] = int(job.notified)
+        columns = ", ".join(values)
+        placeholders = ", ".join(f":{column}" for column in values)
+        with closing(self._connect()) as connection:
+            connection.execute(f"INSERT INTO jobs ({columns}) VALUES ({placeholders})", values)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row else None
+
+    def claim(self, job_id: str, stale_after: float) -> bool:
+        """Mark a job running, unless a live worker already runs it.
+
+        Queued jobs can be claimed, and so can running jobs without a
+        heartbeat for `stale_after` seconds. The update is atomic, so one
+        worker process wins when several try to run the same job.
+
+        Returns:
+            Whether this caller claimed the job.
+        """
+        now = time.time()
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ?,"
+                " attempts = attempts + 1 WHERE job_id = ?"
+                " AND (status = ? OR (status = ? AND COALESCE(heartbeat_at, started_at, 0) < ?))",
+                (
+                    JobStatus.RUNNING.value,
+                    now,
+                    now,
+                    job_id,
+                    JobStatus.QUEUED.value,
+                    JobStatus.RUNNING.value,
+                    now - stale_after,
+                ),
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job_ids: List[str]) -> None:
+        """Record that the given running jobs are still being worked on."""
+        with closing(self._connect()) as connection:
+            connection.executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND status = ?",
+                [(time.time(), job_id, JobStatus.RUNNING.value) for job_id in job_ids],
+            )
+
+    def stale(self, stale_after: float) -> List[Job]:
+        """Jobs no worker has touched for `stale_after` seconds.
+
+        These are running jobs without a recent heartbeat and jobs that have
+        been queued that long, e.g. by a worker that was shut down.
+        """
+        cutoff = time.time() - stale_after
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT * FROM jobs WHERE (status = ? AND created_at < ?)"
+                " OR (status = ? AND COALESCE(heartbeat_at, started_at, 0) < ?)"
+                " ORDER BY created_at",
+                (JobStatus.QUEUED.value, cutoff, JobStatus.RUNNING.value, cutoff),
+            ).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def finish(
+        self,
+        job_id: str,
+        status: JobStatus,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?"
+                " WHERE job_id = ?",
+                (
+                    status.value,
+                    json.dumps(result, default=str) if result is not None else None,
+                    error,
+                    time.time(),
+                    job_id,
+                ),
+            )
+
+    def unfinished(self) -> List[Job]:
+        """Jobs that were queued or running, oldest first."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (JobStatus.QUEUED.value, JobStatus.RUNNING.value),
+            ).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def for_session(
+        self, app_name: str, user_id: str, session_id: str, limit: int = 20
+    ) -> List[Job]:
+        """The session's most recent jobs, newest first."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT * FROM jobs WHERE app_name = ? AND user_id = ? AND session_id = ?"
+                " ORDER BY created_at DESC LIMIT ?",
+                (app_name, user_id, session_id, limit),
+            ).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def take_unnotified(self, app_name: str, user_id: str, session_id: str) -> List[Job]:
+        """Finished jobs of the session not yet reported, marking them reported."""
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute(
+                    "SELECT * FROM jobs WHERE app_name = ? AND user_id = ? AND session_id = ?"
+                    " AND status IN (?, ?) AND notified = 0 ORDER BY finished_at",
+                    (
+                        app_name,
+                        user_id,
+                        session_id,
+                        JobStatus.SUCCEEDED.value,
+                        JobStatus.FAILED.value,
+                    ),
+                ).fetchall()
+                connection.executemany(
+                    "UPDATE jobs SET notified = 1 WHERE job_id = ?",
+                    [(row["job_id"],) for row in rows],
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return [Job.from_row(row) for row in rows]
+
+
+class DetachedToolContext:
+    """Stands in for the `ToolContext` of a tool called outside a conversation turn.
+
+    The tools only need `save_artifact`, `load_artifact` and `state`. Artifacts
+    are bound to the given session rather than to a turn, e.g. the session
+    that submitted a background job, which has long finished its turn.
+
+    Args:
+        artifact_service: Where artifacts are saved.
+        app_name: The app the artifacts belong to.
+        user_id: The user the artifacts belong to.
+        session_id: The session the artifacts belong to.
+    """
+
+    def __init__(
+        self,
+        artifact_service: Optional[BaseArtifactService],
+        app_name: str,
+        user_id: str,
+        session_id: str,
+    ):
+        self._artifact_service = artifact_service
+        self.app_name = app_name
+        self.user_id = user_id
+        self.session_id = session_id
+        self.state: Dict[str, Any] = {}
+
+    async def save_artifact(self, filename: str, artifact: types.Part) -> int:
+        if self._artifact_service is None:
+            raise ValueError("Artifact service is not initialized.")
+        return await self._artifact_service.save_artifact(
+            app_name=self.app_name,
+            user_id=self.user_id,
+            session_id=self.session_id,
+            filename=filename,
+            artifact=artifact,
+        )
+
+    async def load_artifact(
+        self, filename: str, version: Optional[int] = None
+    ) -> Optional[types.Part]:
+        if self._artifact_service is None:
+            raise ValueError("Artifact service is not initialized.")
+        return await self._artifact_service.load_artifact(
+            app_name=self.app_name,
+            user_id=self.user_id,
+            session_id=self.session_id,
+            filename=filename,
+            version=version,
+        )
+
+
+class JobQueue:
+    """Runs slow tool calls outside the conversation turn, a bounded number at a time.
+
+    Jobs run on one long-lived event loop in a thread of its own, so they
+    never compete with requests for the server loop, and the async clients
+    they use stay bound to a single loop for the life of the process. Jobs are
+    recorded in a `JobStore` before they are queued; the first time the queue
+    is bound to an artifact service, jobs left unfinished by a previous process
+    are queued again.
+
+    Several server processes can share one store. A job is claimed atomically
+    before it runs, running jobs send a heartbeat every `heartbeat_seconds`,
+    and jobs whose process stopped sending heartbeats are run again by
+    whichever process notices first.
+
+    Args:
+        store: Where jobs are recorded.
+        max_workers: Number of jobs that run at the same time.
+        heartbeat_seconds: Seconds between heartbeats of running jobs.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        max_workers: int = config.JOB_WORKERS,
+        heartbeat_seconds: float = config.JOB_HEARTBEAT_SECONDS,
+    ):
+        self.store = store
+        self.max_workers = max_workers
+        self.heartbeat_seconds = heartbeat_seconds
+        self._handlers: Dict[str, JobHandler] = {}
+        self._state_keys: Dict[str, str] = {}
+        self._listeners: List[JobListener] = []
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._artifact_service: Optional[BaseArtifactService] = None
+        self._futures: Dict[str, Future] = {}
+        self._running: Set[str] = set()
+        self._stopped = threading.Event()
+        self.draining = False
+
+    def register(self, kind: str, handler: JobHandler, state_key: Optional[str] = None) -> None:
+        """Make a tool available as a job.
+
+        Args:
+            kind: The job kind, usually the tool name.
+            handler: The async tool function, called with the job args and a
+                tool context.
+            state_key: Session state key the result is stored under on completion,
+                suffixed with the job id.
+        """
+        self._handlers[kind] = handler
+        if state_key:
+            self._state_keys[kind] = state_key
+
+    def add_listener(self, listener: JobListener) -> None:
+        """Call `listener` with every job as it finishes, on the job loop; it must not block."""
+        self._listeners.append(listener)
+
+    def bind(self, artifact_service: Optional[BaseArtifactService]) -> None:
+        """Start the job loop on first use and resume unfinished jobs."""
+        with self._lock:
+            if artifact_service is not None:
+                self._artifact_service = artifact_service
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._slots = asyncio.Semaphore(self.max_workers)
+            threading.Thread(target=self._loop.run_forever, name="job-loop", daemon=True).start()
+            resumed = self.store.unfinished()
+            threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True).start()
+
+        for job in resumed:
+            if self._queue(job.job_id):
+                print(f"Resuming background job {job.job_id} ({job.kind})")
+
+    def _queue(self, job_id: str) -> bool:
+        with self._lock:
+            if self.draining or job_id in self._futures:
+                return False
+            future = asyncio.run_coroutine_threadsafe(self._run(job_id), self._loop)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._forget(job_id))
+        return True
+
+    def _forget(self, job_id: str) -> None:
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def _heartbeat_loop(self) -> None:
+        """Keep this process's running jobs alive and pick up abandoned ones."""
+        stale_after = self.heartbeat_seconds * STALE_HEARTBEATS
+        while not self._stopped.wait(self.heartbeat_seconds):
+            try:
+                with self._lock:
+                    running = list(self._running)
+                if running:
+                    self.store.heartbeat(running)
+                for job in self.store.stale(stale_after):
+                    if self._queue(job.job_id):
+                        print(f"Picking up abandoned background job {job.job_id} ({job.kind})")
+            except Exception as e:
+                print(f"Error in background job heartbeat: {e}")
+
+    def drain(self, timeout: float) -> int:
+        """Stop taking jobs and wait for the running ones to finish.
+
+        Jobs that have not started stay queued in the store, for another
+        process or the next start to pick up.
+
+        Args:
+            timeout: Seconds to wait for running jobs.
+
+        Returns:
+            The number of jobs still running when the timeout passed.
+        """
+        with self._lock:
+            self.draining = True
+            futures = list(self._futures.values())
+        # Jobs waiting for a slot return without running once they get one.
+        _, not_done = wait(futures, timeout=timeout)
+        self._stopped.set()
+        return len(not_done)
+
+    def submit(self, kind: str, args: Dict[str, Any], tool_context: ToolContext) -> Job:
+        """Record a job for the current session and queue it.
+
+        Args:
+            kind: A registered job kind.
+            args: Keyword arguments for the handler, JSON serializable.
+            tool_context: The context of the tool call submitting the job.
+
+        Returns:
+            The queued job.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self.draining:
+            raise RuntimeError("The server is shutting down; try again in a moment.")
+
+        invocation_context = tool_context._invocation_context
+        scope = current_scope.get() or UsageScope(
+            app_name=invocation_context.app_name,
+            user_id=invocation_context.user_id,
+            session_id=invocation_context.session.id,
+            tenant_id=tenant_for_user(invocation_context.user_id),
+        )
+        job = Job(
+            job_id=uuid.uuid4().hex[:12],
+            kind=kind,
+            args=args,
+            app_name=scope.app_name,
+            user_id=scope.user_id,
+            session_id=scope.session_id,
+            tenant_id=scope.tenant_id,
+            status=JobStatus.QUEUED,
+            result=None,
+            error=None,
+            attempts=0,
+            notified=False,
+            created_at=time.time(),
+            started_at=None,
+            finished_at=None,
+        )
+        # Bind first, so resuming unfinished jobs cannot pick this one up as well.
+        self.bind(invocation_context.artifact_service)
+        self.store.insert(job)
+        self._queue(job.job_id)
+        return job
+
+    async def _run(self, job_id: str) -> None:
+        async with self._slots:
+            if self.draining:
+                # Left queued for another process or the next start.
+                return
+            await self._run_job(job_id)
+
+    async def _run_job(self, job_id: str) -> None:
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job.done:
+            return
+        handler = self._handlers.get(job.kind)
+        if handler is None:
+            await asyncio.to_thread(
+                self.store.finish, job_id, JobStatus.FAILED, error=f"Unknown job kind: {job.kind}"
+            )
+            return
+
+        stale_after = self.heartbeat_seconds * STALE_HEARTBEATS
+        if not await asyncio.to_thread(self.store.claim, job_id, stale_after):
+            # Another process is running it.
+            return
+        with self._lock:
+            self._running.add(job_id)
+        # Each job is a task of its own, so these only apply to this job.
+        current_scope.set(
+            UsageScope(
+                app_name=job.app_name,
+                user_id=job.user_id,
+                session_id=job.session_id,
+                tenant_id=job.tenant_id,
+            )
+        )
+        # Jobs run outside any turn, so they get a deadline of their own; it
+        # caps every model call of the job and stops the job when it passes.
+        deadline = Deadline.after(config.JOB_TIMEOUT_SECONDS, owner=job_id)
+        current_deadline.set(deadline)
+        try:
+            result = await with_deadline(
+                handler(
+                    **job.args,
+                    tool_context=DetachedToolContext(
+                        self._artifact_service, job.app_name, job.user_id, job.session_id
+                    ),
+                ),
+                deadline.remaining(),
+            )
+            if isinstance(result, dict) and result.get("success") is False:
+                await asyncio.to_thread(
+                    self.store.finish, job_id, JobStatus.FAILED, result=result, error=result.get("error")
+                )
+            else:
+                await asyncio.to_thread(self.store.finish, job_id, JobStatus.SUCCEEDED, result=result)
+        except DeadlineExceededError as e:
+            print(f"Background job {job_id} timed out")
+            if deadline.remaining() <= 0:
+                error = f"The job did not finish within {config.JOB_TIMEOUT_SECONDS:.0f}s and was stopped."
+            else:
+                error = str(e)
+            await asyncio.to_thread(self.store.finish, job_id, JobStatus.FAILED, error=error)
+        except Exception as e:
+            print(f"Background job {job_id} failed: {e}")
+            await asyncio.to_thread(self.store.finish, job_id, JobStatus.FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+
+        finished = await asyncio.to_thread(self.store.get, job_id)
+        for listener in self._listeners:
+            try:
+                listener(finished)
+            except Exception as e:
+                print(f"Job listener failed for {job_id}: {e}")
+
+    def state_key(self, kind: str) -> Optional[str]:
+        return self._state_keys.get(kind)
+
+
+job_queue = JobQueue(JobStore())
+
+
+def submit_job(kind: str, args: Dict[str, Any], tool_context: ToolContext) -> Dict[str, Any]:
+    """Queue a tool call as a background job and describe the handle to the agent."""
+    try:
+        job = job_queue.submit(kind, args, tool_context)
+    except Exception as e:
+        print(f"Error submitting background job: {e}")
+        return {"success": False, "error": f"Could not start background job: {str(e)}"}
+
+    return {
+        "job_id": job.job_id,
+        "status": job.status.value,
+        "message": (
+            "The job is running in the background. The user will be notified when "
+            "it finishes; use check_jobs to see its progress."
+        ),
+        "success": True,
+    }
+
+
+def _describe(job: Job) -> str:
+    if job.status == JobStatus.FAILED:
+        return f"- Job {job.job_id} ({job.kind}) failed: {job.error}"
+    artifact = (job.result or {}).get("artifact_filename")
+    if artifact:
+        return f"- Job {job.job_id} ({job.kind}) finished: saved as '{artifact}'"
+    return f"- Job {job.job_id} ({job.kind}) finished: {json.dumps(job.result, default=str)}"
+
+
+def deliver_job_notifications(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> None:
+    """Before-model callback that tells the root agent about finished background jobs.
+
+    Results are also written to session state, under the key the job kind was
+    registered with. Bind after `bind_usage_scope`.
+    """
+    job_queue.bind(callback_context._invocation_context.artifact_service)
+
+    scope = current_scope.get()
+    if scope is None:
+        return None
+
+    finished = job_queue.store.take_unnotified(scope.app_name, scope.user_id, scope.session_id)
+    if not finished:
+        return None
+
+    for job in finished:
+        state_key = job_queue.state_key(job.kind)
+        if state_key:
+            callback_context.state[output_state_key(state_key, job.job_id)] = job.to_dict()
+
+    llm_request.append_instructions(
+        [
+            "<background_jobs>\n"
+            "These background jobs finished since they were started. Tell the user about them:\n"
+            + "\n".join(_describe(job) for job in finished)
+            + "\n</background_jobs>"
+        ]
+    )
+    return None
@@ -0,0 +1,530 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+from MarketingAgent.config import GeminiModelOptions, config
+
+# List prices in USD: (input per 1M tokens, output per 1M tokens, per image).
+MODEL_PRICING: Dict[str, Tuple[float, float, float]] = {
+    GeminiModelOptions.GEMINI_2_0_FLASH_LITE: (0.075, 0.30, 0.0),
+    GeminiModelOptions.GEMINI_2_0_FLASH: (0.10, 0.40, 0.0),
+    GeminiModelOptions.GEMINI_2_5_FLASH: (0.15, 0.60, 0.0),
+    GeminiModelOptions.GEMINI_2_5_PRO: (1.25, 10.00, 0.0),
+    GeminiModelOptions.IMAGEN_3_0_GENERATE: (0.0, 0.0, 0.04),
+    GeminiModelOptions.IMAGEN_3_0_EDIT: (0.0, 0.0, 0.04),
+}
+
+# Cached input tokens are billed at a fraction of the regular input price.
+CACHED_INPUT_PRICE_RATIO = 0.25
+
+UNSCOPED = "unscoped"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage_records (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL NOT NULL,
+    model TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    tenant_id TEXT NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    images INTEGER NOT NULL,
+    cost_usd REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS usage_totals (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    images INTEGER NOT NULL,
+    cost_usd REAL NOT NULL,
+    PRIMARY KEY (kind, name)
+);
+"""
+
+_TOTAL_COLUMNS = "calls, input_tokens, output_tokens, cached_tokens, images, cost_usd"
+
+# Adds one call to the totals of a scope: overall ("all"), a model, a session or a tenant.
+_ADD_TOTALS = """
+INSERT INTO usage_totals
+    (kind, name, calls, input_tokens, output_tokens, cached_tokens, images, cost_usd)
+VALUES (?, ?, 1, ?, ?, ?, ?, ?)
+ON CONFLICT (kind, name) DO UPDATE SET
+    calls = calls + 1,
+    input_tokens = input_tokens + excluded.input_tokens,
+    output_tokens = output_tokens + excluded.output_tokens,
+    cached_tokens = cached_tokens + excluded.cached_tokens,
+    images = images + excluded.images,
+    cost_usd = cost_usd + excluded.cost_usd
+"""
+
+
+@dataclass(frozen=True)
+class UsageScope:
+    """Identifies the session and tenant that usage is charged to."""
+
+    app_name: str
+    user_id: str
+    session_id: str
+    tenant_id: str
+
+
+# Bound by the root agent at the start of every model call, so tools and
+# sub-agents running inside AgentTool's throwaway sessions still charge the
+# user's real session.
+current_scope: ContextVar[Optional[UsageScope]] = ContextVar(
+    "usage_scope", default=None
+)
+
+
+class BudgetExceededError(Exception):
+    """Raised when a call would exceed a hard session or tenant budget."""
+
+
+@dataclass(frozen=True)
+class UsageRecord:
+    """Usage of a single model call."""
+
+    timestamp: float
+    model: str
+    session_id: str
+    tenant_id: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    images: int = 0
+    cost_usd: float = 0.0
+
+
+@dataclass
+class UsageTotals:
+    """Accumulated usage for a session, tenant or model."""
+
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    images: int = 0
+    cost_usd: float = 0.0
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        summary = asdict(self)
+        summary["tokens"] = self.tokens
+        summary["cost_usd"] = round(self.cost_usd, 6)
+        return summary
+
+
+def estimate_cost(
+    model: str,
+    input_tokens: int = 0,
+    output_tokens: int = 0,
+    cached_tokens: int = 0,
+    images: int = 0,
+) -> float:
+    """Estimate the list-price cost of a call in USD.
+
+    Args:
+        model: The model name.
+        input_tokens: Prompt tokens, including cached tokens.
+        output_tokens: Response tokens.
+        cached_tokens: Prompt tokens served from the context cache.
+        images: Number of images returned.
+
+    Returns:
+        The estimated cost, or 0.0 for models without a known price.
+    """
+    input_price, output_price, image_price = MODEL_PRICING.get(model, (0.0, 0.0, 0.0))
+    billed_input = input_tokens - cached_tokens + cached_tokens * CACHED_INPUT_PRICE_RATIO
+    return (
+        billed_input * input_price / 1_000_000
+        + output_tokens * output_price / 1_000_000
+        + images * image_price
+    )
+
+
+class UsageLedger:
+    """Token, image and cost ledger with session and tenant budgets, kept in SQLite.
+
+    Usage survives restarts and is shared by every server worker using the
+    same database, so budgets hold across processes. Budgets are read from
+    the configuration each time they are checked, so a reloaded `.env`
+    applies right away. They are hard stops: `check_budget` raises
+    `BudgetExceededError` when a call would push a session or tenant past its
+    limit. Crossing BUDGET_SOFT_LIMIT_RATIO of a budget logs a warning once
+    per scope and process.
+
+    Args:
+        db_path: The usage database.
+        max_records: Per-call records kept; totals are kept in full.
+    """
+
+    def __init__(self, db_path: str = config.USAGE_DB_PATH, max_records: int = 10_000):
+        self.db_path = Path(db_path)
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self._keepalive: Optional[sqlite3.Connection] = None
+        self._recorded = 0
+        self._warnings: Dict[Tuple[str, str], List[str]] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._keepalive is None:
+                self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                # Kept open so closing a per-operation connection never
+                # checkpoints the log, as in SqliteSessionService.
+                keepalive = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+                keepalive.execute("PRAGMA journal_mode=WAL")
+                keepalive.executescript(_SCHEMA)
+                self._keepalive = keepalive
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        # WAL stays consistent without a sync per write; a crash loses at most the last calls.
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _totals(self, connection: sqlite3.Connection, kind: str, name: str) -> UsageTotals:
+        row = connection.execute(
+            f"SELECT {_TOTAL_COLUMNS} FROM usage_totals WHERE kind = ? AND name = ?", (kind, name)
+        ).fetchone()
+        totals = UsageTotals(**dict(row)) if row else UsageTotals()
+        totals.warnings = list(self._warnings.get((kind, name), []))
+        return totals
+
+    def _all_totals(self, connection: sqlite3.Connection, kind: str) -> Dict[str, UsageTotals]:
+        rows = connection.execute(
+            f"SELECT name, {_TOTAL_COLUMNS} FROM usage_totals WHERE kind = ? ORDER BY name",
+            (kind,),
+        ).fetchall()
+        totals = {}
+        for row in rows:
+            values = dict(row)
+            name = values.pop("name")
+            warnings = list(self._warnings.get((kind, name), []))
+            totals[name] = UsageTotals(**values, warnings=warnings)
+        return totals
+
+    @staticmethod
+    def _budgets(
+        scope: UsageScope, session: UsageTotals, tenant: UsageTotals
+    ) -> List[Tuple[Tuple[str, str], str, UsageTotals, str, Optional[int]]]:
+        session_key, session_label = ("session", scope.session_id), f"session '{scope.session_id}'"
+        tenant_key, tenant_label = ("tenant", scope.tenant_id), f"tenant '{scope.tenant_id}'"
+        return [
+            (session_key, session_label, session, "tokens", config.SESSION_TOKEN_BUDGET),
+            (session_key, session_label, session, "images", config.SESSION_IMAGE_BUDGET),
+            (tenant_key, tenant_label, tenant, "tokens", config.TENANT_TOKEN_BUDGET),
+            (tenant_key, tenant_label, tenant, "images", config.TENANT_IMAGE_BUDGET),
+        ]
+
+    def check_budget(
+        self, tokens: int = 0, images: int = 0, scope: Optional[UsageScope] = None
+    ) -> None:
+        """Fail fast if a planned call would exceed a hard budget.
+
+        Args:
+            tokens: Tokens the call is expected to use.
+            images: Images the call is expected to produce.
+            scope: The scope to charge; defaults to the bound `current_scope`.
+
+        Raises:
+            BudgetExceededError: If the session or tenant budget would be exceeded.
+        """
+        scope = scope or current_scope.get()
+        if scope is None:
+            return
+        budgets = (
+            config.SESSION_TOKEN_BUDGET,
+            config.SESSION_IMAGE_BUDGET,
+            config.TENANT_TOKEN_BUDGET,
+            config.TENANT_IMAGE_BUDGET,
+        )
+        if all(budget is None for budget in budgets):
+            return
+
+        planned = {"tokens": tokens, "images": images}
+        with closing(self._connect()) as connection:
+            session = self._totals(connection, "session", scope.session_id)
+            tenant = self._totals(connection, "tenant", scope.tenant_id)
+        for _, label, totals, unit, budget in self._budgets(scope, session, tenant):
+            used = getattr(totals, unit)
+            if budget is not None and used + planned[unit] > budget:
+                raise BudgetExceededError(
+                    f"The {unit} budget for {label} is exhausted "
+                    f"({used} of {budget} used). Ask an administrator to raise it."
+                )
+
+    def record(
+        self,
+        model: str,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        cached_tokens: int = 0,
+        images: int = 0,
+        scope: Optional[UsageScope] = None,
+    ) -> UsageRecord:
+        """Record the usage of a completed call.
+
+        Args:
+            model: The model that served the call.
+            input_tokens: Prompt tokens, including cached tokens.
+            output_tokens: Response tokens.
+            cached_tokens: Prompt tokens served from the context cache.
+            images: Number of images returned.
+            scope: The scope to charge; defaults to the bound `current_scope`.
+
+        Returns:
+            The stored UsageRecord.
+        """
+        scope = scope or current_scope.get()
+        record = UsageRecord(
+            timestamp=time.time(),
+            model=str(model),
+            session_id=scope.session_id if scope else UNSCOPED,
+            tenant_id=scope.tenant_id if scope else UNSCOPED,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cached_tokens=cached_tokens,
+            images=images,
+            cost_usd=estimate_cost(model, input_tokens, output_tokens, cached_tokens, images),
+        )
+        increments = (
+            record.input_tokens,
+            record.output_tokens,
+            record.cached_tokens,
+            record.images,
+            record.cost_usd,
+        )
+
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "INSERT INTO usage_records (timestamp, model, session_id, tenant_id,"
+                    " input_tokens, output_tokens, cached_tokens, images, cost_usd)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        record.timestamp,
+                        record.model,
+                        record.session_id,
+                        record.tenant_id,
+                        *increments,
+                    ),
+                )
+                connection.executemany(
+                    _ADD_TOTALS,
+                    [
+                        (kind, name, *increments)
+                        for kind, name in (
+                            ("all", ""),
+                            ("model", record.model),
+                            ("session", record.session_id),
+                            ("tenant", record.tenant_id),
+                        )
+                    ],
+                )
+                with self._lock:
+                    self._recorded += 1
+                    prune = self._recorded % 100 == 0
+                if prune:
+                    connection.execute(
+                        "DELETE FROM usage_records"
+                        " WHERE seq <= (SELECT MAX(seq) FROM usage_records) - ?",
+                        (self.max_records,),
+                    )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            if scope is not None:
+                self._warn_near_limits(connection, scope)
+
+        return record
+
+    def record_response(
+        self,
+        model: str,
+        response: Any,
+        scope: Optional[UsageScope] = None,
+    ) -> Optional[UsageRecord]:
+        """Record the `usage_metadata` of a `generate_content` response.
+
+        Args:
+            model: The model that served the call.
+            response: A GenerateContentResponse, or None.
+            scope: The scope to charge; defaults to the bound `current_scope`.
+
+        Returns:
+            The stored UsageRecord, or None if the response has no usage metadata.
+        """
+        usage: Optional[types.GenerateContentResponseUsageMetadata] = getattr(
+            response, "usage_metadata", None
+        )
+        if usage is None:
+            return None
+
+        return self.record(
+            model,
+            input_tokens=usage.prompt_token_count or 0,
+            output_tokens=(usage.candidates_token_count or 0)
+            + (usage.thoughts_token_count or 0),
+            cached_tokens=usage.cached_content_token_count or 0,
+            scope=scope,
+        )
+
+    def _warn_near_limits(self, connection: sqlite3.Connection, scope: UsageScope) -> None:
+        session = self._totals(connection, "session", scope.session_id)
+        tenant = self._totals(connection, "tenant", scope.tenant_id)
+        for key, label, totals, unit, budget in self._budgets(scope, session, tenant):
+            if budget is None:
+                continue
+            used = getattr(totals, unit)
+            warning = f"{unit} budget for {label}"
+            with self._lock:
+                warnings = self._warnings.setdefault(key, [])
+                if used < budget * config.BUDGET_SOFT_LIMIT_RATIO or warning in warnings:
+                    continue
+                warnings.append(warning)
+            print(f"Usage warning: {label} has used {used} of {budget} {unit}")
+
+    def session_summary(self, session_id: str) -> Dict[str, Any]:
+        """Totals for one session."""
+        with closing(self._connect()) as connection:
+            return self._totals(connection, "session", session_id).to_dict()
+
+    def tenant_summary(self, tenant_id: str) -> Dict[str, Any]:
+        """Totals for one tenant."""
+        with closing(self._connect()) as connection:
+            return self._totals(connection, "tenant", tenant_id).to_dict()
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals overall and broken down by model, tenant and session.
+
+        Returns:
+            A dictionary suitable for capacity planning reports.
+        """
+        with closing(self._connect()) as connection:
+            return {
+                "totals": self._totals(connection, "all", "").to_dict(),
+                **{
+                    f"{kind}s": {
+                        name: totals.to_dict()
+                        for name, totals in self._all_totals(connection, kind).items()
+                    }
+                    for kind in ("model", "tenant", "session")
+                },
+            }
+
+    def records(self) -> List[UsageRecord]:
+        """The most recent per-call records, oldest first."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT * FROM usage_records ORDER BY seq DESC LIMIT ?", (self.max_records,)
+            ).fetchall()
+        records = []
+        for row in reversed(rows):
+            values = dict(row)
+            del values["seq"]
+            records.append(UsageRecord(**values))
+        return records
+
+    def reset(self) -> None:
+        """Forget all recorded usage, e.g. at the start of a billing period."""
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM usage_records")
+            connection.execute("DELETE FROM usage_totals")
+        with self._lock:
+            self._warnings.clear()
+
+
+ledger = UsageLedger()
+
+
+_tenants_lock = threading.Lock()
+# The TENANTS_FILE mapping, with the path and modification time it was read at.
+_tenants: Tuple[Optional[Tuple[str, int]], Dict[str, str]] = (None, {})
+
+
+def tenant_for_user(user_id: str) -> str:
+    """The tenant a user belongs to, as mapped in TENANTS_FILE.
+
+    The tenant decides whose budgets are charged and whose images, prompts
+    and cached copy a user can reach, so it is only ever taken from the
+    server's own mapping, never from session state, which clients write.
+    Users the mapping does not list are tenants of their own. The file is
+    read again when it changes.
+    """
+    global _tenants
+    if not config.TENANTS_FILE:
+        return user_id
+    path = Path(config.TENANTS_FILE)
+    try:
+        signature = (str(path), path.stat().st_mtime_ns)
+    except OSError as e:
+        print(f"Error reading tenants file {path}: {e}")
+        return user_id
+
+    with _tenants_lock:
+        if _tenants[0] != signature:
+            try:
+                mapping = json.loads(path.read_text(encoding="utf-8"))
+                if not isinstance(mapping, dict):
+                    raise ValueError("expected an object of user ids to tenant ids")
+                _tenants = (signature, {str(user): str(tenant) for user, tenant in mapping.items()})
+            except (OSError, ValueError) as e:
+                print(f"Error reading tenants file {path}: {e}")
+                _tenants = (signature, {})
+        return _tenants[1].get(user_id, user_id)
+
+
+def bind_usage_scope(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    """Before-model callback that charges the turn to the caller's session.
+
+    Only the root agent should bind the scope; sub-agents run in throwaway
+    sessions created by AgentTool and inherit the root's scope.
+
+    The tenant is looked up for the user id with `tenant_for_user`.
+    """
+    invocation_context = callback_context._invocation_context
+    session = invocation_context.session
+    current_scope.set(
+        UsageScope(
+            app_name=invocation_context.app_name,
+            user_id=invocation_context.user_id,
+            session_id=session.id,
+            tenant_id=tenant_for_user(invocation_context.user_id),
+        )
+    )
+    return None
+
+
+def enforce_budget(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    """Before-model callback that stops the turn once a hard budget is spent."""
+    try:
+        ledger.check_budget()
+    except BudgetExceededError as e:
+        return LlmResponse(
+            content=types.Content(role="model", parts=[types.Part.from_text(text=str(e))])
+        )
+    return None
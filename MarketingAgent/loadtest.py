@@ -0,0 +1,950 @@
+"""Concurrent-session load harness for ``root_agent``.
+
+Drives N simultaneous sessions through the ADK ``Runner`` with in-memory
+session and artifact services, replaying scripted marketing conversations
+against a stubbed model backend. Run it with::
+
+    python -m MarketingAgent.loadtest --sessions 50 --turn-concurrency 50
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import re
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.events import Event
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.adk.tools import BaseTool, ToolContext
+from google.genai import types
+
+from MarketingAgent import history
+from MarketingAgent.agent import root_agent
+from MarketingAgent.artifacts import LocalArtifactService
+from MarketingAgent.assistants.editing import tools as editing_tools
+from MarketingAgent.assistants.editing.agent import image_editing_agent
+from MarketingAgent.assistants.generation import tools as generation_tools
+from MarketingAgent.assistants.generation.agent import image_generation_agent
+from MarketingAgent.config import LoopLocalClient
+from MarketingAgent.jobs import JobStatus
+from MarketingAgent.jobs import job_queue
+from MarketingAgent.ledger import ledger
+from MarketingAgent.parallel import output_state_key
+from MarketingAgent.sessions import SqliteSessionService
+
+APP_NAME = "MarketingAgent"
+
+# Scripted conversations replayed by each session, one user message per turn.
+SCENARIOS: Dict[str, List[str]] = {
+    "ad_copy": [
+        "Write banner ad copy for our spring tune-up service targeting first-time customers.",
+        "Yes, that's correct. The promotion is 20% off through April.",
+    ],
+    "generate": [
+        "Generate an image of a cozy coffee shop at sunrise.",
+    ],
+    "icon": [
+        "Generate an icon of a wrench for the services page.",
+    ],
+    # Prompts sharing their first 30 characters, requested in one model response.
+    "parallel": [
+        "Generate each of these images: a summer sale storefront banner in red; "
+        "a summer sale storefront banner in blue; a summer sale storefront banner in green.",
+    ],
+    # Two jobs back to back; they run on the job loop after their turns end.
+    "background": [
+        "Generate an image of a delivery van at dawn in the background.",
+        "Generate an image of a delivery van at dusk in the background.",
+    ],
+    "edit_chain": [
+        "Generate an image of our flagship product on a wooden table.",
+        "Edit the image: replace the background with a bright blue studio wall.",
+        "Edit the image: add a warm sunset glow.",
+    ],
+    # Long enough for history compaction to fold the early turns many times over.
+    "long_session": 2 * [
+        "Write banner ad copy for our spring tune-up service targeting first-time customers.",
+        "Yes, that's correct. The promotion is 20% off through April.",
+        "Generate an image of a technician greeting a customer.",
+        "Now write an email version of the ad copy.",
+        "Edit the image: add a warm sunset glow.",
+        "Write a social media post version too.",
+        "Generate an image of a freshly tuned bike in the shop window.",
+        "Make the social media headline shorter.",
+        "Edit the image: replace the background with a bright blue studio wall.",
+        "Write a billboard version.",
+        "Write a direct mail version.",
+        "Summarize all the copy we wrote today.",
+    ],
+}
+
+AD_COPY_RESPONSE = """Here's the ad copy based on the following:
+* **Product/Service:** Spring tune-up service
+* **Target Audience:** First-time customers
+* **Promotion (if applicable):** 20% off through April
+* **Format (if specified/determined):** Banner Ads
+
+AD COPY - BANNER ADS
+
+HEADLINE: Spring Into Smooth Performance
+BENEFIT STATEMENT: Get reliable results all season with an expert tune-up.
+SUPPORTING EVIDENCE: Certified technicians, fast turnaround, and a satisfaction guarantee.
+VALUE ALIGNMENT: Confidence for every trip, whatever the season brings.
+CALL TO ACTION: Book Today, Save 20%
+"""
+
+# What the stub model draws when asked for SVG.
+STUB_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24">'
+    '<circle cx="12" cy="12" r="11" fill="#0b5fff"/>'
+    '<path d="M7 17l6-6m1-4a3 3 0 1 0 3 3" stroke="#ffffff" stroke-width="2" fill="none"/>'
+    "</svg>"
+)
+
+# Characters per partial response when the stub streams, about what Gemini sends.
+STREAM_CHUNK_CHARS = 64
+
+_ARTIFACT_NAME_PATTERN = re.compile(r"(?:generated_image|edited_image|free_edit)_\w+\.png")
+_SVG_REQUEST_PATTERN = re.compile(r"\b(?:icon|badge|widget)s?\b", re.IGNORECASE)
+_PLACEHOLDER_PATTERN = re.compile(r"{([A-Z][A-Z0-9_]*)}")
+_EDIT_REQUEST_PATTERN = re.compile(
+    r"Edit image '(?P<filename>[^']+)' with the following prompt: (?P<prompt>.*)\.$",
+    re.DOTALL,
+)
+
+
+def _text_of(content: types.Content) -> str:
+    return "".join(part.text or "" for part in content.parts or [])
+
+
+def _payload_chars(content: types.Content) -> int:
+    """Characters of text and function calls and responses sent to the model."""
+    chars = 0
+    for part in content.parts or []:
+        if part.text:
+            chars += len(part.text)
+        elif part.function_call:
+            chars += len(json.dumps(part.function_call.args, default=str))
+        elif part.function_response:
+            chars += len(json.dumps(part.function_response.response, default=str))
+    return chars
+
+
+def _function_call(name: str, args: Dict[str, Any]) -> LlmResponse:
+    return _function_calls(name, [args])
+
+
+def _function_calls(name: str, calls: List[Dict[str, Any]]) -> LlmResponse:
+    """One model response calling the same tool once per entry of `calls`."""
+    return LlmResponse(
+        content=types.Content(
+            role="model",
+            parts=[
+                types.Part(function_call=types.FunctionCall(name=name, args=args))
+                for args in calls
+            ],
+        )
+    )
+
+
+def _text_response(text: str) -> LlmResponse:
+    return LlmResponse(
+        content=types.Content(role="model", parts=[types.Part.from_text(text=text)])
+    )
+
+
+class StubLlm(BaseLlm):
+    """A scripted stand-in for Gemini that routes turns to the agent's tools.
+
+    The stub inspects the tools offered in the request and the latest user
+    message to pick a tool call, and answers any function response with a text
+    summary, so every agent in the tree follows its real control flow without
+    reaching the model API.
+
+    `latency` is the time to the first output token and `token_latency` the
+    time per output token after it. When streaming, text arrives in partial
+    chunks followed by the full text, the way ADK's Gemini model yields it.
+    """
+
+    latency: float = 0.5
+    token_latency: float = 0.0
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        await asyncio.sleep(self.latency)
+        response = self._respond(llm_request)
+        text = _text_of(response.content)
+        # Roughly four characters per token, so the ledger sees realistic volumes.
+        ledger.record(
+            self.model,
+            input_tokens=len(str(llm_request.config.system_instruction or "")) // 4
+            + sum(_payload_chars(content) for content in llm_request.contents) // 4,
+            output_tokens=len(text) // 4,
+        )
+        if not (stream and text):
+            await asyncio.sleep(len(text) // 4 * self.token_latency)
+            yield response
+            return
+
+        for start in range(0, len(text), STREAM_CHUNK_CHARS):
+            chunk = text[start : start + STREAM_CHUNK_CHARS]
+            await asyncio.sleep(len(chunk) // 4 * self.token_latency)
+            partial = _text_response(chunk)
+            partial.partial = True
+            yield partial
+        yield response
+
+    def _respond(self, llm_request: LlmRequest) -> LlmResponse:
+        latest = llm_request.contents[-1] if llm_request.contents else None
+        if latest is None:
+            return _text_response("How can I help with your marketing today?")
+
+        function_responses = [
+            part.function_response
+            for part in latest.parts or []
+            if part.function_response
+        ]
+        if function_responses:
+            if function_responses[-1].name == "start_ad_copy":
+                return _text_response(AD_COPY_RESPONSE)
+            return _text_response(json.dumps(function_responses[-1].response, default=str))
+
+        text = _text_of(latest).strip()
+        tools = llm_request.tools_dict
+
+        if "generate_svg" in tools and _SVG_REQUEST_PATTERN.search(text):
+            return _function_call("generate_svg", {"prompt": text})
+
+        if "generate_image" in tools:
+            if text.endswith("in the background."):
+                return _function_call("generate_image", {"prompt": text, "run_in_background": True})
+            return _function_call("generate_image", {"prompt": text})
+
+        if "edit_image" in tools:
+            match = _EDIT_REQUEST_PATTERN.match(text)
+            if match:
+                return _function_call(
+                    "edit_image",
+                    {"image_filename": match["filename"], "prompt": match["prompt"]},
+                )
+            return _text_response("Which image would you like me to edit?")
+
+        lowered = text.lower()
+        # The confirmed brief of the ad_copy scenario, with AD_COPY_CACHE on.
+        if lowered.startswith("yes") and "start_ad_copy" in tools:
+            return _function_call(
+                "start_ad_copy",
+                {
+                    "product": "Spring tune-up service",
+                    "audience": "First-time customers",
+                    "promotion": "20% off through April",
+                    "ad_format": "banner",
+                },
+            )
+
+        if lowered.startswith("generate") and "call_image_generation_agent" in tools:
+            # "Generate each of these images: a; b; c" asks for one call per image.
+            if lowered.startswith("generate each") and ":" in text:
+                requests = [
+                    request.strip(" .") for request in text.split(":", 1)[1].split(";")
+                ]
+                return _function_calls(
+                    "call_image_generation_agent",
+                    [{"prompt": f"Generate {request}."} for request in requests],
+                )
+            return _function_call("call_image_generation_agent", {"prompt": text})
+
+        if lowered.startswith("edit") and "call_image_editing_agent" in tools:
+            filename = self._latest_artifact(llm_request)
+            if filename:
+                return _function_call(
+                    "call_image_editing_agent",
+                    {"image_filename": filename, "prompt": text.split(":", 1)[-1].strip()},
+                )
+
+        return _text_response(AD_COPY_RESPONSE)
+
+    @staticmethod
+    def _latest_artifact(llm_request: LlmRequest) -> Optional[str]:
+        for content in reversed(llm_request.contents):
+            for part in content.parts or []:
+                if part.function_response:
+                    found = _ARTIFACT_NAME_PATTERN.findall(
+                        json.dumps(part.function_response.response, default=str)
+                    )
+                    if found:
+                        return found[-1]
+        return None
+
+
+def _tag_image(png: bytes, prompt: str) -> bytes:
+    """Write the prompt into a PNG text chunk, so each request gets distinct bytes."""
+    data = b"prompt\x00" + prompt.encode("latin-1", "replace")
+    chunk = b"tEXt" + data
+    tagged = len(data).to_bytes(4, "big") + chunk + zlib.crc32(chunk).to_bytes(4, "big")
+    # The IEND chunk is always the last 12 bytes.
+    return png[:-12] + tagged + png[-12:]
+
+
+def _render_stub_image(size: int) -> bytes:
+    """Render a noisy PNG so payload sizes resemble real Imagen output."""
+    from PIL import Image
+
+    image = Image.frombytes("RGB", (size, size), random.randbytes(size * size * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class _StubModels:
+    """Blocking stand-ins for the ``genai_client.models`` calls the tools make."""
+
+    def __init__(self, latency: float, image_latency: float, image_bytes: bytes):
+        self.latency = latency
+        self.image_latency = image_latency
+        self.image_bytes = image_bytes
+
+    def generate_content(self, model: str, contents: Any, **kwargs) -> types.GenerateContentResponse:
+        time.sleep(self.latency)
+        return types.GenerateContentResponse(
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=sum(len(str(part)) for part in contents) // 4,
+                candidates_token_count=60,
+            ),
+            candidates=[
+                types.Candidate(
+                    content=types.Content(
+                        role="model",
+                        parts=[types.Part.from_text(text=f"Enhanced: {contents[-1]}")],
+                    )
+                )
+            ]
+        )
+
+    def _images(self, count: int) -> List[types.GeneratedImage]:
+        time.sleep(self.image_latency)
+        return self.build_images(count)
+
+    def build_images(self, count: int) -> List[types.GeneratedImage]:
+        return [
+            types.GeneratedImage(image=types.Image(image_bytes=bytes(bytearray(self.image_bytes))))
+            for _ in range(count)
+        ]
+
+    def generate_images(self, model: str, prompt: str, config: Any = None) -> types.GenerateImagesResponse:
+        count = getattr(config, "number_of_images", None) or 1
+        return types.GenerateImagesResponse(generated_images=self._images(count))
+
+    def edit_image(self, model: str, prompt: str, reference_images: Any, config: Any = None) -> types.EditImageResponse:
+        count = getattr(config, "number_of_images", None) or 1
+        return types.EditImageResponse(generated_images=self._images(count))
+
+
+class _StubAsyncModels:
+    """Non-blocking stand-in for ``genai_client.aio.models``.
+
+    Like the SDK's httpx client, it is bound to the first event loop that
+    uses it and fails on any other.
+    """
+
+    def __init__(self, models: _StubModels):
+        self.latency = models.latency
+        self.image_latency = models.image_latency
+        self.models = models
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _check_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+        elif loop is not self._loop:
+            raise RuntimeError("The async client is bound to a different event loop")
+
+    async def generate_content(self, model: str, contents: Any, **kwargs) -> types.GenerateContentResponse:
+        self._check_loop()
+        await asyncio.sleep(self.latency)
+        drawing = 'xmlns="http://www.w3.org/2000/svg"' in str(contents[0])
+        return types.GenerateContentResponse(
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=sum(len(str(part)) for part in contents) // 4,
+                candidates_token_count=100,
+            ),
+            candidates=[
+                types.Candidate(
+                    content=types.Content(
+                        role="model",
+                        parts=[
+                            types.Part.from_text(
+                                text=STUB_SVG if drawing else f"Summary: {str(contents[-1])[:400]}"
+                            )
+                        ],
+                    )
+                )
+            ]
+        )
+
+    def _receive(self, count: int, prompt: str) -> List[types.GeneratedImage]:
+        """Decode a response body the way the genai SDK does, with the same copies."""
+        encoded = base64.b64encode(_tag_image(self.models.image_bytes, prompt)).decode("ascii")
+        body = json.dumps({"predictions": [{"bytesBase64Encoded": encoded}] * count})
+        predictions = json.loads(body)["predictions"]
+        return [
+            types.GeneratedImage(
+                image=types.Image(image_bytes=base64.b64decode(prediction["bytesBase64Encoded"]))
+            )
+            for prediction in predictions
+        ]
+
+    async def generate_images(self, model: str, prompt: str, config: Any = None) -> types.GenerateImagesResponse:
+        self._check_loop()
+        await asyncio.sleep(self.image_latency)
+        count = getattr(config, "number_of_images", None) or 1
+        return types.GenerateImagesResponse(generated_images=self._receive(count, prompt))
+
+    async def edit_image(self, model: str, prompt: str, reference_images: Any, config: Any = None) -> types.EditImageResponse:
+        self._check_loop()
+        # The SDK holds the base64 images, the JSON body and its bytes until the response arrives.
+        instances = {
+            "prompt": prompt,
+            "referenceImages": [
+                base64.b64encode(reference.reference_image.image_bytes).decode("ascii")
+                for reference in reference_images
+                if reference.reference_image is not None
+            ],
+        }
+        body = json.dumps(instances)
+        content = body.encode()
+        await asyncio.sleep(self.image_latency)
+        del instances, body, content
+        count = getattr(config, "number_of_images", None) or 1
+        return types.EditImageResponse(generated_images=self._receive(count, prompt))
+
+
+class _StubAsyncClient:
+    def __init__(self, models: _StubAsyncModels):
+        self.models = models
+
+
+class _StubClient:
+    def __init__(self, models: _StubModels):
+        self.models = models
+        self.aio = _StubAsyncClient(_StubAsyncModels(models))
+
+
+# Start and end of each tool call of the root agent, by function call id.
+_tool_call_times: Dict[str, Tuple[float, Optional[float]]] = {}
+
+# A parallel batch must take less than this multiple of its slowest call;
+# calls run one after another take about as many multiples as there are calls.
+PARALLEL_WALL_RATIO = 1.5
+
+
+def _start_tool_timer(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext) -> None:
+    _tool_call_times[tool_context.function_call_id] = (time.perf_counter(), None)
+
+
+def _stop_tool_timer(
+    tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Any
+) -> None:
+    started, _ = _tool_call_times.get(tool_context.function_call_id, (None, None))
+    if started is not None:
+        _tool_call_times[tool_context.function_call_id] = (started, time.perf_counter())
+
+
+def install_stub_backend(
+    llm_latency: float, image_latency: float, image_size: int, token_latency: float = 0.0
+) -> None:
+    """Route every agent and genai call in the package to the stub backend.
+
+    Args:
+        llm_latency: Simulated seconds to the first token of an LLM call.
+        image_latency: Simulated seconds per Imagen call.
+        image_size: Edge length in pixels of the stub images.
+        token_latency: Simulated seconds per output token of an LLM call.
+    """
+    for agent in (root_agent, image_generation_agent, image_editing_agent):
+        agent.model = StubLlm(
+            model=agent.canonical_model.model, latency=llm_latency, token_latency=token_latency
+        )
+    root_agent.before_tool_callback = _start_tool_timer
+    root_agent.after_tool_callback = _stop_tool_timer
+
+    models = _StubModels(llm_latency, image_latency, _render_stub_image(image_size))
+    client = LoopLocalClient(lambda: _StubClient(models))
+    generation_tools.genai_client = client
+    editing_tools.genai_client = client
+    history.genai_client = client
+
+
+@dataclass
+class TurnResult:
+    """Timing for a single scripted turn."""
+
+    session_index: int
+    scenario: str
+    turn: int
+    latency: float
+    events: int
+    input_tokens: int = 0
+    first_token: Optional[float] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class LoadReport:
+    """Aggregated results of a load run."""
+
+    sessions: int
+    wall_time: float
+    turns: List[TurnResult] = field(default_factory=list)
+    loop_lag: List[float] = field(default_factory=list)
+    heap_growth_bytes: Optional[int] = None
+    rss_growth_bytes: Optional[int] = None
+    peak_rss_growth_bytes: Optional[int] = None
+    usage: Dict[str, Any] = field(default_factory=dict)
+
+    def summary(self) -> Dict[str, Any]:
+        """Summarize the run as plain numbers.
+
+        Returns:
+            A dictionary with latency and time-to-first-token percentiles and
+            mean input tokens of each turn per scenario, event-loop lag and
+            memory growth per session.
+        """
+        by_scenario: Dict[str, List[float]] = {}
+        first_token_by_scenario: Dict[str, List[float]] = {}
+        tokens_by_turn: Dict[str, Dict[int, List[int]]] = {}
+        for turn in self.turns:
+            if turn.error is None:
+                by_scenario.setdefault(turn.scenario, []).append(turn.latency)
+                if turn.first_token is not None:
+                    first_token_by_scenario.setdefault(turn.scenario, []).append(turn.first_token)
+                tokens_by_turn.setdefault(turn.scenario, {}).setdefault(turn.turn, []).append(
+                    turn.input_tokens
+                )
+
+        return {
+            "sessions": self.sessions,
+            "wall_time_s": round(self.wall_time, 3),
+            "turns": len(self.turns),
+            "errors": sum(1 for turn in self.turns if turn.error is not None),
+            "error_samples": sorted({turn.error for turn in self.turns if turn.error})[:5],
+            "turn_latency_s": {
+                scenario: _percentiles(latencies)
+                for scenario, latencies in sorted(by_scenario.items())
+            },
+            "time_to_first_token_s": {
+                scenario: _percentiles(latencies)
+                for scenario, latencies in sorted(first_token_by_scenario.items())
+            },
+            "input_tokens_by_turn": {
+                scenario: [
+                    sum(tokens) // len(tokens) for _, tokens in sorted(turns.items())
+                ]
+                for scenario, turns in sorted(tokens_by_turn.items())
+            },
+            "loop_lag_s": _percentiles(self.loop_lag),
+            "heap_growth_per_session_bytes": (
+                self.heap_growth_bytes // self.sessions
+                if self.heap_growth_bytes is not None
+                else None
+            ),
+            "rss_growth_per_session_bytes": (
+                self.rss_growth_bytes // self.sessions
+                if self.rss_growth_bytes is not None
+                else None
+            ),
+            "peak_rss_growth_per_session_bytes": (
+                self.peak_rss_growth_bytes // self.sessions
+                if self.peak_rss_growth_bytes is not None
+                else None
+            ),
+            "usage": self.usage,
+        }
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+    return {
+        "p50": round(statistics.median(ordered), 4),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 4),
+    }
+
+
+def _placeholder_state() -> Dict[str, str]:
+    """Fill the unconfigured ``{CLIENT_NAME}``-style brand placeholders.
+
+    ADK resolves ``{name}`` in instructions from session state, so a template
+    checkout fails every turn unless the placeholders are present in state.
+    """
+    # Instruction providers render the unscoped brand without a context.
+    instructions = " ".join(
+        text if isinstance(text, str) else text(None)
+        for agent in (root_agent, image_generation_agent, image_editing_agent)
+        for text in (agent.instruction, agent.global_instruction)
+    )
+    return {
+        name: name.replace("_", " ").title()
+        for name in _PLACEHOLDER_PATTERN.findall(instructions)
+    }
+
+
+def _current_rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _sample_peak_rss(peak: List[int], interval: float, stop: threading.Event) -> None:
+    """Keep the highest RSS seen in `peak[0]`, sampled off the event loop."""
+    while not stop.wait(interval):
+        rss = _current_rss()
+        if rss is not None and rss > peak[0]:
+            peak[0] = rss
+
+
+async def _monitor_loop_lag(samples: List[float], interval: float, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+
+def _check_parallel_calls(events: List[Event]) -> Optional[str]:
+    """Why the parallel function calls of a turn were not independent, if they were not.
+
+    Every call of a response with several must get a result for its own
+    prompt, its own output state key and artifacts no other call wrote, and
+    the calls must overlap: the response takes less than PARALLEL_WALL_RATIO
+    times its slowest call.
+    """
+    calls = {}
+    batches = []
+    for event in events:
+        function_calls = event.get_function_calls()
+        times = [_tool_call_times.pop(call.id, None) for call in function_calls]
+        if len(function_calls) > 1:
+            calls.update((call.id, call) for call in function_calls)
+            batches.append([span for span in times if span and span[1] is not None])
+
+    filenames: Dict[str, str] = {}
+    for event in events:
+        for response in event.get_function_responses():
+            call = calls.pop(response.id, None)
+            if call is None:
+                continue
+            result = json.dumps(response.response, default=str)
+            prompt = (call.args or {}).get("prompt", "")
+            if prompt.rstrip(".") not in result:
+                return f"{call.name} {call.id} answered another call's prompt"
+            key = output_state_key("image_generation_output", call.id)
+            if call.name == "call_image_generation_agent" and key not in event.actions.state_delta:
+                return f"{call.name} {call.id} stored no output under {key}"
+            for filename in set(_ARTIFACT_NAME_PATTERN.findall(result)):
+                if filenames.setdefault(filename, call.id) != call.id:
+                    return f"Parallel calls {filenames[filename]} and {call.id} both wrote {filename}"
+    if calls:
+        return f"No response to parallel calls {sorted(calls)}"
+    for spans in batches:
+        if len(spans) < 2:
+            continue
+        wall = max(end for _, end in spans) - min(start for start, _ in spans)
+        slowest = max(end - start for start, end in spans)
+        if wall > PARALLEL_WALL_RATIO * slowest:
+            return (
+                f"{len(spans)} parallel calls took {wall:.3f}s, over "
+                f"{PARALLEL_WALL_RATIO}x their slowest ({slowest:.3f}s); they did not overlap"
+            )
+    return None
+
+
+async def _check_background_jobs(user_id: str, session_id: str, timeout: float = 60.0) -> Optional[str]:
+    """Wait for the session's background jobs and report the first that did not succeed."""
+    waited_until = time.monotonic() + timeout
+    while True:
+        jobs = await asyncio.to_thread(job_queue.store.for_session, APP_NAME, user_id, session_id)
+        if all(job.done for job in jobs) or time.monotonic() > waited_until:
+            break
+        await asyncio.sleep(0.05)
+    for job in reversed(jobs):
+        if not job.done:
+            return f"Background job {job.job_id} did not finish within {timeout:.0f}s"
+        if job.status == JobStatus.FAILED:
+            return f"Background job {job.job_id} failed: {job.error}"
+    return None
+
+
+async def _run_session(
+    runner: Runner,
+    index: int,
+    scenario: str,
+    think_time: float,
+    turn_slots: asyncio.Semaphore,
+    results: List[TurnResult],
+    run_config: RunConfig,
+) -> None:
+    user_id = f"user_{index}"
+    session = runner.session_service.create_session(
+        app_name=APP_NAME, user_id=user_id, state=_placeholder_state()
+    )
+
+    for turn, message in enumerate(SCENARIOS[scenario]):
+        content = types.Content(role="user", parts=[types.Part.from_text(text=message)])
+        events: List[Event] = []
+        first_token = None
+        error = None
+        async with turn_slots:
+            tokens_before = ledger.session_summary(session.id)["input_tokens"]
+            started = time.perf_counter()
+            try:
+                async for event in runner.run_async(
+                    user_id=user_id,
+                    session_id=session.id,
+                    new_message=content,
+                    run_config=run_config,
+                ):
+                    events.append(event)
+                    # The first text the user sees from the root agent.
+                    if (
+                        first_token is None
+                        and event.author == root_agent.name
+                        and event.content
+                        and _text_of(event.content)
+                    ):
+                        first_token = time.perf_counter() - started
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            latency = time.perf_counter() - started
+            error = error or _check_parallel_calls(events)
+            input_tokens = ledger.session_summary(session.id)["input_tokens"] - tokens_before
+
+        result = TurnResult(index, scenario, turn, latency, len(events), input_tokens, first_token, error)
+        results.append(result)
+        if think_time:
+            await asyncio.sleep(think_time)
+
+    # Jobs outlive their turns; a job that failed counts against the last one.
+    result.error = result.error or await _check_background_jobs(user_id, session.id)
+
+
+async def run_load(
+    sessions: int,
+    scenarios: List[str],
+    turn_concurrency: int,
+    think_time: float = 0.0,
+    lag_interval: float = 0.05,
+    trace_memory: bool = False,
+    artifact_store: str = "memory",
+    session_store: str = "memory",
+    streaming: bool = False,
+) -> LoadReport:
+    """Run ``sessions`` scripted conversations concurrently against ``root_agent``.
+
+    Args:
+        sessions: Number of simultaneous sessions.
+        scenarios: Scenario names from ``SCENARIOS``, assigned round-robin.
+        turn_concurrency: Maximum number of turns in flight at once.
+        think_time: Seconds each session waits between its turns.
+        lag_interval: Sampling interval of the event-loop lag monitor.
+        trace_memory: Whether to measure Python heap growth with tracemalloc.
+        artifact_store: "memory" for ADK's in-memory service or "local" for
+            the on-disk LocalArtifactService.
+        session_store: "memory" for ADK's in-memory service or "sqlite" for
+            the write-behind SqliteSessionService.
+        streaming: Whether to run turns in SSE streaming mode, as `/run_sse`
+            does for clients that ask for streaming.
+
+    Returns:
+        A LoadReport with per-turn timings, loop lag and memory growth.
+    """
+    runner = Runner(
+        app_name=APP_NAME,
+        agent=root_agent,
+        artifact_service=(
+            LocalArtifactService(root_dir=".artifacts")
+            if artifact_store == "local"
+            else InMemoryArtifactService()
+        ),
+        session_service=(
+            SqliteSessionService(db_path=".cache/sessions.db")
+            if session_store == "sqlite"
+            else InMemorySessionService()
+        ),
+    )
+
+    if trace_memory:
+        tracemalloc.start()
+    heap_before = tracemalloc.get_traced_memory()[0] if trace_memory else None
+    rss_before = _current_rss()
+    peak_rss = [rss_before or 0]
+    stop_sampling = threading.Event()
+    sampler = threading.Thread(
+        target=_sample_peak_rss, args=(peak_rss, 0.005, stop_sampling), daemon=True
+    )
+    sampler.start()
+
+    results: List[TurnResult] = []
+    lag_samples: List[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_monitor_loop_lag(lag_samples, lag_interval, stop))
+    turn_slots = asyncio.Semaphore(turn_concurrency)
+    run_config = RunConfig(streaming_mode=StreamingMode.SSE if streaming else StreamingMode.NONE)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(
+            _run_session(
+                runner,
+                index,
+                scenarios[index % len(scenarios)],
+                think_time,
+                turn_slots,
+                results,
+                run_config,
+            )
+            for index in range(sessions)
+        )
+    )
+    wall_time = time.perf_counter() - started
+
+    stop.set()
+    await monitor
+    stop_sampling.set()
+    sampler.join()
+    if isinstance(runner.session_service, SqliteSessionService):
+        # Write what is still queued while the working directory exists.
+        runner.session_service.close()
+
+    # Measured while the session and artifact services still hold every session.
+    heap_growth = None
+    if trace_memory:
+        heap_growth = tracemalloc.get_traced_memory()[0] - heap_before
+        tracemalloc.stop()
+    rss_after = _current_rss()
+    rss_growth = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+    peak_rss_growth = peak_rss[0] - rss_before if rss_before is not None else None
+
+    return LoadReport(
+        sessions=sessions,
+        wall_time=wall_time,
+        turns=results,
+        loop_lag=lag_samples,
+        heap_growth_bytes=heap_growth,
+        rss_growth_bytes=rss_growth,
+        peak_rss_growth_bytes=peak_rss_growth,
+        usage=ledger.summary()["totals"],
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command-line entry point for the load harness."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent sessions.")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="Scenario(s) to replay; defaults to all, assigned round-robin.",
+    )
+    parser.add_argument(
+        "--turn-concurrency",
+        type=int,
+        default=None,
+        help="Maximum turns in flight at once (defaults to --sessions).",
+    )
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds between turns.")
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.5, help="Stub LLM seconds to the first token."
+    )
+    parser.add_argument(
+        "--token-latency", type=float, default=0.01, help="Stub LLM seconds per output token."
+    )
+    parser.add_argument("--image-latency", type=float, default=2.0, help="Stub Imagen seconds per call.")
+    parser.add_argument("--image-size", type=int, default=512, help="Stub image edge in pixels.")
+    parser.add_argument(
+        "--backend",
+        choices=["stub", "live"],
+        default="stub",
+        help="'live' sends real (billed) requests to Gemini and Imagen.",
+    )
+    parser.add_argument(
+        "--artifact-store",
+        choices=["memory", "local"],
+        default="memory",
+        help="Artifact service to run against.",
+    )
+    parser.add_argument(
+        "--session-store",
+        choices=["memory", "sqlite"],
+        default="memory",
+        help="Session service to run against.",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Stream model output in SSE mode, as /run_sse does for streaming clients.",
+    )
+    parser.add_argument("--tracemalloc", action="store_true", help="Measure heap growth per session.")
+    parser.add_argument("--json", dest="json_path", help="Write the summary to this file.")
+    args = parser.parse_args(argv)
+
+    if args.backend == "stub":
+        install_stub_backend(
+            args.llm_latency, args.image_latency, args.image_size, args.token_latency
+        )
+
+    # Tools write images to a relative .cache directory; keep those out of the repo.
+    with tempfile.TemporaryDirectory(prefix="marketing-loadtest-") as workdir:
+        previous_cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            report = asyncio.run(
+                run_load(
+                    sessions=args.sessions,
+                    scenarios=args.scenario or sorted(SCENARIOS),
+                    turn_concurrency=args.turn_concurrency or args.sessions,
+                    think_time=args.think_time,
+                    trace_memory=args.tracemalloc,
+                    artifact_store=args.artifact_store,
+                    session_store=args.session_store,
+                    streaming=args.streaming,
+                )
+            )
+        finally:
+            os.chdir(previous_cwd)
+
+    summary = report.summary()
+    print(json.dumps(summary, indent=2))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
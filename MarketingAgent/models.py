@@ -0,0 +1,74 @@
+from functools import cached_property
+from typing import Any, AsyncIterator
+
+from google.adk.models import Gemini
+from google.genai import Client
+from google.genai import types
+
+from MarketingAgent.ledger import ledger
+
+
+class _MeteredAsyncModels:
+    """Wraps `client.aio.models` to record the usage metadata of every response."""
+
+    def __init__(self, models: Any):
+        self._models = models
+
+    async def generate_content(self, *, model: str, **kwargs) -> types.GenerateContentResponse:
+        response = await self._models.generate_content(model=model, **kwargs)
+        ledger.record_response(model, response)
+        return response
+
+    async def generate_content_stream(self, *, model: str, **kwargs) -> AsyncIterator[types.GenerateContentResponse]:
+        stream = await self._models.generate_content_stream(model=model, **kwargs)
+        return self._metered_stream(model, stream)
+
+    async def _metered_stream(
+        self, model: str, stream: AsyncIterator[types.GenerateContentResponse]
+    ) -> AsyncIterator[types.GenerateContentResponse]:
+        # Usage metadata is cumulative, so only the last chunk that carries it
+        # counts. A stream closed early, e.g. by a cancelled turn, is still charged.
+        last_with_usage = None
+        try:
+            async for chunk in stream:
+                if chunk.usage_metadata:
+                    last_with_usage = chunk
+                yield chunk
+        finally:
+            ledger.record_response(model, last_with_usage)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._models, name)
+
+
+class _MeteredAsyncClient:
+    def __init__(self, aio: Any):
+        self._aio = aio
+        self.models = _MeteredAsyncModels(aio.models)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._aio, name)
+
+
+class _MeteredClient:
+    def __init__(self, client: Client):
+        self._client = client
+        self.aio = _MeteredAsyncClient(client.aio)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+class MeteredGemini(Gemini):
+    """Gemini model that records token usage of every agent turn in the ledger.
+
+    ADK drops `usage_metadata` when it converts responses to `LlmResponse`, so
+    usage is captured on the client side instead.
+    """
+
+    @cached_property
+    def api_client(self) -> Client:
+        """Provides the metered api client."""
+        return _MeteredClient(
+            Client(http_options=types.HttpOptions(headers=self._tracking_headers))
+        )
@@ -0,0 +1,180 @@
+import asyncio
+import inspect
+from typing import Iterable, Optional
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.adk.flows.llm_flows import functions
+from google.adk.tools import BaseTool
+
+from MarketingAgent.config import config
+
+# What this module replaces in, or reuses from, ADK's function call handling,
+# including module-private helpers that only the pinned google-adk defines.
+_ADK_FUNCTIONS = (
+    "handle_function_calls_async",
+    "merge_parallel_function_response_events",
+    "__call_tool_async",
+    "__build_response_event",
+    "_get_tool_and_context",
+    "tracer",
+    "trace_tool_response",
+)
+_missing = [name for name in _ADK_FUNCTIONS if not hasattr(functions, name)]
+if _missing:
+    raise RuntimeError(
+        f"google.adk.flows.llm_flows.functions no longer defines {', '.join(_missing)}; "
+        "update MarketingAgent.parallel for this google-adk version"
+    )
+
+_sequential_handler = functions.handle_function_calls_async
+_merge_events = functions.merge_parallel_function_response_events
+_call_tool = getattr(functions, "__call_tool_async")
+_build_response_event = getattr(functions, "__build_response_event")
+_get_tool_and_context = functions._get_tool_and_context
+
+
+def output_state_key(name: str, call_id: Optional[str]) -> str:
+    """The session state key a tool call stores its output under.
+
+    Parallel calls each write their own key, so one call's output never
+    replaces another's when their state changes are merged.
+
+    Args:
+        name: The kind of output, e.g. "image_generation_output".
+        call_id: The id of the function call or background job.
+    """
+    return f"{name}:{call_id}" if call_id else name
+
+
+def is_output_state_key(key: str, names: Iterable[str]) -> bool:
+    """Whether `key` holds a tool output of one of the `names` kinds."""
+    return any(key == name or key.startswith(f"{name}:") for name in names)
+
+
+def merge_function_response_events(function_response_events: list[Event]) -> Event:
+    """ADK's merge of the responses to one model response's calls, keeping every change.
+
+    ADK keeps the actions of the last call only, which drops the state
+    written and the artifacts saved by all the others.
+    """
+    merged_event = _merge_events(function_response_events)
+    if len(function_response_events) > 1:
+        state_delta: dict = {}
+        artifact_delta: dict = {}
+        for event in function_response_events:
+            state_delta.update(event.actions.state_delta)
+            artifact_delta.update(event.actions.artifact_delta)
+        merged_event.actions.state_delta = state_delta
+        merged_event.actions.artifact_delta = artifact_delta
+    return merged_event
+
+
+async def _call_function(
+    invocation_context: InvocationContext,
+    function_call_event: Event,
+    function_call,
+    tools_dict: dict[str, BaseTool],
+) -> Optional[Event]:
+    """One iteration of ADK's sequential function call loop."""
+    agent = invocation_context.agent
+    tool, tool_context = _get_tool_and_context(
+        invocation_context, function_call_event, function_call, tools_dict
+    )
+    function_args = function_call.args or {}
+    function_response = None
+
+    if agent.before_tool_callback:
+        function_response = agent.before_tool_callback(
+            tool=tool, args=function_args, tool_context=tool_context
+        )
+        if inspect.isawaitable(function_response):
+            function_response = await function_response
+
+    if not function_response:
+        function_response = await _call_tool(tool, args=function_args, tool_context=tool_context)
+
+    if agent.after_tool_callback:
+        altered_function_response = agent.after_tool_callback(
+            tool=tool,
+            args=function_args,
+            tool_context=tool_context,
+            tool_response=function_response,
+        )
+        if inspect.isawaitable(altered_function_response):
+            altered_function_response = await altered_function_response
+        if altered_function_response is not None:
+            function_response = altered_function_response
+
+    if tool.is_long_running and not function_response:
+        return None
+    return _build_response_event(tool, function_response, tool_context, invocation_context)
+
+
+async def handle_function_calls_concurrently(
+    invocation_context: InvocationContext,
+    function_call_event: Event,
+    tools_dict: dict[str, BaseTool],
+    filters: Optional[set[str]] = None,
+) -> Optional[Event]:
+    """Run the function calls of one model response at the same time.
+
+    A drop-in for ADK's `handle_function_calls_async`, which awaits the calls
+    one after another, so a turn asking for three images takes three times
+    as long as one. Each call already has its own `ToolContext`, with its
+    own state and artifact changes; they are merged in call order as before.
+    If a call fails, the others are cancelled and the error is raised.
+    """
+    from google.adk.agents import LlmAgent
+
+    function_calls = [
+        function_call
+        for function_call in function_call_event.get_function_calls()
+        if not (filters and function_call.id not in filters)
+    ]
+    if (
+        not config.PARALLEL_TOOL_CALLS
+        or len(function_calls) < 2
+        or not isinstance(invocation_context.agent, LlmAgent)
+    ):
+        return await _sequential_handler(
+            invocation_context, function_call_event, tools_dict, filters
+        )
+
+    tasks = [
+        asyncio.create_task(
+            _call_function(invocation_context, function_call_event, function_call, tools_dict)
+        )
+        for function_call in function_calls
+    ]
+    try:
+        events = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    function_response_events = [event for event in events if event is not None]
+    if not function_response_events:
+        return None
+    merged_event = merge_function_response_events(function_response_events)
+    if len(function_response_events) > 1:
+        with functions.tracer.start_as_current_span("tool_response"):
+            functions.trace_tool_response(
+                invocation_context=invocation_context,
+                event_id=merged_event.id,
+                function_response_event=merged_event,
+            )
+    return merged_event
+
+
+def enable_parallel_function_calls() -> None:
+    """Make every agent run the function calls of a model response concurrently.
+
+    Takes effect when PARALLEL_TOOL_CALLS is set, which is checked on every
+    response, so it can be turned off by reloading the configuration. The
+    merge of their results keeps every call's changes either way.
+    """
+    functions.handle_function_calls_async = handle_function_calls_concurrently
+    functions.merge_parallel_function_response_events = merge_function_response_events
+
@@ -0,0 +1,186 @@
+import asyncio
+import base64
+import io
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from dataclasses import asdict, dataclass, field
+from enum import StrEnum
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from MarketingAgent.ledger import current_scope
+
+# Longest side of the preview sent with IMAGE_RECEIVED.
+PREVIEW_SIZE = 128
+# Events kept per session for clients that subscribe after they were emitted.
+REPLAY_LENGTH = 32
+# Seconds after its last event that an unwatched session's events are dropped.
+REPLAY_TTL_SECONDS = 600
+
+_SessionKey = Tuple[str, str, str]
+
+
+class ProgressStage(StrEnum):
+    """Milestones of a long-running image tool."""
+
+    AGENT_STARTED = "agent_started"
+    PROMPT_ENHANCED = "prompt_enhanced"
+    REQUEST_SENT = "request_sent"
+    IMAGE_RECEIVED = "image_received"
+    ARTIFACT_SAVED = "artifact_saved"
+    AGENT_FINISHED = "agent_finished"
+
+
+@dataclass(frozen=True)
+class ProgressEvent:
+    """One progress update of a tool call, scoped to the session that made it."""
+
+    app_name: str
+    user_id: str
+    session_id: str
+    tool: str
+    stage: ProgressStage
+    data: Dict[str, Any] = field(default_factory=dict)
+    timestamp: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict[str, Any]:
+        event = asdict(self)
+        event["stage"] = self.stage.value
+        return event
+
+
+class ProgressBus:
+    """Fans progress events out to the clients watching a session.
+
+    Events may be published from the server loop or from background job
+    threads; every subscriber receives them on its own loop. The recent
+    events of a session nobody watches are dropped `replay_ttl` seconds
+    after its last one.
+    """
+
+    def __init__(self, replay_length: int = REPLAY_LENGTH, replay_ttl: float = REPLAY_TTL_SECONDS):
+        self.replay_length = replay_length
+        self.replay_ttl = replay_ttl
+        self._lock = threading.Lock()
+        self._subscribers: Dict[_SessionKey, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = defaultdict(list)
+        # Ordered by each session's last event, oldest first.
+        self._recent: "OrderedDict[_SessionKey, Deque[ProgressEvent]]" = OrderedDict()
+
+    def _expired(self, key: _SessionKey, now: float) -> bool:
+        return now - self._recent[key][-1].timestamp > self.replay_ttl
+
+    def _prune(self, now: float) -> None:
+        for key in list(self._recent):
+            if not self._expired(key, now):
+                break
+            if key not in self._subscribers:
+                del self._recent[key]
+
+    def publish(self, event: ProgressEvent) -> None:
+        key = (event.app_name, event.user_id, event.session_id)
+        with self._lock:
+            recent = self._recent.pop(key, None) or deque(maxlen=self.replay_length)
+            recent.append(event)
+            self._recent[key] = recent
+            self._prune(time.time())
+            subscribers = list(self._subscribers.get(key, ()))
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                # The subscriber's loop has closed; it is removed when it unsubscribes.
+                pass
+
+    def recent(self, app_name: str, user_id: str, session_id: str) -> List[ProgressEvent]:
+        with self._lock:
+            return list(self._recent.get((app_name, user_id, session_id), ()))
+
+    async def subscribe(
+        self, app_name: str, user_id: str, session_id: str, replay: bool = True
+    ) -> AsyncIterator[ProgressEvent]:
+        """Yield the session's progress events as they are published.
+
+        Args:
+            app_name: The app of the session.
+            user_id: The user of the session.
+            session_id: The session to watch.
+            replay: Whether to start with the session's recent events.
+        """
+        key = (app_name, user_id, session_id)
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            backlog = list(self._recent.get(key, ())) if replay else []
+            self._subscribers[key].append(subscriber)
+
+        try:
+            for event in backlog:
+                yield event
+            while True:
+                yield await subscriber[1].get()
+        finally:
+            with self._lock:
+                self._subscribers[key].remove(subscriber)
+                if not self._subscribers[key]:
+                    del self._subscribers[key]
+                    if key in self._recent and self._expired(key, time.time()):
+                        del self._recent[key]
+
+
+progress_bus = ProgressBus()
+
+
+def emit_progress(tool: str, stage: ProgressStage, **data: Any) -> None:
+    """Publish a progress event for the session bound to `current_scope`.
+
+    Does nothing outside an agent turn or background job.
+    """
+    scope = current_scope.get()
+    if scope is None:
+        return
+    progress_bus.publish(
+        ProgressEvent(
+            app_name=scope.app_name,
+            user_id=scope.user_id,
+            session_id=scope.session_id,
+            tool=tool,
+            stage=stage,
+            data=data,
+        )
+    )
+
+
+def image_preview(image_bytes: bytes, size: int = PREVIEW_SIZE) -> Optional[str]:
+    """A small JPEG of the image as a data URL, for showing before the artifact is saved."""
+    try:
+        # Shrink before converting, so only the decoded original is full size.
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.draft("RGB", (size, size))
+            image.thumbnail((size, size))
+            preview = image.convert("RGB")
+        buffer = io.BytesIO()
+        preview.save(buffer, format="JPEG", quality=60)
+    except Exception as e:
+        print(f"Error creating image preview: {e}")
+        return None
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def add_progress_route(app: Any) -> None:
+    """Add a server-sent events endpoint streaming a session's progress events.
+
+    The route is `GET /apps/{app_name}/users/{user_id}/sessions/{session_id}/progress`
+    on the ADK FastAPI app.
+    """
+    from fastapi.responses import StreamingResponse
+
+    @app.get("/apps/{app_name}/users/{user_id}/sessions/{session_id}/progress")
+    async def stream_progress(app_name: str, user_id: str, session_id: str):
+        async def event_stream():
+            async for event in progress_bus.subscribe(app_name, user_id, session_id):
+                yield f"data: {json.dumps(event.to_dict())}\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
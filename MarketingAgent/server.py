@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import importlib
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from google.adk.cli import fast_api
+
+from MarketingAgent.artifacts import LocalArtifactService
+from MarketingAgent.assistants.generation.dedup import prompt_index
+from MarketingAgent.assistants.memory import image_memory
+from MarketingAgent.circuits import circuit_summary
+from MarketingAgent.config import config
+from MarketingAgent.jobs import job_queue
+from MarketingAgent.progress import add_progress_route
+from MarketingAgent.sessions import SqliteSessionService
+
+# `adk web` serves every agent package in this directory.
+AGENTS_DIR = str(Path(__file__).resolve().parent.parent)
+AGENT_MODULE = "MarketingAgent.agent"
+CACHE_DIR = Path(".cache")
+# Seconds the supervisor waits after a worker crashes before starting another.
+RESTART_DELAY_SECONDS = 1.0
+
+# Set once the process has been asked to shut down; /readyz then fails.
+shutting_down = threading.Event()
+
+
+def preload_agents() -> None:
+    """Import the agents, so workers forked afterwards share them."""
+    importlib.import_module(AGENT_MODULE)
+
+
+def _cache_writable() -> bool:
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return False
+    return os.access(CACHE_DIR, os.W_OK)
+
+
+def add_health_routes(app: FastAPI) -> None:
+    """Add liveness (`GET /healthz`) and readiness (`GET /readyz`) endpoints.
+
+    The worker is ready once the agents are loaded and the shared cache is
+    writable, and stops being ready as soon as it starts shutting down.
+    """
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok", "pid": os.getpid()}
+
+    @app.get("/readyz")
+    async def readyz():
+        checks = {
+            "agents_loaded": AGENT_MODULE in sys.modules,
+            "cache_writable": _cache_writable(),
+            "accepting_work": not (shutting_down.is_set() or job_queue.draining),
+        }
+        ready = all(checks.values())
+        return JSONResponse(
+            {
+                "status": "ready" if ready else "unavailable",
+                "pid": os.getpid(),
+                "checks": checks,
+                "circuits": circuit_summary(),
+                "image_memory": image_memory.to_dict(),
+            },
+            status_code=200 if ready else 503,
+        )
+
+
+class _AgentRunRequest(fast_api.AgentRunRequest):
+    """A `/run_sse` request that streams partial text unless told otherwise."""
+
+    streaming: bool = config.STREAM_RESPONSES
+
+
+def create_app(web: bool = True, persistent: bool = True) -> FastAPI:
+    """Create the ADK API server with the progress stream and health checks added.
+
+    Args:
+        web: Whether to also serve the ADK dev UI.
+        persistent: Whether to keep sessions and artifacts in the local SQLite
+            stores instead of ADK's in-memory ones. Several workers can only
+            serve the same users with the persistent stores.
+
+    Returns:
+        The FastAPI app.
+    """
+    session_service: Optional[SqliteSessionService] = None
+    artifact_service: Optional[LocalArtifactService] = None
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # Lookups made while the prompt index loads wait for it in their threads.
+        loading = asyncio.create_task(asyncio.to_thread(prompt_index.load))
+        retention = None
+        if artifact_service is not None:
+            # Resume unfinished jobs and start their heartbeat now rather than
+            # on the first submit. In-memory sessions do not outlive a restart,
+            # so their jobs have nothing to resume into.
+            await asyncio.to_thread(job_queue.bind, artifact_service)
+            retention = asyncio.create_task(
+                artifact_service.run_retention(config.ARTIFACT_RETENTION_INTERVAL_MINUTES * 60)
+            )
+        yield
+        if retention is not None:
+            retention.cancel()
+        # Requests have finished by now; wait for background jobs still
+        # calling Imagen, leaving jobs that have not started for another worker.
+        shutting_down.set()
+        await loading
+        unfinished = await asyncio.to_thread(job_queue.drain, config.SHUTDOWN_GRACE_SECONDS)
+        if unfinished:
+            print(f"Shutting down with {unfinished} background jobs still running")
+        if session_service is not None:
+            session_service.close()
+
+    # get_fast_api_app of google-adk 0.5 (pinned in pyproject.toml) takes
+    # no services and builds its routes and services from module globals, so
+    # it is handed ours in their place while it runs. Check these names when
+    # raising the pin.
+    overrides = {"AgentRunRequest": _AgentRunRequest}
+    if persistent:
+        # It only offers in-memory, Vertex AI and SQLAlchemy services.
+        session_service = SqliteSessionService()
+        artifact_service = LocalArtifactService()
+        overrides["InMemorySessionService"] = lambda: session_service
+        overrides["InMemoryArtifactService"] = lambda: artifact_service
+    missing = [name for name in overrides if not hasattr(fast_api, name)]
+    if missing:
+        raise RuntimeError(
+            f"google.adk.cli.fast_api no longer defines {', '.join(missing)}; "
+            "update create_app for this google-adk version"
+        )
+    originals = {name: getattr(fast_api, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(fast_api, name, value)
+    try:
+        app = fast_api.get_fast_api_app(agent_dir=AGENTS_DIR, web=web, lifespan=lifespan)
+    finally:
+        for name, value in originals.items():
+            setattr(fast_api, name, value)
+    add_progress_route(app)
+    add_health_routes(app)
+    return app
+
+
+class _Server(uvicorn.Server):
+    """Uvicorn server that fails readiness as soon as it is asked to stop."""
+
+    def handle_exit(self, sig: int, frame) -> None:
+        shutting_down.set()
+        super().handle_exit(sig, frame)
+
+
+def _server_config(app: FastAPI, host: str, port: int) -> uvicorn.Config:
+    # In-flight requests, and the Imagen calls they are waiting on, get the
+    # grace period to finish before connections are closed.
+    return uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        timeout_graceful_shutdown=config.SHUTDOWN_GRACE_SECONDS,
+    )
+
+
+def _run_worker(sock: socket.socket, host: str, port: int, web: bool) -> None:
+    """Run one worker process on the supervisor's listening socket."""
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+    # The session writer and job threads are started here, after the fork.
+    app = create_app(web=web)
+    _Server(_server_config(app, host, port)).run(sockets=[sock])
+
+
+def serve(host: str, port: int, workers: int, web: bool = True) -> None:
+    """Serve the agents from `workers` processes sharing one listening socket.
+
+    The agents are imported once before the workers are forked. The
+    supervisor restarts workers that crash and, on SIGTERM or SIGINT, asks
+    every worker to drain and waits for them to exit.
+
+    Args:
+        host: The interface to listen on.
+        port: The port to listen on.
+        workers: Number of worker processes.
+        web: Whether to also serve the ADK dev UI.
+    """
+    preload_agents()
+    sock = _server_config(FastAPI(), host, port).bind_socket()
+    children: Dict[int, int] = {}
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                _run_worker(sock, host, port, web)
+            except BaseException as e:
+                print(f"Worker {os.getpid()} failed: {e}")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        children[pid] = slot
+
+    def stop(sig: int, frame) -> None:
+        shutting_down.set()
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for slot in range(workers):
+        spawn(slot)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Serving on http://{host}:{port} with {workers} workers: {sorted(children)}")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        slot = children.pop(pid, None)
+        if slot is None or shutting_down.is_set():
+            continue
+        print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}; restarting")
+        time.sleep(RESTART_DELAY_SECONDS)
+        if not shutting_down.is_set():
+            spawn(slot)
+    sock.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve the marketing agent.")
+    parser.add_argument("--host", default=config.HOST_URL)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes (default: SERVER_WORKERS, or one; one with --in-memory).",
+    )
+    parser.add_argument("--no-web", action="store_true", help="Serve the API without the dev UI.")
+    parser.add_argument(
+        "--in-memory",
+        action="store_true",
+        help="Keep sessions and artifacts in memory instead of the local stores (one worker only).",
+    )
+    args = parser.parse_args(argv)
+    if args.in_memory:
+        # Workers would not share the in-memory sessions.
+        if args.workers is not None and args.workers > 1:
+            parser.error("--in-memory needs --workers 1, since workers would not share sessions")
+        workers = 1
+    else:
+        # One by default: the progress stream and image memory cap are per process.
+        workers = args.workers or config.SERVER_WORKERS or 1
+
+    if workers > 1:
+        serve(args.host, args.port, workers, web=not args.no_web)
+        return
+
+    preload_agents()
+    app = create_app(web=not args.no_web, persistent=not args.in_memory)
+    _Server(_server_config(app, args.host, args.port)).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,551 @@
+import atexit
+import copy
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import closing
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session, State
+from google.adk.sessions.base_session_service import GetSessionConfig
+from google.adk.sessions.base_session_service import ListEventsResponse
+from google.adk.sessions.base_session_service import ListSessionsResponse
+
+from MarketingAgent.config import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_update_time REAL NOT NULL,
+    PRIMARY KEY (app_name, user_id, session_id)
+);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    event TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_session ON events (app_name, user_id, session_id, seq);
+CREATE TABLE IF NOT EXISTS app_states (
+    app_name TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_states (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (app_name, user_id)
+);
+"""
+
+_SessionKey = Tuple[str, str, str]
+
+
+def _split_state(state: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    """Split a state delta into its app, user and session scoped parts."""
+    app_state, user_state, session_state = {}, {}, {}
+    for key, value in state.items():
+        if key.startswith(State.APP_PREFIX):
+            app_state[key.removeprefix(State.APP_PREFIX)] = value
+        elif key.startswith(State.USER_PREFIX):
+            user_state[key.removeprefix(State.USER_PREFIX)] = value
+        elif not key.startswith(State.TEMP_PREFIX):
+            session_state[key] = value
+    return app_state, user_state, session_state
+
+
+@dataclass
+class _PendingWrites:
+    """Writes not yet flushed to SQLite, with state deltas coalesced per scope."""
+
+    events: List[Tuple[_SessionKey, Event]] = field(default_factory=list)
+    session_states: Dict[_SessionKey, Dict[str, Any]] = field(default_factory=dict)
+    update_times: Dict[_SessionKey, float] = field(default_factory=dict)
+    app_states: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    user_states: Dict[Tuple[str, str], Dict[str, Any]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.events or self.session_states or self.app_states or self.user_states)
+
+    def merge(self, later: "_PendingWrites") -> None:
+        """Apply `later` on top of these writes, keeping the newest value of each key."""
+        self.events.extend(later.events)
+        for target, source in (
+            (self.session_states, later.session_states),
+            (self.app_states, later.app_states),
+            (self.user_states, later.user_states),
+        ):
+            for key, delta in source.items():
+                target.setdefault(key, {}).update(delta)
+        self.update_times.update(later.update_times)
+
+
+class SqliteSessionService(BaseSessionService):
+    """Session service that persists sessions and events to local SQLite.
+
+    Appending an event only updates memory: the event and its state delta are
+    queued and a background thread writes them in one transaction at most
+    `flush_interval` seconds later, with repeated updates of a state key
+    coalesced into one write. Sessions are loaded from disk on first use and
+    kept in a bounded LRU cache; a session another worker process has updated
+    since is reloaded. Pending writes are flushed on delete and at exit.
+
+    Args:
+        db_path: The SQLite database file.
+        flush_interval: Longest delay in seconds before a queued write is flushed.
+        cache_size: Number of sessions kept in memory.
+    """
+
+    def __init__(
+        self,
+        db_path: str = config.SESSION_DB_PATH,
+        flush_interval: float = config.SESSION_FLUSH_INTERVAL,
+        cache_size: int = config.SESSION_CACHE_SIZE,
+    ):
+        self.db_path = Path(db_path)
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Closing the last connection to a WAL database checkpoints it and
+        # deletes the log, which takes tens of milliseconds; this idle
+        # connection keeps the per-operation ones from ever being the last.
+        self._keepalive = self._connect()
+        self._keepalive.execute("PRAGMA journal_mode=WAL")
+        self._keepalive.executescript(_SCHEMA)
+
+        self._lock = threading.Lock()
+        # Held while a batch is taken from `_pending` and written, so batches
+        # reach the database in the order their events were appended.
+        self._write_lock = threading.Lock()
+        self._sessions: "OrderedDict[_SessionKey, Session]" = OrderedDict()
+        self._app_states: Dict[str, Dict[str, Any]] = {}
+        self._user_states: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._pending = _PendingWrites()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per operation keeps the service safe across threads and
+        # across worker processes sharing the same database.
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    # Write-behind
+
+    def _write_loop(self) -> None:
+        while not self._closed.is_set():
+            self._wake.wait()
+            # Let the writes of the current turn accumulate into one batch.
+            self._closed.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing sessions to {self.db_path}: {e}")
+
+    def flush(self) -> None:
+        """Write every queued event and state delta now."""
+        with self._write_lock:
+            with self._lock:
+                batch, self._pending = self._pending, _PendingWrites()
+            if not batch:
+                return
+            try:
+                self._write_batch(batch)
+            except BaseException:
+                # Put the batch back in front of anything queued meanwhile.
+                with self._lock:
+                    batch.merge(self._pending)
+                    self._pending = batch
+                self._wake.set()
+                raise
+
+    def _write_batch(self, batch: _PendingWrites) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = [
+                    row
+                    for key in batch.update_times
+                    for row in connection.execute(
+                        "SELECT app_name, user_id, session_id, state FROM sessions"
+                        " WHERE app_name = ? AND user_id = ? AND session_id = ?",
+                        key,
+                    )
+                ]
+                stored = {(app, user, session): state for app, user, session, state in rows}
+
+                connection.executemany(
+                    "INSERT INTO events (app_name, user_id, session_id, timestamp, event)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (*key, event.timestamp, event.model_dump_json(exclude_none=True))
+                        for key, event in batch.events
+                        # Events of sessions deleted meanwhile are dropped.
+                        if key in stored
+                    ],
+                )
+                for key, update_time in batch.update_times.items():
+                    if key not in stored:
+                        continue
+                    state = json.loads(stored[key])
+                    state.update(batch.session_states.get(key, {}))
+                    connection.execute(
+                        "UPDATE sessions SET state = ?, last_update_time = MAX(last_update_time, ?)"
+                        " WHERE app_name = ? AND user_id = ? AND session_id = ?",
+                        (json.dumps(state), update_time, *key),
+                    )
+                for app_name, delta in batch.app_states.items():
+                    self._merge_stored_state(connection, "app_states", (app_name,), delta)
+                for (app_name, user_id), delta in batch.user_states.items():
+                    self._merge_stored_state(connection, "user_states", (app_name, user_id), delta)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _merge_stored_state(
+        connection: sqlite3.Connection, table: str, key: Tuple[str, ...], delta: Dict[str, Any]
+    ) -> None:
+        where = " AND ".join(
+            f"{column} = ?" for column in ("app_name", "user_id")[: len(key)]
+        )
+        row = connection.execute(f"SELECT state FROM {table} WHERE {where}", key).fetchone()
+        state = json.loads(row[0]) if row else {}
+        state.update(delta)
+        columns = ("app_name", "user_id")[: len(key)]
+        connection.execute(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}, state)"
+            f" VALUES ({', '.join('?' * len(key))}, ?)",
+            (*key, json.dumps(state)),
+        )
+
+    def close(self) -> None:
+        """Stop the background writer and flush what it has not written yet."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wake.set()
+        self._writer.join()
+        self.flush()
+        self._keepalive.close()
+
+    # Reads
+
+    def _load_shared_state(self, app_name: str, user_id: str) -> None:
+        """Read the app and user state into memory the first time they are used."""
+        with self._lock:
+            loaded = app_name in self._app_states and (app_name, user_id) in self._user_states
+        if loaded:
+            return
+        with closing(self._connect()) as connection:
+            app_row = connection.execute(
+                "SELECT state FROM app_states WHERE app_name = ?", (app_name,)
+            ).fetchone()
+            user_row = connection.execute(
+                "SELECT state FROM user_states WHERE app_name = ? AND user_id = ?",
+                (app_name, user_id),
+            ).fetchone()
+        with self._lock:
+            self._app_states.setdefault(app_name, json.loads(app_row[0]) if app_row else {})
+            self._user_states.setdefault(
+                (app_name, user_id), json.loads(user_row[0]) if user_row else {}
+            )
+
+    def _with_shared_state(self, session: Session) -> Session:
+        """A copy of `session` with the app and user state merged in."""
+        self._load_shared_state(session.app_name, session.user_id)
+        copied_session = copy.deepcopy(session)
+        with self._lock:
+            app_state = dict(self._app_states[session.app_name])
+            user_state = dict(self._user_states[(session.app_name, session.user_id)])
+        for key, value in app_state.items():
+            copied_session.state[State.APP_PREFIX + key] = value
+        for key, value in user_state.items():
+            copied_session.state[State.USER_PREFIX + key] = value
+        return copied_session
+
+    @staticmethod
+    def _read_events(
+        connection: sqlite3.Connection,
+        key: _SessionKey,
+        after_seq: int = 0,
+        after_timestamp: Optional[float] = None,
+        limit: Optional[int] = None,
+        newest: bool = False,
+    ) -> List[Tuple[int, Event]]:
+        query = (
+            "SELECT seq, event FROM events"
+            " WHERE app_name = ? AND user_id = ? AND session_id = ? AND seq > ?"
+        )
+        params: List[Any] = [*key, after_seq]
+        if after_timestamp is not None:
+            query += " AND timestamp >= ?"
+            params.append(after_timestamp)
+        query += " ORDER BY seq DESC" if newest else " ORDER BY seq"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = connection.execute(query, params).fetchall()
+        if newest:
+            rows.reverse()
+        return [(seq, Event.model_validate_json(event)) for seq, event in rows]
+
+    def _load_session(
+        self, key: _SessionKey, session_config: Optional[GetSessionConfig]
+    ) -> Optional[Session]:
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT state, last_update_time FROM sessions"
+                " WHERE app_name = ? AND user_id = ? AND session_id = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                return None
+            events = self._read_events(
+                connection,
+                key,
+                after_timestamp=session_config.after_timestamp if session_config else None,
+                limit=session_config.num_recent_events if session_config else None,
+                newest=True,
+            )
+        app_name, user_id, session_id = key
+        return Session(
+            app_name=app_name,
+            user_id=user_id,
+            id=session_id,
+            state=json.loads(row[0]),
+            events=[event for _, event in events],
+            last_update_time=row[1],
+        )
+
+    def _stored_update_time(self, key: _SessionKey) -> Optional[float]:
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT last_update_time FROM sessions"
+                " WHERE app_name = ? AND user_id = ? AND session_id = ?",
+                key,
+            ).fetchone()
+        return row[0] if row else None
+
+    def _cache(self, key: _SessionKey, session: Session) -> None:
+        with self._lock:
+            self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.cache_size:
+                self._sessions.popitem(last=False)
+
+    # BaseSessionService
+
+    def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session_id = session_id.strip() if session_id and session_id.strip() else str(uuid.uuid4())
+        app_delta, user_delta, session_state = _split_state(state or {})
+        now = time.time()
+
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+                    (app_name, user_id, session_id, json.dumps(session_state), now, now),
+                )
+                if app_delta:
+                    self._merge_stored_state(connection, "app_states", (app_name,), app_delta)
+                if user_delta:
+                    self._merge_stored_state(
+                        connection, "user_states", (app_name, user_id), user_delta
+                    )
+                connection.execute("COMMIT")
+            except sqlite3.IntegrityError:
+                connection.execute("ROLLBACK")
+                raise ValueError(f"Session {session_id} already exists for user {user_id}.")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        # Re-read the shared state, which now includes this session's part of it.
+        with self._lock:
+            self._app_states.pop(app_name, None)
+            self._user_states.pop((app_name, user_id), None)
+
+        session = Session(
+            app_name=app_name,
+            user_id=user_id,
+            id=session_id,
+            state=session_state,
+            last_update_time=now,
+        )
+        self._cache((app_name, user_id, session_id), session)
+        return self._with_shared_state(session)
+
+    def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        key = (app_name, user_id, session_id)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+
+        stored_update_time = self._stored_update_time(key)
+        if stored_update_time is None:
+            return None
+        if session is None or stored_update_time > session.last_update_time:
+            # Not loaded yet, or another worker process has written to it.
+            self.flush()
+            if config and (config.num_recent_events or config.after_timestamp):
+                # Only the requested page is read; it is not cached as the session.
+                session = self._load_session(key, config)
+                return self._with_shared_state(session) if session else None
+            session = self._load_session(key, None)
+            if session is None:
+                return None
+            self._cache(key, session)
+
+        copied_session = self._with_shared_state(session)
+        if config:
+            if config.num_recent_events:
+                copied_session.events = copied_session.events[-config.num_recent_events :]
+            if config.after_timestamp:
+                copied_session.events = [
+                    event
+                    for event in copied_session.events
+                    if event.timestamp >= config.after_timestamp
+                ]
+        return copied_session
+
+    def list_sessions(self, *, app_name: str, user_id: str) -> ListSessionsResponse:
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT session_id, last_update_time FROM sessions"
+                " WHERE app_name = ? AND user_id = ? ORDER BY last_update_time DESC",
+                (app_name, user_id),
+            ).fetchall()
+        return ListSessionsResponse(
+            sessions=[
+                Session(
+                    app_name=app_name,
+                    user_id=user_id,
+                    id=session_id,
+                    last_update_time=last_update_time,
+                )
+                for session_id, last_update_time in rows
+            ]
+        )
+
+    def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = (app_name, user_id, session_id)
+        self.flush()
+        with self._lock:
+            self._sessions.pop(key, None)
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?", key
+                )
+                connection.execute(
+                    "DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def list_events(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        page_size: int = config.SESSION_EVENT_PAGE_SIZE,
+        page_token: Optional[str] = None,
+    ) -> ListEventsResponse:
+        """List a session's events oldest first, one page at a time.
+
+        Args:
+            app_name: The app of the session.
+            user_id: The user of the session.
+            session_id: The session.
+            page_size: Most events returned.
+            page_token: The `next_page_token` of the previous page.
+
+        Returns:
+            The page of events and the token of the next page, if any.
+        """
+        self.flush()
+        with closing(self._connect()) as connection:
+            rows = self._read_events(
+                connection,
+                (app_name, user_id, session_id),
+                after_seq=int(page_token) if page_token else 0,
+                limit=page_size + 1,
+            )
+        next_page_token = str(rows[page_size - 1][0]) if len(rows) > page_size else None
+        return ListEventsResponse(
+            events=[event for _, event in rows[:page_size]],
+            next_page_token=next_page_token,
+        )
+
+    def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        super().append_event(session=session, event=event)
+        session.last_update_time = event.timestamp
+
+        key = (session.app_name, session.user_id, session.id)
+        delta = event.actions.state_delta if event.actions else {}
+        app_delta, user_delta, session_delta = _split_state(delta or {})
+        with self._lock:
+            stored_session = self._sessions.get(key)
+            if stored_session is not None and stored_session is not session:
+                super().append_event(session=stored_session, event=event)
+                stored_session.last_update_time = event.timestamp
+                for state_key in delta or {}:
+                    if state_key.startswith((State.APP_PREFIX, State.USER_PREFIX)):
+                        stored_session.state.pop(state_key, None)
+            if key[0] in self._app_states:
+                self._app_states[key[0]].update(app_delta)
+            if key[:2] in self._user_states:
+                self._user_states[key[:2]].update(user_delta)
+
+            pending = self._pending
+            pending.events.append((key, event))
+            pending.update_times[key] = event.timestamp
+            if session_delta:
+                pending.session_states.setdefault(key, {}).update(session_delta)
+            if app_delta:
+                pending.app_states.setdefault(key[0], {}).update(app_delta)
+            if user_delta:
+                pending.user_states.setdefault(key[:2], {}).update(user_delta)
+        self._wake.set()
+        return event
@@ -1,13 +1,34 @@
+import asyncio
+import time
+from dataclasses import asdict
+
 from google.adk.tools import ToolContext
 from google.adk.tools.agent_tool import AgentTool
 
 from MarketingAgent.assistants.editing.agent import image_editing_agent
+from MarketingAgent.assistants.gallery import CHANNEL_STATE_KEY
+from MarketingAgent.assistants.gallery import asset_gallery
 from MarketingAgent.assistants.generation.agent import image_generation_agent
+from MarketingAgent.copy_cache import BRIEF_STATE_KEY
+from MarketingAgent.copy_cache import AdCopyBrief
+from MarketingAgent.jobs import job_queue
+from MarketingAgent.ledger import UNSCOPED
+from MarketingAgent.ledger import current_scope
+from MarketingAgent.ledger import ledger
+from MarketingAgent.parallel import output_state_key
+from MarketingAgent.progress import ProgressStage
+from MarketingAgent.progress import emit_progress
+
+
+# Appended to sub-agent requests when the user wants to keep working meanwhile.
+BACKGROUND_REQUEST = " Run it in the background and report the job id."
 
 
 async def call_image_generation_agent(
     tool_context: ToolContext,
     prompt: str,
+    background: bool = False,
+    channel: str = "",
 ):
     """Tool to call the image generation agent.
 
@@ -17,20 +38,30 @@ async def call_image_generation_agent(
     Args:
         tool_context: The tool execution context with artifact service access.
         prompt: The text prompt for image generation.
+        background: When True, the image is generated as a background job and
+            a job id is returned right away.
+        channel: The marketing channel the image is for, e.g. "social",
+            "banner" or "email", so it can be found by channel later.
 
 
     Returns:
         The output from the image generation agent, including artifact metadata.
     """
     agent_tool = AgentTool(agent=image_generation_agent)
+    if hasattr(tool_context, "state"):
+        tool_context.state[CHANNEL_STATE_KEY] = channel
 
+    request = prompt + BACKGROUND_REQUEST if background else prompt
+    emit_progress("call_image_generation_agent", ProgressStage.AGENT_STARTED, request=request)
     generation_output = await agent_tool.run_async(
-        args={"request": prompt}, tool_context=tool_context
+        args={"request": request}, tool_context=tool_context
     )
+    emit_progress("call_image_generation_agent", ProgressStage.AGENT_FINISHED)
 
-    # Store the output in the context state for reference
+    # Store the output in the context state for reference, under a key of this call's own
     if hasattr(tool_context, "state"):
-        tool_context.state["image_generation_output"] = generation_output
+        key = output_state_key("image_generation_output", tool_context.function_call_id)
+        tool_context.state[key] = generation_output
 
     return generation_output
 
@@ -39,6 +70,8 @@ async def call_image_editing_agent(
     tool_context: ToolContext,
     image_filename: str,
     prompt: str,
+    background: bool = False,
+    channel: str = "",
 ):
     """Tool to call the image editing agent.
 
@@ -49,21 +82,170 @@ async def call_image_editing_agent(
         tool_context: The tool execution context with artifact service access.
         image_filename: The filename of the image to edit.
         prompt: The text prompt describing the desired edit.
+        background: When True, the edit runs as a background job and a job id
+            is returned right away.
+        channel: The marketing channel the edited image is for, e.g. "social",
+            "banner" or "email", so it can be found by channel later.
 
     Returns:
         The output from the image editing agent, including artifact metadata.
     """
     agent_tool = AgentTool(agent=image_editing_agent)
+    if hasattr(tool_context, "state"):
+        tool_context.state[CHANNEL_STATE_KEY] = channel
 
     # Format a request string with all the parameters
     request = f"Edit image '{image_filename}' with the following prompt: {prompt}."
+    if background:
+        request += BACKGROUND_REQUEST
 
+    emit_progress("call_image_editing_agent", ProgressStage.AGENT_STARTED, request=request)
     editing_output = await agent_tool.run_async(
         args={"request": request}, tool_context=tool_context
     )
+    emit_progress("call_image_editing_agent", ProgressStage.AGENT_FINISHED)
 
-    # Store the output in the context state for reference
+    # Store the output in the context state for reference, under a key of this call's own
     if hasattr(tool_context, "state"):
-        tool_context.state["image_editing_output"] = editing_output
+        key = output_state_key("image_editing_output", tool_context.function_call_id)
+        tool_context.state[key] = editing_output
 
     return editing_output
+
+
+def get_usage_summary(tool_context: ToolContext):
+    """Tool to report token, image and cost usage for the current session and tenant.
+
+    Args:
+        tool_context: The tool execution context.
+
+    Returns:
+        The accumulated usage of this session and of its tenant.
+    """
+    scope = current_scope.get()
+    if scope is None:
+        return {"success": False, "error": "No usage has been recorded yet"}
+
+    return {
+        "session_id": scope.session_id,
+        "session_usage": ledger.session_summary(scope.session_id),
+        "tenant_id": scope.tenant_id,
+        "tenant_usage": ledger.tenant_summary(scope.tenant_id),
+        "success": True,
+    }
+
+
+async def search_assets(
+    tool_context: ToolContext,
+    query: str,
+    channel: str = "",
+    since_days: int = 0,
+    limit: int = 5,
+):
+    """Tool to find images made earlier for this tenant, e.g. "the beach image from last week".
+
+    Searches the prompts, enhanced prompts, channels and edit history of every
+    generated and edited image. Reuse a match with reuse_image instead of
+    generating a new image.
+
+    Args:
+        tool_context: The tool execution context.
+        query: Words describing the image.
+        channel: Only images made for this channel, e.g. "social".
+        since_days: Only images made in the last this many days; 0 for any time.
+        limit: Maximum number of images to return.
+
+    Returns:
+        The matching images, best first, with their node ids and artifact filenames.
+    """
+    scope = current_scope.get()
+    since = time.time() - since_days * 86400 if since_days > 0 else None
+    try:
+        # The first search after a restart may index the prompt log.
+        assets = await asyncio.to_thread(
+            asset_gallery.search,
+            query,
+            tenant_id=scope.tenant_id if scope else UNSCOPED,
+            channel=channel,
+            since=since,
+            limit=max(1, min(limit, 20)),
+        )
+    except Exception as e:
+        print(f"Error searching the asset gallery: {e}")
+        return {"query": query, "success": False, "error": f"Search failed: {str(e)}"}
+
+    return {
+        "query": query,
+        "assets": [asset.to_dict() for asset in assets],
+        "message": (
+            "Offer these to the user; call reuse_image with a node_id to use one."
+            if assets
+            else "No matching images; offer to generate one."
+        ),
+        "success": True,
+    }
+
+
+def start_ad_copy(
+    tool_context: ToolContext,
+    product: str,
+    audience: str,
+    promotion: str = "",
+    ad_format: str = "",
+    regenerate: bool = False,
+):
+    """Tool to record the confirmed brief of new ad copy, right before writing it.
+
+    Copy written earlier for the same brief, brand and instructions is
+    answered from the cache instead of being written again.
+
+    Args:
+        tool_context: The tool execution context.
+        product: The product or service.
+        audience: The target audience.
+        promotion: The promotion details; leave empty without one.
+        ad_format: The format, e.g. "banner", "social" or "email"; leave empty if not specified.
+        regenerate: True when the user asks for a new or different version of
+            copy written before, so the cache is bypassed.
+
+    Returns:
+        The brief as recorded.
+    """
+    brief = AdCopyBrief(product, audience, promotion, ad_format).normalized()
+    tool_context.state[BRIEF_STATE_KEY] = {"brief": asdict(brief), "regenerate": regenerate}
+    return {
+        "brief": asdict(brief),
+        "message": "Write the ad copy for this brief now.",
+        "success": True,
+    }
+
+
+async def check_jobs(tool_context: ToolContext, job_id: str = ""):
+    """Tool to report the status and results of background image jobs.
+
+    Args:
+        tool_context: The tool execution context.
+        job_id: A specific job to check; leave empty to list this session's recent jobs.
+
+    Returns:
+        The status, and once finished the result or error, of each job.
+    """
+    scope = current_scope.get()
+    if job_id:
+        job = await asyncio.to_thread(job_queue.store.get, job_id)
+        # Jobs of other sessions are not disclosed, not even that they exist.
+        if job is None or scope is None or (job.app_name, job.user_id, job.session_id) != (
+            scope.app_name,
+            scope.user_id,
+            scope.session_id,
+        ):
+            return {"job_id": job_id, "success": False, "error": "Job not found"}
+        return {"jobs": [job.to_dict()], "success": True}
+
+    if scope is None:
+        return {"jobs": [], "success": True}
+
+    jobs = await asyncio.to_thread(
+        job_queue.store.for_session, scope.app_name, scope.user_id, scope.session_id
+    )
+    return {"jobs": [job.to_dict() for job in jobs], "success": True}